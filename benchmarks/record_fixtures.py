@@ -0,0 +1,81 @@
+"""
+Benchmark Fixture Recorder
+
+This module refreshes the benchmark corpus from the live PubChem API. Every
+record listed in fixtures/manifest.json is downloaded once and stored gzipped
+as fixtures/<kind>/<id>.json.gz; records PubChem answers 404 for are marked
+with "status": 404 in the manifest instead.
+
+The checked-in corpus is synthetic (entries marked "synthetic": true). A
+recorded entry loses that mark, so after a successful run the benchmarks
+measure real payloads.
+
+To add a record to the corpus, list its ID in the manifest and run this
+script again.
+
+Author: Israel Neto
+Date: 2024
+"""
+
+import gzip
+import json
+import os
+import sys
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, ".."))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, "..", "pubchem"))
+
+import requests
+
+from common import http_client
+from compound_pubchem import PUG_VIEW_COMPOUND_URL
+from substance_pubchem import PUG_VIEW_SUBSTANCE_URL
+
+FIXTURES_DIR = os.path.join(BENCHMARKS_DIR, "fixtures")
+MANIFEST_FILE = os.path.join(FIXTURES_DIR, "manifest.json")
+
+URLS = {
+    "compound": PUG_VIEW_COMPOUND_URL,
+    "substance": PUG_VIEW_SUBSTANCE_URL,
+}
+
+def record_fixture(kind, entry):
+    """
+    Downloads one manifest entry and stores its response.
+
+    Args:
+        kind (str): "compound" or "substance"
+        entry (dict): Manifest entry, updated with the response status
+    """
+    fixture_path = os.path.join(FIXTURES_DIR, kind, f"{entry['id']}.json.gz")
+    response = http_client.get(URLS[kind].format(entry["id"]))
+    if response.status_code == 404:
+        entry["status"] = 404
+        entry.pop("synthetic", None)
+        if os.path.exists(fixture_path):
+            os.remove(fixture_path)
+        return
+    response.raise_for_status()
+    entry.pop("status", None)
+    entry.pop("synthetic", None)
+    os.makedirs(os.path.dirname(fixture_path), exist_ok=True)
+    # mtime=0 keeps the file identical when the response did not change
+    with gzip.GzipFile(fixture_path, "wb", mtime=0) as fixture:
+        fixture.write(response.content)
+
+if __name__ == "__main__":
+    with open(MANIFEST_FILE) as manifest_file:
+        manifest = json.load(manifest_file)
+
+    for kind, entries in manifest.items():
+        for entry in entries:
+            try:
+                record_fixture(kind, entry)
+                print(f"Recorded {kind} {entry['id']} (status {entry.get('status', 200)})")
+            except requests.exceptions.RequestException as e:
+                print(f"Error recording {kind} {entry['id']}: {e}")
+
+    with open(MANIFEST_FILE, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=4)
+        manifest_file.write("\n")
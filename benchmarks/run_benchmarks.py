@@ -0,0 +1,328 @@
+"""
+Offline Benchmark Suite
+
+This module measures the throughput of the scraper's CPU-bound stages on the
+PUG View corpus in benchmarks/fixtures, without touching the network.
+
+The checked-in corpus is synthetic: PUG View shaped records with placeholder
+titles, text and references, marked "synthetic" in the manifest. It is meant
+for comparing runs against each other (--compare), not for absolute figures,
+since its payloads are smaller and more uniform than real records. Running
+record_fixtures.py replaces it with real responses. The results note how many
+synthetic records were used.
+
+Each stage is timed separately:
+
+- load_record: decoding a response and dropping its references and unused sections
+- remove_references: in-place reference pruning of a decoded record
+- transform: compound / substance transform of a loaded record
+- serialize_compact / serialize_pretty: encoding of transformed records
+- pipeline: run_pipeline end to end (replayed fetch, transform, journal,
+  JSON Lines and JSON array writes), 404s included
+
+Every benchmark reports records/sec (best of --repeat runs) and the peak
+memory allocated during one run. Results can be saved and compared against
+a previous run, which fails when a stage regressed.
+
+Usage:
+    python run_benchmarks.py
+    python run_benchmarks.py --save baseline.json
+    python run_benchmarks.py --compare baseline.json --tolerance 0.2
+
+Features:
+- Checked-in synthetic corpus of tiny, typical and large records, plus 404s
+  (re-recordable from PubChem)
+- Per-stage records/sec and peak memory (tracemalloc)
+- JSON results and regression check against a baseline
+
+Author: Israel Neto
+Date: 2024
+"""
+
+import argparse
+import functools
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, ".."))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, "..", "pubchem"))
+
+from common import json_backend
+from common.pipeline import run_pipeline
+from compound_pubchem import COMPOUND_SCOPED_HEADINGS, transform_compound
+from pug_view import load_record, remove_references
+from substance_pubchem import SUBSTANCE_HEADINGS, transform_substance
+
+FIXTURES_DIR = os.path.join(BENCHMARKS_DIR, "fixtures")
+
+DEFAULT_REPEAT = 20
+
+# Allowed relative drop of records/sec (or growth of peak memory) before
+# --compare reports a regression
+DEFAULT_TOLERANCE = 0.2
+
+# Headings kept when loading, and transform, of every record kind
+KINDS = {
+    "compound": (COMPOUND_SCOPED_HEADINGS, transform_compound),
+    "substance": (SUBSTANCE_HEADINGS, transform_substance),
+}
+
+class Corpus:
+    """
+    Fixture responses of one record kind.
+
+    Args:
+        kind (str): "compound" or "substance"
+        entries (list): Manifest entries of the kind
+    """
+
+    def __init__(self, kind, entries):
+        self.kind = kind
+        self.headings, self.transform = KINDS[kind]
+        self.responses = {}
+        self.synthetic = sum(1 for entry in entries if entry.get("synthetic"))
+        for entry in entries:
+            content = None
+            if entry.get("status", 200) == 200:
+                with gzip.open(os.path.join(FIXTURES_DIR, kind, f"{entry['id']}.json.gz"), "rb") as fixture:
+                    content = fixture.read()
+            self.responses[entry["id"]] = content
+
+    def found(self):
+        """
+        Returns the (ID, response body) pairs of the records that exist.
+        """
+        return [(item_id, content) for item_id, content in self.responses.items() if content is not None]
+
+    def fetch(self, item_id):
+        """
+        Replays the fetch of a record, like fetch_compound / fetch_substance.
+
+        Returns:
+            dict: Loaded record, or {"error": message} for a 404 entry
+        """
+        content = self.responses[item_id]
+        if content is None:
+            return {"error": "404 Client Error: Not Found"}
+        return load_record(content, self.headings)
+
+def load_corpus():
+    """
+    Loads the fixture corpus listed in fixtures/manifest.json.
+
+    Returns:
+        list: One Corpus per record kind
+    """
+    with open(os.path.join(FIXTURES_DIR, "manifest.json")) as manifest_file:
+        manifest = json.load(manifest_file)
+    return [Corpus(kind, entries) for kind, entries in manifest.items()]
+
+# Each benchmark receives a Corpus and a scratch directory for its output
+# files, and returns (records per run, prepare).
+# prepare() builds the input of one run, untimed, and returns the function
+# that is timed.
+
+def _reuse(run):
+    return lambda: run
+
+def bench_load_record(corpus, scratch_dir):
+    responses = [content for _, content in corpus.found()]
+
+    def run():
+        for content in responses:
+            load_record(content, corpus.headings)
+    return len(responses), _reuse(run)
+
+def bench_remove_references(corpus, scratch_dir):
+    responses = [content for _, content in corpus.found()]
+
+    def prepare():
+        # Pruning works in place, so every run gets freshly decoded documents
+        documents = [json_backend.loads(content) for content in responses]
+
+        def run():
+            for document in documents:
+                remove_references(document)
+        return run
+    return len(responses), prepare
+
+def bench_transform(corpus, scratch_dir):
+    records = [(item_id, corpus.fetch(item_id)) for item_id, _ in corpus.found()]
+
+    def run():
+        for item_id, data in records:
+            corpus.transform(item_id, data, corpus.kind)
+    return len(records), _reuse(run)
+
+def _transformed(corpus):
+    return [corpus.transform(item_id, corpus.fetch(item_id), corpus.kind) for item_id, _ in corpus.found()]
+
+def bench_serialize_compact(corpus, scratch_dir):
+    records = _transformed(corpus)
+
+    def run():
+        for record in records:
+            json_backend.dumps(record)
+    return len(records), _reuse(run)
+
+def bench_serialize_pretty(corpus, scratch_dir):
+    records = _transformed(corpus)
+
+    def run():
+        for record in records:
+            json_backend.dumps_pretty(record)
+    return len(records), _reuse(run)
+
+def bench_pipeline(corpus, scratch_dir):
+    output_file = os.path.join(scratch_dir, f"{corpus.kind}.json")
+    transform_one = functools.partial(corpus.transform, source_type=corpus.kind)
+
+    def run():
+        run_pipeline(list(corpus.responses), corpus.fetch, transform_one, output_file)
+    return len(corpus.responses), _reuse(run)
+
+BENCHMARKS = [
+    ("load_record", bench_load_record),
+    ("remove_references", bench_remove_references),
+    ("transform", bench_transform),
+    ("serialize_compact", bench_serialize_compact),
+    ("serialize_pretty", bench_serialize_pretty),
+    ("pipeline", bench_pipeline),
+]
+
+def measure(setup, corpus, repeat, scratch_dir):
+    """
+    Times a benchmark and measures its peak memory.
+
+    Args:
+        setup (callable): Benchmark function from BENCHMARKS
+        corpus (Corpus): Records to run it on
+        repeat (int): Number of timed runs
+        scratch_dir (str): Directory for the benchmark's output files
+
+    Returns:
+        dict: records, records_per_sec (best run) and peak_memory_kb
+    """
+    records, prepare = setup(corpus, scratch_dir)
+
+    best = None
+    for _ in range(repeat):
+        timed = prepare()
+        started = time.perf_counter()
+        timed()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    # Measured apart from the timings, which tracemalloc slows down
+    timed = prepare()
+    tracemalloc.start()
+    try:
+        timed()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "records": records,
+        "records_per_sec": round(records / best, 1) if best else float("inf"),
+        "peak_memory_kb": round(peak / 1024, 1),
+    }
+
+def run_benchmarks(repeat=DEFAULT_REPEAT, names=None):
+    """
+    Runs every benchmark on every record kind.
+
+    Args:
+        repeat (int): Number of timed runs per benchmark
+        names (list): Only run these benchmarks (None runs all)
+
+    Returns:
+        dict: {"<benchmark>/<kind>": measurements}, plus the JSON backend in use
+        and the number of synthetic fixture records
+    """
+    results = {}
+    corpora = load_corpus()
+    with tempfile.TemporaryDirectory(prefix="benchmark_") as scratch_dir:
+        for corpus in corpora:
+            for name, setup in BENCHMARKS:
+                if names and name not in names:
+                    continue
+                results[f"{name}/{corpus.kind}"] = measure(setup, corpus, repeat, scratch_dir)
+    return {"json_backend": json_backend.BACKEND, "synthetic_fixtures": sum(corpus.synthetic for corpus in corpora),
+            "results": results}
+
+def print_results(report):
+    """
+    Prints a results table.
+
+    Args:
+        report (dict): Report returned by run_benchmarks
+    """
+    print(f"JSON backend: {report['json_backend']}")
+    if report.get("synthetic_fixtures"):
+        print(f"Note: {report['synthetic_fixtures']} fixture records are synthetic; compare runs with each other, "
+              f"these figures do not represent real PubChem payloads (see record_fixtures.py)")
+    print(f"{'benchmark':<30} {'records':>8} {'records/sec':>14} {'peak memory (KB)':>18}")
+    for name, result in report["results"].items():
+        print(f"{name:<30} {result['records']:>8} {result['records_per_sec']:>14,.1f} "
+              f"{result['peak_memory_kb']:>18,.1f}")
+
+def compare(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Lists the benchmarks that regressed against a baseline report.
+
+    Args:
+        report (dict): Current report
+        baseline (dict): Previous report, e.g. from --save
+        tolerance (float): Allowed relative drop of records/sec or growth of
+            peak memory
+
+    Returns:
+        list: Regression messages (empty if none)
+    """
+    regressions = []
+    for name, result in report["results"].items():
+        previous = baseline["results"].get(name)
+        if previous is None:
+            continue
+        if result["records_per_sec"] < previous["records_per_sec"] * (1 - tolerance):
+            regressions.append(f"{name}: {result['records_per_sec']:,.1f} records/sec, "
+                               f"was {previous['records_per_sec']:,.1f}")
+        if result["peak_memory_kb"] > previous["peak_memory_kb"] * (1 + tolerance):
+            regressions.append(f"{name}: {result['peak_memory_kb']:,.1f} KB peak memory, "
+                               f"was {previous['peak_memory_kb']:,.1f}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the scraper stages on the fixture corpus.")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="timed runs per benchmark")
+    parser.add_argument("--only", action="append", choices=[name for name, _ in BENCHMARKS],
+                        help="only run this benchmark (repeatable)")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline results file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed relative slowdown or memory growth (default 0.2)")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.repeat, args.only)
+    print_results(report)
+
+    if args.save:
+        with open(args.save, "w") as results_file:
+            json.dump(report, results_file, indent=4)
+        print(f"Results saved to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(report, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions")
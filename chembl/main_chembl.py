@@ -1,27 +1,132 @@
-import requests
-import json
+"""
+ChEMBL Data Processing
 
-def fetch_chembl_data():
-    url = "https://www.ebi.ac.uk/chembl/interface_api/es_proxy/es_data/get_es_document/chembl_molecule/CHEMBL4443036?source=_metadata.compound_generated.image_file%2Cmolecule_structures"
+This module runs the bulk ChEMBL molecule stage: either a list of ChEMBL IDs,
+fetched concurrently, or the whole molecule listing, paged through in large
+pages. Molecules are normalized into the PubChem compound layout and saved
+to chembl_data.jsonl / chembl_data.json.
 
-    try:
-        response = requests.get(url)
+Usage:
+    python main_chembl.py CHEMBL25 CHEMBL192
+    python main_chembl.py --ids-file chembl_ids.txt
+    python main_chembl.py --listing --max-phase 4
+    python main_chembl.py --listing --merge-index ../molecules_merge_index.sqlite
+    python main_chembl.py --listing --mongo-uri mongodb://localhost:27017
+    python main_chembl.py --listing --metrics-file chembl.prom
 
-        if response.status_code == 200:
-            try:
-                data = response.json()
+Author: Israel Neto
+Date: 2024
+"""
 
-                with open("chembl_data.json", "w") as json_file:
-                    json.dump(data, json_file, indent=4)
+import argparse
+import os
+import sys
 
-                print("Os dados foram salvos em 'chembl_data.json'.")
-            except json.JSONDecodeError:
-                print("Erro ao decodificar JSON. Resposta bruta:")
-                print(response.text)
-        else:
-            print(f"Erro na requisição. Código de status: {response.status_code}")
-    except requests.RequestException as e:
-        print(f"Ocorreu um erro ao acessar a API: {e}")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from common import metrics, mongo_loader
+from common.fetch_engine import DEFAULT_MAX_CONCURRENCY
+from common.merge_index import DEFAULT_MERGE_INDEX_FILE, MergeIndex
+from common.pipeline import jsonl_path
+from common.response_cache import ResponseCache
+from molecule_chembl import MAX_PAGE_SIZE, process_molecule_ids, process_molecule_listing
+
+DEFAULT_CHEMBL_IDS = ["CHEMBL4443036"]
+
+def fetch_chembl_data(chembl_ids=None, output_file="chembl_data.json", cache=None, compact=False, listing=False,
+                      max_molecules=None, filters=None, max_concurrency=DEFAULT_MAX_CONCURRENCY, resume=False,
+                      merge_index_file=None, merge_index=None):
+    """
+    Fetches ChEMBL molecules and saves them in the compound record layout.
+
+    Args:
+        chembl_ids (list): ChEMBL molecule IDs (defaults to DEFAULT_CHEMBL_IDS)
+        output_file (str): Path to output JSON file; records are streamed to
+            the same path with a .jsonl extension
+        cache (ResponseCache): Optional response cache to read through
+        compact (bool): Write compact JSON instead of the indented format
+        listing (bool): Page through the molecule listing instead of fetching
+            chembl_ids
+        max_molecules (int): Stop the listing after this many molecules
+        filters (dict): ChEMBL REST filters applied to the listing
+        max_concurrency (int): Maximum number of requests in flight at once
+        resume (bool): Continue an interrupted ID list run
+        merge_index_file (str): Add the written molecules to this InChIKey
+            merge index, shared with the PubChem stage (None skips indexing)
+        merge_index (MergeIndex): Already open merge index to add to instead,
+            e.g. one shared with PubChem stages running at the same time; left
+            open
+
+    Returns:
+        dict: Counts returned by the molecule stage
+    """
+    owned_index = merge_index is None and merge_index_file is not None
+    if owned_index:
+        merge_index = MergeIndex(merge_index_file)
+    if listing:
+        counts = process_molecule_listing(output_file, max_molecules=max_molecules, filters=filters,
+                                          max_concurrency=max_concurrency, cache=cache, compact=compact,
+                                          merge_index=merge_index)
+    else:
+        counts = process_molecule_ids(chembl_ids or DEFAULT_CHEMBL_IDS, output_file, max_concurrency=max_concurrency,
+                                      cache=cache, resume=resume, compact=compact, merge_index=merge_index)
+    if owned_index:
+        merge_index.close()
+    print(f"Os dados foram salvos em '{output_file}'.")
+    return counts
+
+def read_ids_file(path):
+    """
+    Reads ChEMBL IDs from a file, one per line (blank lines are ignored).
+
+    Args:
+        path (str): ID file
+
+    Returns:
+        list: ChEMBL IDs
+    """
+    with open(path) as ids_file:
+        return [line.strip() for line in ids_file if line.strip()]
 
 if __name__ == "__main__":
-    fetch_chembl_data()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Fetch ChEMBL molecules in the compound record layout.")
+    parser.add_argument("ids", nargs="*", help="ChEMBL molecule IDs")
+    parser.add_argument("--ids-file", help="file with one ChEMBL ID per line")
+    parser.add_argument("--listing", action="store_true",
+                        help=f"page through the whole molecule listing ({MAX_PAGE_SIZE} molecules per request)")
+    parser.add_argument("--max-molecules", type=int, help="stop the listing after this many molecules")
+    parser.add_argument("--max-phase", type=int, help="only list molecules with this maximum clinical phase")
+    parser.add_argument("--max-concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY,
+                        help="requests in flight at once")
+    parser.add_argument("--output", default="chembl_data.json", help="output JSON file")
+    parser.add_argument("--compact", action="store_true", help="write compact JSON instead of the indented format")
+    parser.add_argument("--resume", action="store_true", help="continue an interrupted ID list run")
+    parser.add_argument("--merge-index", nargs="?", const=DEFAULT_MERGE_INDEX_FILE, metavar="PATH",
+                        help="add the molecules to the InChIKey merge index shared with PubChem "
+                             f"(default path: {DEFAULT_MERGE_INDEX_FILE})")
+    parser.add_argument("--mongo-uri", metavar="URI",
+                        help="upsert the molecules into DrugXpert.molecules on this MongoDB server")
+    parser.add_argument("--metrics-file", metavar="PATH",
+                        help="write Prometheus metrics to this textfile (name it *.prom)")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="serve Prometheus metrics on http://localhost:PORT/metrics during the run")
+    args = parser.parse_args()
+    if args.metrics_port is not None:
+        metrics.start_http_server(args.metrics_port)
+
+    chembl_ids = list(args.ids)
+    if args.ids_file:
+        chembl_ids.extend(read_ids_file(args.ids_file))
+    filters = {"max_phase": args.max_phase} if args.max_phase is not None else None
+    fetch_chembl_data(chembl_ids, args.output, cache=ResponseCache(), compact=args.compact, listing=args.listing,
+                      max_molecules=args.max_molecules, filters=filters, max_concurrency=args.max_concurrency,
+                      resume=args.resume, merge_index_file=args.merge_index)
+    if args.mongo_uri is not None:
+        source = jsonl_path(args.output)
+        counts = mongo_loader.load_jsonl(source, mongo_loader.get_collection(args.mongo_uri))
+        print(f"Loaded {source} into MongoDB: {counts['inserted']} inserted, "
+              f"{counts['updated']} updated, {counts['unchanged']} unchanged, {counts['failed']} failed")
+    metrics.print_summary()
+    if args.metrics_file is not None:
+        metrics.write_textfile(args.metrics_file)
+        print(f"Metrics written to {args.metrics_file}")
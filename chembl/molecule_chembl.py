@@ -0,0 +1,378 @@
+"""
+ChEMBL Molecule Processor
+
+This module fetches molecules from ChEMBL in bulk and normalizes them into the
+compound record layout used for PubChem, so both sources are written,
+exported and loaded into MongoDB the same way.
+
+Molecules are fetched either by ChEMBL ID, concurrently and resumably through
+the streaming pipeline, or by paging through the ChEMBL molecule listing in
+pages of up to 1000 molecules, several pages in flight at once. Both request
+types project only the fields the transform reads.
+
+Features:
+- ID list mode: concurrent per-molecule requests with a `source` projection
+- Listing mode: concurrent large pages with an `only` projection and filters
+- Normalization into the PubChem compound layout
+- JSON Lines output, optional JSON array, compact mode
+
+Author: Israel Neto
+Date: 2024
+"""
+
+import functools
+import itertools
+import os
+import sys
+from urllib.parse import quote, urlencode
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from common import http_client, json_backend, metrics
+from common.fetch_engine import DEFAULT_MAX_CONCURRENCY, iter_fetch
+from common.pipeline import jsonl_path, record_encoder, run_pipeline, write_compact_json_array, write_json_array
+
+CHEMBL_DOCUMENT_URL = "https://www.ebi.ac.uk/chembl/interface_api/es_proxy/es_data/get_es_document/chembl_molecule/{}"
+CHEMBL_MOLECULE_LIST_URL = "https://www.ebi.ac.uk/chembl/api/data/molecule.json"
+
+# Largest page the ChEMBL REST API serves
+MAX_PAGE_SIZE = 1000
+
+# Fields the transform reads, as document paths for the `source` projection
+SOURCE_FIELDS = [
+    "molecule_chembl_id",
+    "pref_name",
+    "max_phase",
+    "chirality",
+    "molecule_structures.canonical_smiles",
+    "molecule_structures.standard_inchi",
+    "molecule_structures.standard_inchi_key",
+    "molecule_properties",
+    "molecule_synonyms",
+]
+
+# The listing's `only` projection takes top-level fields
+LISTING_FIELDS = list(dict.fromkeys(field.split(".")[0] for field in SOURCE_FIELDS))
+
+def document_url(chembl_id):
+    """
+    Builds the URL of a molecule document, projected to SOURCE_FIELDS.
+
+    Args:
+        chembl_id (str): ChEMBL molecule ID, e.g. "CHEMBL25"
+
+    Returns:
+        str: Document URL
+    """
+    return CHEMBL_DOCUMENT_URL.format(chembl_id) + "?source=" + quote(",".join(SOURCE_FIELDS), safe="")
+
+def listing_url(offset, page_size=MAX_PAGE_SIZE, filters=None):
+    """
+    Builds the URL of one page of the molecule listing, projected to LISTING_FIELDS.
+
+    Args:
+        offset (int): Index of the first molecule of the page
+        page_size (int): Molecules per page (at most MAX_PAGE_SIZE)
+        filters (dict): Extra ChEMBL REST filters, e.g. {"max_phase": 4}
+
+    Returns:
+        str: Page URL
+    """
+    params = {"limit": page_size, "offset": offset, "only": ",".join(LISTING_FIELDS)}
+    params.update(filters or {})
+    return f"{CHEMBL_MOLECULE_LIST_URL}?{urlencode(params)}"
+
+def fetch_molecule(chembl_id, cache=None):
+    """
+    Fetches a single molecule document from ChEMBL.
+
+    Args:
+        chembl_id (str): ChEMBL molecule ID
+        cache (ResponseCache): Optional response cache to read through
+
+    Returns:
+        dict: Molecule fields, or {"error": message} if the request failed
+    """
+    try:
+        content = http_client.get_content(document_url(chembl_id), cache=cache)
+        with metrics.time_stage("parse"):
+            document = json_backend.loads(content)
+        if not isinstance(document, dict) or document.get("found") is False or "_source" not in document:
+            raise ValueError("ChEMBL has no molecule with this ID")
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"Error fetching data for molecule {chembl_id}: {e}")
+        return {"error": str(e)}
+    return document["_source"]
+
+def fetch_page(offset, page_size=MAX_PAGE_SIZE, filters=None, cache=None):
+    """
+    Fetches one page of the molecule listing.
+
+    Args:
+        offset (int): Index of the first molecule of the page
+        page_size (int): Molecules per page
+        filters (dict): Extra ChEMBL REST filters
+        cache (ResponseCache): Optional response cache to read through
+
+    Returns:
+        dict: Page with "molecules" and "page_meta", or {"error": message}
+    """
+    try:
+        content = http_client.get_content(listing_url(offset, page_size, filters), cache=cache)
+        with metrics.time_stage("parse"):
+            return json_backend.loads(content)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"Error fetching molecules {offset}-{offset + page_size - 1}: {e}")
+        return {"error": str(e)}
+
+def _value(value):
+    return "Unknown" if value is None or value == "" else value
+
+def _number(value):
+    """
+    Converts a ChEMBL numeric string ("63.60", "3") to a number, like the
+    numeric PubChem fields.
+    """
+    if value is None or value == "":
+        return "Unknown"
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return value
+    return int(number) if number.is_integer() else number
+
+def transform_molecule(chembl_id, molecule, source_type):
+    """
+    Transforms a ChEMBL molecule into the compound record layout.
+
+    Fields ChEMBL does not provide are "Unknown", as for PubChem records
+    missing them. The record is identified by identifiers.chemblId instead of
+    identifiers.pubChemCID.
+
+    Args:
+        chembl_id (str): ChEMBL molecule ID
+        molecule (dict): Molecule fields returned by fetch_molecule or a listing page
+        source_type (str): Type identifier for the data source
+
+    Returns:
+        dict: Transformed molecule
+    """
+    structures = molecule.get("molecule_structures") or {}
+    properties = molecule.get("molecule_properties") or {}
+    synonyms = [entry.get("molecule_synonym") for entry in molecule.get("molecule_synonyms") or []]
+
+    # Phase 4 means approved somewhere; phases 1-3 are clinical candidates
+    approved = []
+    investigational = []
+    try:
+        max_phase = float(molecule.get("max_phase"))
+    except (TypeError, ValueError):
+        max_phase = None
+    if max_phase == 4:
+        approved.append("ChEMBL")
+    elif max_phase is not None and max_phase >= 1:
+        investigational.append("ChEMBL")
+
+    return {
+        "basicInfo": {
+            "type": source_type,
+            "moleculeName": _value(molecule.get("pref_name")),
+            "recordNumber": chembl_id,
+            "source": "chembl",
+            "drugBankId": "Unknown",
+            "casRegistryNumber": "Unknown",
+            "unii": "Unknown",
+            "chebiId": "Unknown",
+            "description": "Unknown"
+        },
+        "identifiers": {
+            "chemblId": chembl_id,
+            "wikidata": "Unknown",
+            "hmdbID": "Unknown",
+            "lipidMapsID": "Unknown",
+            "nciThesaurusCode": "Unknown",
+            "metabolomicsWorkbenchID": "Unknown",
+            "dssToxID": "Unknown"
+        },
+        "structure": {
+            "smilesStructure": _value(structures.get("canonical_smiles")),
+            "inchiString": _value(structures.get("standard_inchi")),
+            "inchiKey": _value(structures.get("standard_inchi_key")),
+            "molecularFormula": _value(properties.get("full_molformula"))
+        },
+        "physicalProperties": {
+            "molecularWeight": _value(properties.get("full_mwt")),
+            "exactMass": "Unknown",
+            "monoisotopicMass": _value(properties.get("mw_monoisotopic")),
+            "xlogp3": "Unknown",
+            "formalCharge": "Unknown",
+            "complexity": "Unknown",
+            "topologicalPolarSurfaceArea": _number(properties.get("psa")),
+            "heavyAtomCount": _number(properties.get("heavy_atoms")),
+            "meltingPoint": "Unknown",
+            "solubility": "Unknown"
+        },
+        "bondInformation": {
+            "hydrogenBondDonorCount": _number(properties.get("hbd")),
+            "hydrogenBondAcceptorCount": _number(properties.get("hba")),
+            "rotatableBondCount": _number(properties.get("rtb")),
+            "covalentlyBondedUnitCount": "Unknown"
+        },
+        "stereochemistry": {
+            "definedAtomStereocenterCount": "Unknown",
+            "undefinedAtomStereocenterCount": "Unknown",
+            "definedBondStereocenterCount": "Unknown",
+            "undefinedBondStereocenterCount": "Unknown",
+            "isotopeAtomCount": "Unknown",
+            # ChEMBL chirality 0 is a racemic mixture
+            "isRacemic": molecule.get("chirality") == 0
+        },
+        "pharmacology": {
+            "indications": {
+                "text": "Unknown"
+            },
+            "overview": "Unknown",
+            "mechanism": "Unknown",
+            "pharmacodynamics": "Unknown",
+            "absorption": "Unknown",
+            "routeOfElimination": "Unknown",
+            "classification": {
+                "meshPharmacological": []
+            }
+        },
+        "synonyms": list(dict.fromkeys(synonym for synonym in synonyms if synonym)),
+        "spectralData": {
+            "nmr": {
+                "proton": [],
+                "carbon": []
+            },
+            "massSpectrometry": {
+                "precursorMZ": "",
+                "topPeaks": ""
+            }
+        },
+        "biologicalProperties": {
+            "organismPresence": [],
+            "biochemicalFunction": "Unknown"
+        },
+        "commercialAvailability": {
+            "regulatoryStatus": {
+                "approved": approved,
+                "investigational": investigational
+            }
+        },
+        "classification": {},
+        "metadata": {
+            "createDate": "Unknown",
+            "modifyDate": "Unknown",
+            "dataSource": "ChEMBL"
+        }
+    }
+
+def process_molecule_ids(chembl_ids, output_file, source_type="compound", max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                         cache=None, resume=False, json_array=True, compact=False, transform_workers=0,
+                         merge_index=None):
+    """
+    Processes a list of ChEMBL molecules, one request each.
+
+    Args:
+        chembl_ids (iterable): ChEMBL molecule IDs, in output order
+        output_file (str): Path to output JSON file; records are streamed to
+            the same path with a .jsonl extension
+        source_type (str): Type identifier for the data source
+        max_concurrency (int): Maximum number of requests in flight at once
+        cache (ResponseCache): Optional response cache to read through
+        resume (bool): Continue the run journaled in output_file + ".journal"
+        json_array (bool): Also write the records as one JSON array to output_file
+        compact (bool): Write compact JSON instead of the indented format
+        transform_workers (int): Worker processes transforming records in parallel
+        merge_index (MergeIndex): InChIKey merge index the written molecules
+            are added to
+
+    Returns:
+        dict: Counts of written, skipped and failed IDs (see run_pipeline)
+    """
+    fetch_one = functools.partial(fetch_molecule, cache=cache)
+    transform_one = functools.partial(transform_molecule, source_type=source_type)
+    counts = run_pipeline(list(dict.fromkeys(chembl_ids)), fetch_one, transform_one, output_file, max_concurrency,
+                          resume=resume, json_array=json_array, compact=compact,
+                          transform_workers=transform_workers, merge_index=merge_index)
+
+    print(f"{counts['written']} molecules streamed to {jsonl_path(output_file)} ({counts['failed']} failed)")
+    if json_array:
+        print(f"Final molecule data saved to {output_file}")
+    return counts
+
+def process_molecule_listing(output_file, source_type="compound", max_molecules=None, page_size=MAX_PAGE_SIZE,
+                             filters=None, max_concurrency=DEFAULT_MAX_CONCURRENCY, cache=None, json_array=True,
+                             compact=False, merge_index=None):
+    """
+    Processes every molecule of the ChEMBL listing, page by page.
+
+    The first page gives the total count; the remaining pages are then
+    fetched concurrently and written in listing order.
+
+    Args:
+        output_file (str): Path to output JSON file; records are streamed to
+            the same path with a .jsonl extension
+        source_type (str): Type identifier for the data source
+        max_molecules (int): Stop after this many molecules (None processes all)
+        page_size (int): Molecules per request (at most MAX_PAGE_SIZE)
+        filters (dict): Extra ChEMBL REST filters, e.g. {"max_phase": 4}
+        max_concurrency (int): Maximum number of pages in flight at once
+        cache (ResponseCache): Optional response cache to read through
+        json_array (bool): Also write the records as one JSON array to output_file
+        compact (bool): Write compact JSON instead of the indented format
+        merge_index (MergeIndex): InChIKey merge index the written molecules
+            are added to
+
+    Returns:
+        dict: Counts of written molecules and failed pages
+    """
+    page_size = min(page_size, MAX_PAGE_SIZE)
+    counts = {"written": 0, "failed_pages": 0}
+    fetch_one = functools.partial(fetch_page, page_size=page_size, filters=filters, cache=cache)
+    encode = record_encoder(compact)
+
+    first_page = fetch_one(0)
+    if "error" in first_page:
+        counts["failed_pages"] += 1
+        return counts
+    total = first_page["page_meta"]["total_count"]
+    if max_molecules is not None:
+        total = min(total, max_molecules)
+    pages = itertools.chain([(0, first_page)],
+                            iter_fetch(range(page_size, total, page_size), fetch_one, max_concurrency))
+
+    lines_file_path = jsonl_path(output_file)
+    with open(lines_file_path, "wb") as lines_file:
+        for offset, page in pages:
+            if "error" in page:
+                counts["failed_pages"] += 1
+                continue
+            for molecule in page.get("molecules", [])[:total - offset]:
+                chembl_id = molecule.get("molecule_chembl_id")
+                record = transform_molecule(chembl_id, molecule, source_type)
+                line = encode(record) + b"\n"
+                if merge_index is not None:
+                    merge_index.add("chembl", chembl_id, record["structure"]["inchiKey"], lines_file_path,
+                                    lines_file.tell(), len(line))
+                lines_file.write(line)
+                counts["written"] += 1
+                metrics.RECORDS.inc("written")
+    if merge_index is not None:
+        merge_index.commit()
+
+    if json_array:
+        with open(lines_file_path, "rb") as lines_file:
+            if compact:
+                write_compact_json_array(output_file, lines_file)
+            else:
+                write_json_array(output_file, (json_backend.loads(line) for line in lines_file))
+
+    print(f"{counts['written']} molecules streamed to {lines_file_path} ({counts['failed_pages']} pages failed)")
+    if json_array:
+        print(f"Final molecule data saved to {output_file}")
+    return counts
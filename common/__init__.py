@@ -0,0 +1,8 @@
+"""
+Shared Scraper Infrastructure
+
+Helpers used by both the PubChem and ChEMBL scrapers.
+
+Author: Israel Neto
+Date: 2024
+"""
@@ -0,0 +1,104 @@
+"""
+Concurrent Fetch Engine
+
+This module runs the blocking per-ID fetch functions of the scrapers on an
+asyncio event loop so that several requests can be in flight at once.
+
+Features:
+- Configurable cap on in-flight requests
+- Streaming iteration over a bounded window of IDs, in input order
+- Works with any blocking fetch function (requests based)
+- Per-record fetch time recorded in the stage metrics
+- Context variables (e.g. the request lane) carried into the worker threads
+- Errors of any kind raised by a fetch re-raised in the consumer; stopping
+  early or on an error does not wait for the requests in flight
+
+Author: Israel Neto
+Date: 2024
+"""
+
+import asyncio
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from . import metrics
+
+DEFAULT_MAX_CONCURRENCY = 5
+
+# Number of IDs scheduled ahead of the one being yielded by iter_fetch, per
+# request slot. Lets fast requests keep going while a slow one is retried.
+WINDOW_PER_SLOT = 4
+
+class _Raised:
+    """
+    Exception raised by a fetch, carried to the consumer as a result.
+    """
+
+    def __init__(self, error):
+        self.error = error
+
+def _timed_fetch(fetch_one, item_id):
+    try:
+        with metrics.time_stage("fetch"):
+            return fetch_one(item_id)
+    except BaseException as e:
+        # A KeyboardInterrupt or SystemExit would otherwise never reach the
+        # awaiting future, leaving the consumer waiting forever
+        return _Raised(e)
+
+def _submit(loop, executor, fetch_one, item_id):
+    # run_in_executor does not carry context variables over to the worker
+    # thread, so the fetch runs in a copy of the caller's context
+    return loop.run_in_executor(executor, contextvars.copy_context().run, _timed_fetch, fetch_one, item_id)
+
+def iter_fetch(ids, fetch_one, max_concurrency=DEFAULT_MAX_CONCURRENCY, window=None):
+    """
+    Fetches IDs concurrently and yields the results one by one, in input order.
+
+    Only a bounded window of IDs is scheduled at any time, so memory stays flat
+    however long the ID range is. If the consumer stops early or an error is
+    raised, the IDs not started yet are cancelled and the requests in flight
+    are left to finish in the background.
+
+    Args:
+        ids (iterable): IDs to fetch
+        fetch_one (callable): Function receiving an ID and returning its data
+        max_concurrency (int): Maximum number of requests in flight at once
+        window (int): Maximum number of IDs scheduled or buffered ahead of the
+            consumer (defaults to WINDOW_PER_SLOT * max_concurrency)
+
+    Yields:
+        tuple: (ID, fetched data)
+
+    Raises:
+        BaseException: Whatever fetch_one raised, once its ID's turn comes
+    """
+    window = window or WINDOW_PER_SLOT * max_concurrency
+    loop = asyncio.new_event_loop()
+    executor = ThreadPoolExecutor(max_workers=max_concurrency)
+    id_iter = iter(ids)
+    pending = deque()
+
+    def schedule_next():
+        for item_id in id_iter:
+            pending.append((item_id, _submit(loop, executor, fetch_one, item_id)))
+            return
+
+    try:
+        for _ in range(window):
+            schedule_next()
+        while pending:
+            item_id, future = pending.popleft()
+            result = loop.run_until_complete(future)
+            if isinstance(result, _Raised):
+                raise result.error
+            schedule_next()
+            yield item_id, result
+    finally:
+        for _, future in pending:
+            future.cancel()
+        # Nothing is in flight after a full run; otherwise do not wait for
+        # requests (and their retries) whose results nobody will read
+        executor.shutdown(wait=not pending, cancel_futures=True)
+        loop.close()
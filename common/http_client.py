@@ -0,0 +1,233 @@
+"""
+Shared HTTP Client
+
+This module owns the single pooled requests session used by the PubChem and
+ChEMBL scrapers, so connections (and their TLS handshakes) are reused across
+records instead of being opened for every request.
+
+Features:
+- One keep-alive session shared by every scraper
+- Configurable connection pool size
+- Connection reuse statistics
+- Per-host rate limiting and retries with jittered exponential backoff
+- Optional read-through response cache with conditional revalidation
+- Request latency, status, byte, retry and cache metrics
+
+Author: Israel Neto
+Date: 2024
+"""
+
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import metrics
+from .rate_limiter import backoff_delay, get_rate_limiter
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = 60
+MAX_RETRIES = 5
+
+# Statuses PubChem and ChEMBL return for transient conditions ("server busy",
+# throttling, gateway errors) that are worth retrying
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_lock = threading.Lock()
+_session = None
+_pool_size = DEFAULT_POOL_SIZE
+
+def _build_session(pool_size):
+    """
+    Creates a session whose HTTP and HTTPS adapters keep pool_size connections.
+
+    Args:
+        pool_size (int): Maximum number of kept-alive connections per host
+
+    Returns:
+        requests.Session: Configured session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def configure(pool_size=DEFAULT_POOL_SIZE):
+    """
+    Replaces the shared session with one using the given pool size.
+
+    The pool size should be at least the fetch concurrency, otherwise extra
+    connections are opened and discarded after each request.
+
+    Args:
+        pool_size (int): Maximum number of kept-alive connections per host
+    """
+    global _session, _pool_size
+    with _lock:
+        if _session is not None:
+            _session.close()
+        _pool_size = pool_size
+        _session = _build_session(pool_size)
+
+def get_session():
+    """
+    Returns the shared session, creating it on first use.
+
+    Returns:
+        requests.Session: Shared pooled session
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            _session = _build_session(_pool_size)
+        return _session
+
+def _retry_after(response):
+    """
+    Reads a Retry-After header given in seconds.
+
+    Args:
+        response (requests.Response): Server response
+
+    Returns:
+        float: Seconds to wait, or None if the header is absent or not numeric
+    """
+    value = response.headers.get("Retry-After")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def get(url, max_retries=MAX_RETRIES, **kwargs):
+    """
+    Sends a GET request through the shared session and the rate limiter of
+    the URL's host.
+
+    Connection errors, timeouts and transient statuses are retried with
+    jittered exponential backoff. The X-Throttling-Control header of every
+    response is fed back into the limiter of the host that sent it.
+
+    Args:
+        url (str): URL to request
+        max_retries (int): Number of retries after the first attempt
+        **kwargs: Extra arguments forwarded to requests.Session.get
+
+    Returns:
+        requests.Response: Server response (possibly a non-2xx one once
+        retries are exhausted)
+    """
+    kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+    limiter = get_rate_limiter(urlparse(url).hostname)
+    session = get_session()
+    attempt = 0
+    while True:
+        limiter.acquire()
+        started = time.perf_counter()
+        try:
+            response = session.get(url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            metrics.HTTP_REQUESTS.inc("error")
+            if attempt >= max_retries:
+                raise
+            metrics.HTTP_RETRIES.inc(type(e).__name__)
+            time.sleep(backoff_delay(attempt))
+            attempt += 1
+            continue
+        metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started)
+        metrics.HTTP_REQUESTS.inc(response.status_code)
+        metrics.HTTP_RESPONSE_BYTES.inc(amount=len(response.content))
+
+        limiter.observe_throttling(response.headers.get("X-Throttling-Control"))
+        if response.status_code not in RETRY_STATUS_CODES or attempt >= max_retries:
+            return response
+
+        delay = _retry_after(response)
+        if delay is None:
+            delay = backoff_delay(attempt)
+        print(f"Retrying {url} after status {response.status_code} (attempt {attempt + 1}/{max_retries})")
+        metrics.HTTP_RETRIES.inc(response.status_code)
+        time.sleep(delay)
+        attempt += 1
+
+def get_content(url, cache=None, **kwargs):
+    """
+    Returns the body of a successful GET, reading through a response cache.
+
+    Fresh cache entries are returned without touching the network. Stale
+    entries are revalidated with If-None-Match / If-Modified-Since and served
+    again on 304 Not Modified.
+
+    Args:
+        url (str): URL to request
+        cache (ResponseCache): Response cache, or None to always hit the network
+        **kwargs: Extra arguments forwarded to get
+
+    Returns:
+        bytes: Response body
+
+    Raises:
+        requests.exceptions.RequestException: If the request fails or the
+        server answers with an error status
+    """
+    entry = cache.get(url) if cache is not None else None
+    if entry is not None and cache.is_fresh(entry):
+        metrics.CACHE_LOOKUPS.inc("hit")
+        return entry.body
+
+    headers = dict(kwargs.pop("headers", None) or {})
+    if entry is not None:
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+
+    response = get(url, headers=headers, **kwargs)
+    if entry is not None and response.status_code == 304:
+        metrics.CACHE_LOOKUPS.inc("revalidated")
+        cache.refresh(url, entry)
+        return entry.body
+    if cache is not None:
+        metrics.CACHE_LOOKUPS.inc("miss")
+
+    response.raise_for_status()
+    if cache is not None:
+        cache.put(url, response.content, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+    return response.content
+
+def is_not_found(error):
+    """
+    Tells whether a request failed because the resource does not exist.
+
+    Args:
+        error (Exception): Error raised by get_content
+
+    Returns:
+        bool: True for an HTTP 404 answer
+    """
+    return (isinstance(error, requests.exceptions.HTTPError) and error.response is not None
+            and error.response.status_code == 404)
+
+def connection_stats():
+    """
+    Reports how many connections were opened and reused by the shared session.
+
+    Returns:
+        dict: Counts of requests, opened connections and reused connections
+    """
+    session = get_session()
+    requests_sent = 0
+    connections_opened = 0
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            requests_sent += pool.num_requests
+            connections_opened += pool.num_connections
+    return {
+        "requests": requests_sent,
+        "connections_opened": connections_opened,
+        "connections_reused": requests_sent - connections_opened
+    }
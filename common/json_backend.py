@@ -0,0 +1,104 @@
+"""
+JSON Backend
+
+This module decodes API responses and encodes output records with the fastest
+JSON library available. orjson is used when it is installed; otherwise, or
+for documents it rejects, the standard library json module is used.
+
+Features:
+- Optional orjson backend with a stdlib fallback
+- Decoding straight from response bytes
+- Compact (non-indented) UTF-8 encoding
+- Pretty encoding, byte-identical to json.dumps(obj, indent=4)
+- Record objects encoded through their to_dict() method
+
+Author: Israel Neto
+Date: 2024
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Name of the backend in use, "orjson" or "json"
+BACKEND = "json" if orjson is None else "orjson"
+
+def to_serializable(obj):
+    """
+    Converts a record object to the value it is encoded as.
+
+    Used as the encoders' default hook, so records such as CompoundRecord
+    encode exactly like the dicts their to_dict() method returns.
+
+    Args:
+        obj (Any): Value the encoder does not support
+
+    Returns:
+        dict: obj.to_dict()
+
+    Raises:
+        TypeError: If obj has no to_dict method
+    """
+    to_dict = getattr(obj, "to_dict", None)
+    if to_dict is None:
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+    return to_dict()
+
+def loads(data):
+    """
+    Decodes a JSON document.
+
+    Args:
+        data (bytes/str): JSON document
+
+    Returns:
+        Any: Decoded value
+
+    Raises:
+        ValueError: If data is not valid JSON (json.JSONDecodeError)
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # NaN/Infinity and other extensions only the stdlib accepts
+            pass
+    return json.loads(data)
+
+def dumps(obj):
+    """
+    Encodes a value as compact JSON, without indentation or spaces.
+
+    Non-ASCII characters are written as UTF-8 rather than \\u escapes.
+
+    Args:
+        obj (Any): Value to encode
+
+    Returns:
+        bytes: UTF-8 encoded JSON
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=to_serializable)
+        except orjson.JSONEncodeError:
+            # Integers wider than 64 bits and other values orjson refuses
+            pass
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, default=to_serializable).encode("utf-8")
+
+def dumps_pretty(obj):
+    """
+    Encodes a value as indented JSON, exactly like json.dumps(obj, indent=4).
+
+    Always uses the stdlib encoder, since orjson has no 4-space indent and
+    does not escape non-ASCII characters.
+
+    Args:
+        obj (Any): Value to encode
+
+    Returns:
+        str: Indented JSON
+    """
+    return json.dumps(obj, indent=4, default=to_serializable)
@@ -0,0 +1,338 @@
+"""
+Cross-Source Merge Index
+
+This module indexes the compound records written by the PubChem and ChEMBL
+stages by InChIKey, so records of the same molecule can be merged without
+scanning one source for every record of the other.
+
+The index is a SQLite table of (source, record ID) -> (InChIKey, connectivity
+block, output file, offset, length). The pipelines add every record as they
+write it. Records written to an output the next run overwrites (the delta of
+an incremental run) also keep a compressed copy of their line in the index,
+so they stay mergeable after that file is gone. Merging walks the index once
+in key order, reading each group's records from the index or straight from
+their output files, and yields one merged record per group. Groups are
+either full InChIKeys, or the 14-character connectivity block, which groups
+stereoisomers and isotopologues of the same skeleton.
+
+Usage:
+    python -m common.merge_index molecules_index.sqlite merged_molecules.jsonl [--connectivity]
+
+Features:
+- Persistent InChIKey / connectivity index updated while records are written
+- Single ordered pass producing one merged record per molecule
+- Field-wise merge: PubChem values first, "Unknown" fields filled from ChEMBL,
+  lists combined
+- Records of incremental (delta) runs kept across runs
+- Stale entries (output files rewritten since) detected and skipped
+- One index can be shared by stages running in different threads
+
+Author: Israel Neto
+Date: 2024
+"""
+
+import argparse
+import itertools
+import os
+import sqlite3
+import threading
+import zlib
+
+from . import json_backend
+
+# Index shared by the scrapers unless another path is given
+DEFAULT_MERGE_INDEX_FILE = "molecules_merge_index.sqlite"
+
+# Order in which sources take precedence when merging
+SOURCE_PRIORITY = {"pubchem": 0, "chembl": 1}
+
+# Identifier holding the record ID of every source
+RECORD_ID_FIELDS = {"pubchem": "pubChemCID", "chembl": "chemblId"}
+
+# Values a merged field is filled over
+_MISSING = (None, "", "Unknown")
+
+# Index rows fetched at once while walking the groups
+_FETCH_SIZE = 1000
+
+def connectivity_block(inchi_key):
+    """
+    Returns the connectivity (skeleton) block of an InChIKey.
+
+    Args:
+        inchi_key (str): Standard InChIKey, e.g. "BSYNRYMUTXBXSQ-UHFFFAOYSA-N"
+
+    Returns:
+        str: First 14 characters, or None if inchi_key is not an InChIKey
+    """
+    if not isinstance(inchi_key, str) or len(inchi_key) != 27 or inchi_key[14] != "-" or inchi_key[25] != "-":
+        return None
+    return inchi_key[:14]
+
+def record_identity(record):
+    """
+    Returns the source, record ID and InChIKey of a transformed compound record.
+
+    Args:
+        record (dict): Record in the compound layout
+
+    Returns:
+        tuple: (source, record ID as a string, InChIKey), the InChIKey being
+        None if the record has none
+    """
+    source = (record.get("basicInfo") or {}).get("source")
+    record_id = (record.get("identifiers") or {}).get(RECORD_ID_FIELDS.get(source))
+    inchi_key = (record.get("structure") or {}).get("inchiKey")
+    return source, str(record_id), inchi_key if connectivity_block(inchi_key) else None
+
+class MergeIndex:
+    """
+    InChIKey index of the records written by every source.
+
+    The index is thread-safe, so stages running at the same time can share
+    one instance (and one connection) instead of contending for the file.
+
+    Args:
+        path (str): SQLite database file, created if missing
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript(
+            "CREATE TABLE IF NOT EXISTS records (source TEXT, record_id TEXT, inchi_key TEXT, connectivity TEXT, "
+            "file TEXT, offset INTEGER, length INTEGER, PRIMARY KEY (source, record_id));"
+            "CREATE INDEX IF NOT EXISTS records_inchi_key ON records (inchi_key);"
+            "CREATE INDEX IF NOT EXISTS records_connectivity ON records (connectivity);"
+        )
+        columns = [row[1] for row in self._connection.execute("PRAGMA table_info(records)")]
+        if "line" not in columns:
+            # zlib compressed copy of the line, for records whose output file is not kept
+            self._connection.execute("ALTER TABLE records ADD COLUMN line BLOB")
+        self._connection.commit()
+
+    def add(self, source, record_id, inchi_key, jsonl_file, offset, length, line=None):
+        """
+        Indexes a written record, replacing its previous entry. Records without
+        an InChIKey are removed from the index. Saved by the next commit.
+
+        Args:
+            source (str): Record source, e.g. "pubchem" or "chembl"
+            record_id: Record ID within the source
+            inchi_key (str): Standard InChIKey, or None
+            jsonl_file (str): JSON Lines file holding the record
+            offset (int): Offset of the record's line in the file
+            length (int): Length of the line, newline included
+            line (bytes): The line itself, to keep in the index when the output
+                file will be overwritten by the next run (None keeps only its
+                location)
+        """
+        connectivity = connectivity_block(inchi_key)
+        with self._lock:
+            if connectivity is None:
+                self._connection.execute("DELETE FROM records WHERE source = ? AND record_id = ?",
+                                         (source, str(record_id)))
+                return
+            self._connection.execute(
+                "INSERT OR REPLACE INTO records (source, record_id, inchi_key, connectivity, file, offset, length, "
+                "line) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (source, str(record_id), inchi_key, connectivity, os.path.abspath(jsonl_file), offset, length,
+                 zlib.compress(line) if line is not None else None),
+            )
+
+    def add_line(self, record_id, line, jsonl_file, offset, keep_line=False):
+        """
+        Indexes a record from its encoded output line.
+
+        Args:
+            record_id: Record ID within its source
+            line (bytes): Encoded record, newline included
+            jsonl_file (str): JSON Lines file the line was written to
+            offset (int): Offset of the line in the file
+            keep_line (bool): Keep a copy of the line in the index, for output
+                files the next run overwrites
+        """
+        source, _, inchi_key = record_identity(json_backend.loads(line))
+        if source is not None:
+            self.add(source, record_id, inchi_key, jsonl_file, offset, len(line), line if keep_line else None)
+
+    def commit(self):
+        """
+        Saves the entries added since the last commit.
+        """
+        with self._lock:
+            self._connection.commit()
+
+    def close(self):
+        """
+        Commits and closes the index.
+        """
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
+
+    def counts(self):
+        """
+        Counts the indexed records per source.
+
+        Returns:
+            dict: {source: records}
+        """
+        with self._lock:
+            return dict(self._connection.execute("SELECT source, COUNT(*) FROM records GROUP BY source"))
+
+    def iter_groups(self, connectivity=False):
+        """
+        Walks the index once in key order, grouping records of one molecule.
+
+        Args:
+            connectivity (bool): Group on the connectivity block instead of
+                the full InChIKey
+
+        Yields:
+            tuple: (group key, entries sorted by source priority), each entry
+            being (source, record ID, InChIKey, file, offset, length, kept
+            line or None)
+        """
+        column = "connectivity" if connectivity else "inchi_key"
+        with self._lock:
+            cursor = self._connection.execute(
+                f"SELECT {column}, source, record_id, inchi_key, file, offset, length, line FROM records "
+                f"ORDER BY {column}"
+            )
+
+        def rows():
+            # The lock is only held while fetching, so writers are not blocked
+            # for the whole walk
+            while True:
+                with self._lock:
+                    batch = cursor.fetchmany(_FETCH_SIZE)
+                if not batch:
+                    return
+                yield from batch
+
+        for key, group in itertools.groupby(rows(), key=lambda row: row[0]):
+            entries = sorted((row[1:] for row in group),
+                             key=lambda entry: (SOURCE_PRIORITY.get(entry[0], len(SOURCE_PRIORITY)),
+                                                len(entry[1]), entry[1]))
+            yield key, entries
+
+    def merged_records(self, connectivity=False):
+        """
+        Yields one merged record per molecule, in a single pass over the index.
+
+        Each record is read from its kept line, or from its output file at the
+        indexed offset. Entries whose line no longer holds the indexed record
+        (the file was rewritten since) are skipped.
+
+        Args:
+            connectivity (bool): Merge on the connectivity block instead of
+                the full InChIKey
+
+        Yields:
+            dict: Merged record (see merge_records)
+        """
+        files = {}
+        try:
+            for key, entries in self.iter_groups(connectivity):
+                records = []
+                for source, record_id, inchi_key, jsonl_file, offset, length, line in entries:
+                    if line is not None:
+                        record = json_backend.loads(zlib.decompress(line))
+                    else:
+                        record = _read_record(files, jsonl_file, offset, length)
+                    if record is None or record_identity(record) != (source, record_id, inchi_key):
+                        print(f"Skipping stale merge index entry {source} {record_id}")
+                        continue
+                    records.append((source, record_id, record))
+                if records:
+                    yield merge_records(key, records)
+        finally:
+            for lines_file in files.values():
+                lines_file.close()
+
+def _read_record(files, jsonl_file, offset, length):
+    lines_file = files.get(jsonl_file)
+    if lines_file is None:
+        try:
+            lines_file = files[jsonl_file] = open(jsonl_file, "rb")
+        except OSError:
+            return None
+    lines_file.seek(offset)
+    try:
+        return json_backend.loads(lines_file.read(length))
+    except ValueError:
+        return None
+
+def _fill(target, other):
+    """
+    Fills the missing fields of target from other, recursively. Lists are
+    combined, keeping target's items first and dropping duplicates.
+    """
+    for key, value in other.items():
+        current = target.get(key)
+        if key not in target or current in _MISSING:
+            target[key] = value
+        elif type(current) is dict and type(value) is dict:
+            _fill(current, value)
+        elif type(current) is list and type(value) is list:
+            current.extend(item for item in value if item not in current)
+
+def merge_records(key, records):
+    """
+    Merges the records of one molecule.
+
+    The record of the highest priority source is the base; fields it lacks are
+    filled from the others in priority order. The merged record gets a "merge"
+    entry listing the InChIKeys and source records it was built from.
+
+    Args:
+        key (str): Group key (InChIKey or connectivity block)
+        records (list): (source, record ID, record) tuples, in priority order
+
+    Returns:
+        dict: Merged record
+    """
+    merged = records[0][2]
+    for _, _, record in records[1:]:
+        _fill(merged, record)
+    merged["merge"] = {
+        "key": key,
+        "inchiKeys": sorted({record["structure"]["inchiKey"] for _, _, record in records}),
+        "records": [{"source": source, "id": record_id} for source, record_id, _ in records],
+    }
+    return merged
+
+def write_merged(index, output_file, connectivity=False):
+    """
+    Writes the merged records to a JSON Lines file.
+
+    Args:
+        index (MergeIndex): Index of the records to merge
+        output_file (str): Output JSON Lines file
+        connectivity (bool): Merge on the connectivity block
+
+    Returns:
+        int: Number of merged records written
+    """
+    written = 0
+    with open(output_file, "wb") as lines_file:
+        for record in index.merged_records(connectivity):
+            lines_file.write(json_backend.dumps(record) + b"\n")
+            written += 1
+    return written
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge the indexed PubChem and ChEMBL records by InChIKey.")
+    parser.add_argument("index", help="merge index database")
+    parser.add_argument("output", help="merged JSON Lines file")
+    parser.add_argument("--connectivity", action="store_true",
+                        help="merge on the 14-character connectivity block (groups stereoisomers)")
+    args = parser.parse_args()
+
+    merge_index = MergeIndex(args.index)
+    print(f"Indexed records: {merge_index.counts()}")
+    written = write_merged(merge_index, args.output, args.connectivity)
+    merge_index.close()
+    print(f"{written} merged records saved to {args.output}")
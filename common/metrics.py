@@ -0,0 +1,390 @@
+"""
+Scraper Metrics
+
+This module collects counters and histograms about a scraper run (request
+latency, bytes downloaded, HTTP statuses, retries, cache use and the time
+spent in every pipeline stage) and exposes them in the Prometheus text
+format, either as a textfile for node_exporter's textfile collector or on a
+/metrics HTTP endpoint, plus a human readable summary at the end of a run.
+
+Metrics are process-wide and thread-safe. Transforms running in worker
+processes report their timings back to the parent, so the stage times cover
+both transform modes.
+
+Features:
+- Labelled counters and histograms, no external dependencies
+- Prometheus text exposition format
+- Atomic textfile writes and an optional /metrics endpoint
+- Per-run summary with request latency percentiles and time per stage
+
+Author: Israel Neto
+Date: 2024
+"""
+
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds, in seconds, of the latency and stage duration buckets
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Order the pipeline stages are listed in by the summary
+STAGES = ("fetch", "parse", "transform", "encode", "write")
+
+class _Metric:
+    """
+    Base of the labelled metric types.
+
+    Args:
+        name (str): Metric name
+        help_text (str): One-line description
+        labels (tuple): Label names
+    """
+
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, label_values):
+        if len(label_values) != len(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}, got {label_values}")
+        return tuple(str(value) for value in label_values)
+
+    def _label_text(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{label}="{_escape(value)}"' for label, value in pairs) + "}"
+
+    def reset(self):
+        """
+        Drops every recorded value.
+        """
+        with self._lock:
+            self._values.clear()
+
+class Counter(_Metric):
+    """
+    Monotonically increasing count, e.g. requests or bytes.
+    """
+
+    kind = "counter"
+
+    def inc(self, *label_values, amount=1):
+        """
+        Adds to the counter.
+
+        Args:
+            *label_values: One value per label name
+            amount (float): Amount to add
+        """
+        key = self._key(label_values)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *label_values):
+        """
+        Returns the count of a label combination (0 if never incremented).
+        """
+        return self._values.get(self._key(label_values), 0)
+
+    def values(self):
+        """
+        Returns {label values: count} for every recorded label combination.
+        """
+        with self._lock:
+            return dict(self._values)
+
+    def total(self):
+        """
+        Returns the sum over every label combination.
+        """
+        return sum(self.values().values())
+
+    def render(self):
+        lines = []
+        for key, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{self._label_text(key)} {_number(value)}")
+        return lines
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values in cumulative buckets, e.g. latencies.
+
+    Args:
+        name (str): Metric name
+        help_text (str): One-line description
+        labels (tuple): Label names
+        buckets (tuple): Increasing bucket upper bounds
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        """
+        Records one value.
+
+        Args:
+            value (float): Observed value
+            *label_values: One value per label name
+        """
+        key = self._key(label_values)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # Per-bucket (not cumulative) counts, the last one being +Inf
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, *label_values):
+        """
+        Observes the duration of a with block, in seconds.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def snapshot(self, *label_values):
+        """
+        Returns the state of a label combination.
+
+        Returns:
+            tuple: (per-bucket counts, sum, count), or None if nothing was observed
+        """
+        with self._lock:
+            entry = self._values.get(self._key(label_values))
+            return None if entry is None else (list(entry[0]), entry[1], entry[2])
+
+    def quantile(self, q, *label_values):
+        """
+        Estimates a quantile by linear interpolation within its bucket, like
+        Prometheus' histogram_quantile.
+
+        Args:
+            q (float): Quantile between 0 and 1
+            *label_values: One value per label name
+
+        Returns:
+            float: Estimated value, or None if nothing was observed
+        """
+        snapshot = self.snapshot(*label_values)
+        if snapshot is None:
+            return None
+        counts, _, count = snapshot
+        rank = q * count
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            if bucket_count and seen + bucket_count >= rank:
+                if index == len(self.buckets):
+                    # Beyond the last bound: the best estimate is that bound
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+    def render(self):
+        with self._lock:
+            entries = sorted((key, (list(entry[0]), entry[1], entry[2])) for key, entry in self._values.items())
+        lines = []
+        for key, (counts, total, count) in entries:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                le = bound if bound == "+Inf" else _number(bound)
+                lines.append(f"{self.name}_bucket{self._label_text(key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(key)} {_number(total)}")
+            lines.append(f"{self.name}_count{self._label_text(key)} {count}")
+        return lines
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Registry:
+    """
+    Set of metrics rendered together.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help_text, labels=()):
+        """
+        Creates and registers a counter.
+        """
+        metric = Counter(name, help_text, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labels=(), buckets=DURATION_BUCKETS):
+        """
+        Creates and registers a histogram.
+        """
+        metric = Histogram(name, help_text, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        Renders every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: Exposition text
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        """
+        Drops every recorded value, e.g. between two runs in one process.
+        """
+        for metric in self._metrics:
+            metric.reset()
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "scraper_http_requests_total", "HTTP request attempts, by status code, or error when no response arrived",
+    ("status",))
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "scraper_http_request_duration_seconds", "Latency of single HTTP request attempts, body included")
+HTTP_RESPONSE_BYTES = REGISTRY.counter(
+    "scraper_http_response_bytes_total", "Bytes of HTTP response bodies downloaded")
+HTTP_RETRIES = REGISTRY.counter(
+    "scraper_http_retries_total", "Retried HTTP requests, by status code or error", ("reason",))
+CACHE_LOOKUPS = REGISTRY.counter(
+    "scraper_cache_lookups_total", "Response cache lookups, by result (hit, revalidated, miss)", ("result",))
+STAGE_SECONDS = REGISTRY.histogram(
+    "scraper_stage_duration_seconds",
+    "Time spent per record in each pipeline stage (parse is response decoding, also counted in fetch)", ("stage",))
+RECORDS = REGISTRY.counter(
+    "scraper_records_total", "Records processed by the pipeline, by outcome", ("outcome",))
+
+def time_stage(stage):
+    """
+    Times a with block as one record's pass through a pipeline stage.
+
+    Args:
+        stage (str): One of STAGES
+
+    Returns:
+        contextmanager: Observes STAGE_SECONDS on exit
+    """
+    return STAGE_SECONDS.time(stage)
+
+def write_textfile(path, registry=REGISTRY):
+    """
+    Writes the metrics for node_exporter's textfile collector.
+
+    The file is replaced atomically, so the collector never reads a partial
+    file. Its name must end with .prom to be collected.
+
+    Args:
+        path (str): Output file
+        registry (Registry): Metrics to write
+    """
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "w") as metrics_file:
+        metrics_file.write(registry.render())
+    os.replace(temporary_path, path)
+
+def start_http_server(port, address="", registry=REGISTRY):
+    """
+    Serves the metrics on http://<address>:<port>/metrics from a daemon thread.
+
+    Args:
+        port (int): Port to listen on
+        address (str): Interface to bind ("" binds every interface)
+        registry (Registry): Metrics to serve
+
+    Returns:
+        ThreadingHTTPServer: The running server (call shutdown() to stop it)
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Scrapes every few seconds would drown the scraper's own output
+            pass
+
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def _format_bytes(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.1f} {unit}" if unit != "B" else f"{int(size)} B"
+        size /= 1024
+
+def summary_lines():
+    """
+    Summarizes the metrics recorded so far.
+
+    Returns:
+        list: Lines of text
+    """
+    statuses = ", ".join(f"{status}: {count}" for (status,), count in sorted(HTTP_REQUESTS.values().items()))
+    lines = [
+        f"Requests: {HTTP_REQUESTS.total()} ({statuses or 'none'}), {HTTP_RETRIES.total()} retries, "
+        f"{_format_bytes(HTTP_RESPONSE_BYTES.total())} downloaded",
+    ]
+    if HTTP_REQUEST_SECONDS.snapshot() is not None:
+        percentiles = ", ".join(f"p{int(q * 100)} {HTTP_REQUEST_SECONDS.quantile(q):.3f}s" for q in (0.5, 0.95, 0.99))
+        lines.append(f"Request latency: {percentiles}")
+    cache = CACHE_LOOKUPS.values()
+    if cache:
+        lines.append("Cache: " + ", ".join(f"{count} {result}" for (result,), count in sorted(cache.items())))
+    stages = []
+    for stage in STAGES:
+        snapshot = STAGE_SECONDS.snapshot(stage)
+        if snapshot is not None:
+            stages.append(f"{stage} {snapshot[1]:.2f}s")
+    if stages:
+        lines.append("Stage time (summed over records): " + ", ".join(stages))
+    records = RECORDS.values()
+    if records:
+        lines.append("Records: " + ", ".join(f"{count} {outcome}" for (outcome,), count in sorted(records.items())))
+    return lines
+
+def print_summary():
+    """
+    Prints the run summary.
+    """
+    print("\nRun metrics:")
+    for line in summary_lines():
+        print(f"  {line}")
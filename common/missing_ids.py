@@ -0,0 +1,168 @@
+"""
+Missing ID Cache
+
+PubChem's CID and SID spaces are full of deprecated and never assigned IDs.
+Each one costs a full record request ending in a 404. This module remembers
+the IDs found missing, for a limited time since IDs do get (re)assigned, and
+filters ID ranges before they are fetched: known missing IDs are dropped, and
+the rest can be checked with bulk existence queries, so the per-record fetch
+loop only visits live IDs.
+
+Features:
+- SQLite negative cache of missing IDs per record kind, with expiry
+- Range filtering against the cache
+- Concurrent pre-pass of batched existence checks, recording the gaps found
+
+Author: Israel Neto
+Date: 2024
+"""
+
+import sqlite3
+import time
+
+import requests
+
+from .fetch_engine import DEFAULT_MAX_CONCURRENCY, iter_fetch
+
+# Seconds an ID stays known missing before it is requested again
+DEFAULT_MISSING_TTL = 30 * 24 * 3600
+
+# IDs per existence check when the caller does not say otherwise
+DEFAULT_CHECK_BATCH_SIZE = 200
+
+# Seconds to wait for the write lock of another connection, e.g. the other
+# record kind's stage running at the same time
+LOCK_TIMEOUT = 60.0
+
+class MissingIdCache:
+    """
+    IDs of one record kind known to be missing.
+
+    Entries older than ttl are dropped when the cache is opened. Adds are
+    committed straight away, so no write lock is held between them while
+    other stages share the database.
+
+    Args:
+        path (str): SQLite database file, created if missing; several kinds
+            can share it
+        kind (str): Record kind, e.g. "compound" or "substance"
+        ttl (float): Seconds an entry stays valid
+    """
+
+    def __init__(self, path, kind, ttl=DEFAULT_MISSING_TTL):
+        self.path = path
+        self.kind = kind
+        self.ttl = ttl
+        self._connection = sqlite3.connect(path, timeout=LOCK_TIMEOUT)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS missing (kind TEXT, id, checked_at REAL, PRIMARY KEY (kind, id))"
+        )
+        self._connection.execute("DELETE FROM missing WHERE kind = ? AND checked_at < ?",
+                                 (kind, time.time() - ttl))
+        self._connection.commit()
+
+    def add(self, item_id):
+        """
+        Records an ID as missing as of now, and commits it.
+
+        Args:
+            item_id: Missing record ID
+        """
+        self.add_all([item_id])
+
+    def add_all(self, item_ids):
+        """
+        Records several IDs as missing as of now, in one commit.
+
+        Args:
+            item_ids (iterable): Missing record IDs
+        """
+        checked_at = time.time()
+        self._connection.executemany("INSERT OR REPLACE INTO missing (kind, id, checked_at) VALUES (?, ?, ?)",
+                                     ((self.kind, item_id, checked_at) for item_id in item_ids))
+        self._connection.commit()
+
+    def missing_in(self, ids):
+        """
+        Returns the IDs of a list known to be missing.
+
+        Args:
+            ids (list): Record IDs
+
+        Returns:
+            set: IDs with a valid missing entry
+        """
+        if not ids:
+            return set()
+        rows = self._connection.execute(
+            "SELECT id FROM missing WHERE kind = ? AND id BETWEEN ? AND ? AND checked_at >= ?",
+            (self.kind, min(ids), max(ids), time.time() - self.ttl),
+        )
+        wanted = set(ids)
+        return {item_id for (item_id,) in rows if item_id in wanted}
+
+    def commit(self):
+        """
+        Saves any pending entries. Kept for callers that sync their indexes
+        together; add and add_all already commit.
+        """
+        self._connection.commit()
+
+    def close(self):
+        """
+        Commits and closes the cache.
+        """
+        self.commit()
+        self._connection.close()
+
+def live_ids(ids, missing_ids=None, check_batch=None, batch_size=DEFAULT_CHECK_BATCH_SIZE,
+             max_concurrency=DEFAULT_MAX_CONCURRENCY):
+    """
+    Narrows a list of IDs down to the ones worth fetching.
+
+    Known missing IDs are dropped. With check_batch, the remaining IDs are
+    checked batch by batch, several batches in flight at once; the IDs a
+    check leaves out are dropped and recorded as missing. The IDs of a batch
+    whose check failed are all kept.
+
+    Args:
+        ids (iterable): Record IDs, in fetch order
+        missing_ids (MissingIdCache): Known missing IDs (None skips the cache)
+        check_batch (callable): Function receiving a list of IDs and returning
+            the set of those that exist (None skips the existence checks)
+        batch_size (int): IDs per existence check
+        max_concurrency (int): Maximum number of checks in flight at once
+
+    Returns:
+        list: IDs to fetch, in the original order
+    """
+    ids = list(ids)
+    if missing_ids is not None:
+        known = missing_ids.missing_in(ids)
+        ids = [item_id for item_id in ids if item_id not in known]
+    if check_batch is None:
+        return ids
+
+    batches = [ids[start:start + batch_size] for start in range(0, len(ids), batch_size)]
+
+    def check(index):
+        try:
+            return {"existing": check_batch(batches[index])}
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Existence check of IDs {batches[index][0]}-{batches[index][-1]} failed, keeping them: {e}")
+            return {"error": str(e)}
+
+    live = []
+    for index, result in iter_fetch(range(len(batches)), check, max_concurrency):
+        if "error" in result:
+            live.extend(batches[index])
+            continue
+        gaps = []
+        for item_id in batches[index]:
+            if item_id in result["existing"]:
+                live.append(item_id)
+            else:
+                gaps.append(item_id)
+        if missing_ids is not None and gaps:
+            missing_ids.add_all(gaps)
+    return live
@@ -0,0 +1,198 @@
+"""
+MongoDB Bulk Loader
+
+This module loads transformed records into the DrugXpert MongoDB database
+(the `molecules` collection) with batched, unordered bulk upserts, instead of
+going through one large JSON file and a manual insertMany.
+
+Records are matched on their natural key, so loading the same file twice, or
+loading a delta file from an incremental refresh, updates the existing
+documents instead of duplicating them:
+- compounds on identifiers.pubChemCID, ChEMBL molecules on
+  identifiers.chemblId, and other records on structure.inchiKey
+- substances on their type and recordNumber (the PubChem SID)
+
+Features:
+- Unordered bulk upserts in fixed-size batches
+- Indexes on the match keys created before loading
+- Inserted / updated / unchanged / failed counts
+- Plain or compressed JSON Lines input, sharded outputs loaded in parallel
+- Works with any pymongo compatible collection (mongod, mongomock)
+
+Author: Israel Neto
+Date: 2024
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from . import json_backend
+from .shard_writer import open_lines, read_manifest
+
+try:
+    from pymongo import ASCENDING, MongoClient, ReplaceOne
+    from pymongo.errors import BulkWriteError
+except ImportError:
+    MongoClient = None
+
+DEFAULT_MONGO_URI = "mongodb://localhost:27017"
+DEFAULT_DATABASE = "DrugXpert"
+DEFAULT_COLLECTION = "molecules"
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_LOAD_WORKERS = 4
+
+def get_collection(uri=DEFAULT_MONGO_URI, database=DEFAULT_DATABASE, collection=DEFAULT_COLLECTION):
+    """
+    Connects to the molecules collection.
+
+    Args:
+        uri (str): MongoDB connection string
+        database (str): Database name
+        collection (str): Collection name
+
+    Returns:
+        pymongo.collection.Collection: The collection
+
+    Raises:
+        ImportError: If pymongo is not installed
+    """
+    if MongoClient is None:
+        raise ImportError("Loading into MongoDB requires pymongo (pip install pymongo)")
+    return MongoClient(uri)[database][collection]
+
+def record_key(record):
+    """
+    Builds the filter matching a record's document.
+
+    Args:
+        record (dict): Transformed compound or substance record
+
+    Returns:
+        dict: Filter on the record's natural key, or None if it has none
+    """
+    if record.get("type") == "substance":
+        return {"type": "substance", "recordNumber": record.get("recordNumber")}
+    cid = record.get("identifiers", {}).get("pubChemCID")
+    if cid is not None:
+        return {"identifiers.pubChemCID": cid}
+    chembl_id = record.get("identifiers", {}).get("chemblId")
+    if chembl_id is not None:
+        return {"identifiers.chemblId": chembl_id}
+    inchi_key = record.get("structure", {}).get("inchiKey")
+    if inchi_key and inchi_key != "Unknown":
+        return {"structure.inchiKey": inchi_key}
+    return None
+
+class MongoLoader:
+    """
+    Buffers records and upserts them in unordered bulk writes.
+
+    Args:
+        collection: pymongo compatible collection
+        batch_size (int): Records per bulk write
+    """
+
+    def __init__(self, collection, batch_size=DEFAULT_BATCH_SIZE):
+        if MongoClient is None:
+            raise ImportError("Loading into MongoDB requires pymongo (pip install pymongo)")
+        self.collection = collection
+        self.batch_size = batch_size
+        self.counts = {"inserted": 0, "updated": 0, "unchanged": 0, "skipped": 0, "failed": 0}
+        self._operations = []
+
+    def ensure_indexes(self):
+        """
+        Creates the indexes the upserts match on, if they do not exist yet.
+        """
+        # Sparse, so documents without a CID (substances, ChEMBL molecules) do not collide
+        self.collection.create_index([("identifiers.pubChemCID", ASCENDING)], unique=True, sparse=True,
+                                     name="pubChemCID")
+        self.collection.create_index([("identifiers.chemblId", ASCENDING)], unique=True, sparse=True,
+                                     name="chemblId")
+        self.collection.create_index([("structure.inchiKey", ASCENDING)], name="inchiKey")
+        self.collection.create_index(
+            [("type", ASCENDING), ("recordNumber", ASCENDING)], name="type_recordNumber",
+        )
+
+    def add(self, record):
+        """
+        Queues a record, writing the batch once it is full.
+
+        Args:
+            record (dict): Transformed compound or substance record
+        """
+        key = record_key(record)
+        if key is None:
+            self.counts["skipped"] += 1
+            return
+        self._operations.append(ReplaceOne(key, record, upsert=True))
+        if len(self._operations) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the queued records in one unordered bulk write. Records the
+        server rejects are counted as failed; the rest of the batch is still
+        written.
+        """
+        if not self._operations:
+            return
+        operations, self._operations = self._operations, []
+        try:
+            result = self.collection.bulk_write(operations, ordered=False).bulk_api_result
+        except BulkWriteError as e:
+            result = e.details
+            for error in result["writeErrors"]:
+                print(f"Error loading record: {error['errmsg']}")
+            self.counts["failed"] += len(result["writeErrors"])
+        self.counts["inserted"] += result["nUpserted"]
+        self.counts["updated"] += result["nModified"]
+        self.counts["unchanged"] += result["nMatched"] - result["nModified"]
+
+def load_jsonl(jsonl_file, collection, batch_size=DEFAULT_BATCH_SIZE, create_indexes=True):
+    """
+    Upserts every record of a JSON Lines output file.
+
+    The file is streamed, so memory stays flat whatever its size.
+
+    Args:
+        jsonl_file (str): Path to the JSON Lines file written by the pipeline,
+            or a .gz / .zst compressed shard
+        collection: pymongo compatible collection
+        batch_size (int): Records per bulk write
+        create_indexes (bool): Create the match key indexes first
+
+    Returns:
+        dict: Counts of inserted, updated, unchanged, skipped and failed records
+    """
+    loader = MongoLoader(collection, batch_size)
+    if create_indexes:
+        loader.ensure_indexes()
+    with open_lines(jsonl_file) as lines_file:
+        for line in lines_file:
+            if line.strip():
+                loader.add(json_backend.loads(line))
+    loader.flush()
+    return loader.counts
+
+def load_shards(shard_directory, collection, batch_size=DEFAULT_BATCH_SIZE, workers=DEFAULT_LOAD_WORKERS):
+    """
+    Upserts every shard listed in a shard manifest, several shards at once.
+
+    Args:
+        shard_directory (str): Directory written by a ShardedWriter
+        collection: pymongo compatible collection
+        batch_size (int): Records per bulk write
+        workers (int): Shards loaded in parallel
+
+    Returns:
+        dict: Counts of inserted, updated, unchanged, skipped and failed records
+    """
+    MongoLoader(collection, batch_size).ensure_indexes()
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0, "skipped": 0, "failed": 0}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(lambda path: load_jsonl(path, collection, batch_size, create_indexes=False),
+                               read_manifest(shard_directory)["paths"])
+        for shard_counts in results:
+            for outcome, count in shard_counts.items():
+                counts[outcome] += count
+    return counts
@@ -0,0 +1,341 @@
+"""
+Streaming Record Pipeline
+
+This module chains the fetch, transform and write steps so each record is
+transformed and written as soon as it is fetched. Records are streamed to a
+JSON Lines file, keeping memory flat however large the ID range is; the
+single-array JSON file can still be produced as a final step.
+
+Features:
+- Generator based fetch -> transform -> write pipeline
+- Newline-delimited JSON output in ID order
+- Resumable through the progress journal
+- Optional final JSON array, identical to json.dump(records, indent=4)
+- Compact output mode using the fast JSON backend
+- Optional process-pool transform stage, with output still in ID order
+- Incremental mode writing only the records changed since the last run
+- Record outcome counts and write times in the run metrics
+- Optional cross-source merge index updated as records are written
+- Optional negative cache of the IDs found missing
+- Optional compressed, rotating JSON Lines shards with a manifest, written
+  in place of the JSON Lines file
+
+Author: Israel Neto
+Date: 2024
+"""
+
+import json
+import os
+import time
+
+from . import json_backend, metrics
+from .fetch_engine import DEFAULT_MAX_CONCURRENCY, iter_fetch
+from .progress_journal import ProgressJournal
+from .shard_writer import open_lines
+from .transform_pool import iter_transform
+
+# Seconds between fsyncs of the output and journal files
+SYNC_INTERVAL = 1.0
+
+def jsonl_path(output_file):
+    """
+    Derives the JSON Lines path used for an output file.
+
+    Args:
+        output_file (str): Path of the JSON output file
+
+    Returns:
+        str: Same path with a .jsonl extension
+    """
+    return os.path.splitext(output_file)[0] + ".jsonl"
+
+def _encode_line(record):
+    return json.dumps(record, default=json_backend.to_serializable).encode("utf-8")
+
+def record_encoder(compact=False):
+    """
+    Returns the function encoding a record as one output line.
+
+    Args:
+        compact (bool): Compact JSON from the fast JSON backend instead of
+            json.dumps spacing
+
+    Returns:
+        callable: Function encoding a record to bytes, without the newline
+    """
+    return json_backend.dumps if compact else _encode_line
+
+def write_json_array(output_file, records):
+    """
+    Streams records into a JSON array file.
+
+    The bytes written are identical to json.dump(list(records), indent=4),
+    without holding every record in memory.
+
+    Args:
+        output_file (str): Path to output JSON file
+        records (iterable): Records to write
+    """
+    with open(output_file, "w") as json_file:
+        json_file.write("[")
+        separator = "\n    "
+        for record in records:
+            json_file.write(separator)
+            json_file.write(json_backend.dumps_pretty(record).replace("\n", "\n    "))
+            separator = ",\n    "
+        json_file.write("]" if separator == "\n    " else "\n]")
+
+def write_compact_json_array(output_file, lines):
+    """
+    Joins compact JSON Lines into a compact JSON array file.
+
+    The lines are copied as they are, without decoding them again.
+
+    Args:
+        output_file (str): Path to output JSON file
+        lines (iterable): Encoded records, each ending with a newline
+    """
+    with open(output_file, "wb") as json_file:
+        json_file.write(b"[")
+        separator = b""
+        for line in lines:
+            json_file.write(separator)
+            json_file.write(line[:-1])
+            separator = b","
+        json_file.write(b"]")
+
+def read_jsonl_lines(jsonl_file, locations):
+    """
+    Reads raw lines from a JSON Lines file at known locations.
+
+    Args:
+        jsonl_file (str): Path to the JSON Lines file
+        locations (iterable): (offset, length) tuples, in the desired order
+
+    Yields:
+        bytes: Encoded records, including their newline
+    """
+    with open(jsonl_file, "rb") as lines_file:
+        for offset, length in locations:
+            lines_file.seek(offset)
+            yield lines_file.read(length)
+
+def read_jsonl_records(jsonl_file, locations):
+    """
+    Reads records from a JSON Lines file at known locations.
+
+    Args:
+        jsonl_file (str): Path to the JSON Lines file
+        locations (iterable): (offset, length) tuples, in the desired order
+
+    Yields:
+        dict: Decoded records
+    """
+    for line in read_jsonl_lines(jsonl_file, locations):
+        yield json_backend.loads(line)
+
+def _reindex_shards(merge_index, shard_writer, journal):
+    # Journaled records of the finished shards, by (shard number, line number)
+    journaled = {location: item_id for item_id, location in journal.completed.items() if location}
+    for shard in shard_writer.shards:
+        with open_lines(os.path.join(shard_writer.directory, shard["file"])) as lines:
+            for index, line in enumerate(lines):
+                item_id = journaled.get((shard["number"], index))
+                if item_id is not None:
+                    merge_index.add_line(item_id, line, shard_writer.directory, index, keep_line=True)
+
+def run_pipeline(ids, fetch_one, transform_one, output_file, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 resume=False, json_array=True, compact=False, transform_workers=0, refresh_index=None,
+                 fingerprint_one=None, merge_index=None, missing_ids=None, shard_writer=None):
+    """
+    Fetches, transforms and writes every ID, one record at a time.
+
+    Records are appended to jsonl_path(output_file) in ID order and every ID
+    is journaled to output_file + ".journal". On resume, finished IDs are
+    skipped, failed IDs are retried and any output line written after the
+    last journal entry is discarded.
+
+    With a shard_writer, the records go to its shards instead of the JSON
+    Lines file, and are journaled by (shard number, line number). On resume,
+    the records of a shard that was never finished are fetched again.
+
+    Args:
+        ids (iterable): IDs to process, in output order
+        fetch_one (callable): Function receiving an ID and returning its data,
+            or {"error": message} if the fetch failed
+        transform_one (callable): Function receiving (ID, data) and returning
+            the transformed record, or None to skip it
+        output_file (str): Path to output JSON file
+        max_concurrency (int): Maximum number of requests in flight at once
+        resume (bool): Continue the run journaled next to output_file
+        json_array (bool): Also write the records as one JSON array to output_file
+        compact (bool): Write compact JSON with the fast JSON backend instead of
+            json.dumps spacing and an indented array
+        transform_workers (int): Worker processes transforming records in
+            parallel (0 transforms them in this process); transform_one must
+            then be picklable
+        refresh_index (RefreshIndex): Fingerprints of previous runs; records
+            whose fingerprint did not change are neither transformed nor
+            written, so the output only holds new and changed records
+        fingerprint_one (callable): Function receiving (ID, data) and returning
+            its (modify date, content hash) fingerprint; required with
+            refresh_index
+        merge_index (MergeIndex): InChIKey index every written record is
+            added to, for merging with the records of other sources; with
+            refresh_index or shard_writer, the index keeps a copy of each
+            line, since the delta output is overwritten by the next run and
+            shards cannot be read at an offset. Resumed runs index the
+            journaled records again
+        missing_ids (MissingIdCache): Negative cache the IDs whose fetch
+            returned {"missing": True} are added to; they are journaled as
+            done and counted as missing instead of failed
+        shard_writer (ShardedWriter): Write the records as compressed shards
+            with a manifest instead of the JSON Lines file (created with the
+            same resume flag); closed when done
+
+    Returns:
+        dict: Counts of written, skipped, unchanged, missing and failed IDs,
+        plus the error of every failed ID under "errors"
+
+    Raises:
+        ValueError: If both json_array and shard_writer are given
+    """
+    if json_array and shard_writer is not None:
+        raise ValueError("Sharded output cannot also be written as a JSON array")
+    lines_file_path = jsonl_path(output_file)
+    journal = ProgressJournal(output_file + ".journal", resume=resume)
+    # Records journaled into a shard that was never finished
+    lost_ids = set()
+    if shard_writer is not None:
+        finished = shard_writer.finished_numbers
+        lost_ids = {item_id for item_id, location in journal.completed.items()
+                    if location and location[0] not in finished}
+    pending_ids = [item_id for item_id in ids if not journal.is_done(item_id) or item_id in lost_ids]
+    if resume:
+        print(f"Resuming: {len(journal.completed) - len(lost_ids)} IDs already done, {len(pending_ids)} remaining")
+
+    counts = {"written": 0, "skipped": 0, "unchanged": 0, "missing": 0, "failed": 0}
+    encode = record_encoder(compact)
+    # A delta output only holds the records changed since the previous run and
+    # is overwritten by the next one, and shards cannot be read at an offset,
+    # so the merge index keeps their lines
+    keep_lines = refresh_index is not None or shard_writer is not None
+    # Fingerprints of the records between the change check and their write
+    fingerprints = {}
+
+    def fetched():
+        for item_id, data in iter_fetch(pending_ids, fetch_one, max_concurrency):
+            if "error" in data:
+                if missing_ids is not None and data.get("missing"):
+                    missing_ids.add(item_id)
+                    journal.record_done(item_id, None)
+                    counts["missing"] += 1
+                    metrics.RECORDS.inc("missing")
+                    continue
+                journal.record_failed(item_id, data["error"])
+                counts["failed"] += 1
+                metrics.RECORDS.inc("failed")
+                continue
+            if refresh_index is not None:
+                fingerprint = fingerprint_one(item_id, data)
+                # A lost record's fingerprint may be indexed already
+                if item_id not in lost_ids and refresh_index.get(item_id) == fingerprint:
+                    journal.record_done(item_id, None)
+                    counts["unchanged"] += 1
+                    metrics.RECORDS.inc("unchanged")
+                    continue
+                fingerprints[item_id] = fingerprint
+            yield item_id, data
+
+    if shard_writer is not None:
+        lines_file = None
+        if resume and merge_index is not None:
+            _reindex_shards(merge_index, shard_writer, journal)
+            merge_index.commit()
+    else:
+        mode = "r+b" if resume and os.path.exists(lines_file_path) else "wb"
+        lines_file = open(lines_file_path, mode)
+        if mode == "r+b":
+            lines_file.truncate(journal.output_end())
+            lines_file.seek(0, os.SEEK_END)
+            if merge_index is not None:
+                # The journal reaches the disk before the index is committed,
+                # so records journaled just before a crash may be missing
+                # from the index: index every journaled record again
+                journaled = [(item_id, location) for item_id, location in journal.completed.items() if location]
+                lines = read_jsonl_lines(lines_file_path, (location for _, location in journaled))
+                for (item_id, (offset, _)), line in zip(journaled, lines):
+                    merge_index.add_line(item_id, line, lines_file_path, offset, keep_line=keep_lines)
+                merge_index.commit()
+
+    def write(item_id, line):
+        if lines_file is None:
+            location = shard_writer.write(line)
+            if location[1] == 0:
+                # A shard was just finished: its records must stay journaled
+                journal.sync()
+            # Shard directory and line number, for reference; the line is kept
+            source_file, offset = shard_writer.directory, location[1]
+        else:
+            location = (lines_file.tell(), len(line))
+            lines_file.write(line)
+            lines_file.flush()
+            source_file, offset = lines_file_path, location[0]
+        if merge_index is not None:
+            merge_index.add_line(item_id, line, source_file, offset, keep_line=keep_lines)
+        return location
+
+    last_sync = time.monotonic()
+    try:
+        for item_id, line in iter_transform(fetched(), transform_one, encode, transform_workers):
+            with metrics.time_stage("write"):
+                location = None
+                if line is not None:
+                    location = write(item_id, line)
+                    outcome = "written"
+                else:
+                    outcome = "skipped"
+                journal.record_done(item_id, location)
+                if refresh_index is not None:
+                    refresh_index.put(item_id, fingerprints.pop(item_id))
+            counts[outcome] += 1
+            metrics.RECORDS.inc(outcome)
+
+            if time.monotonic() - last_sync >= SYNC_INTERVAL:
+                # Output must reach the disk before the journal and index that
+                # point at it; shard records are refetched if their shard is lost
+                if lines_file is not None:
+                    os.fsync(lines_file.fileno())
+                journal.sync()
+                if refresh_index is not None:
+                    refresh_index.commit()
+                if merge_index is not None:
+                    merge_index.commit()
+                if missing_ids is not None:
+                    missing_ids.commit()
+                last_sync = time.monotonic()
+    finally:
+        if lines_file is not None:
+            lines_file.flush()
+            os.fsync(lines_file.fileno())
+            lines_file.close()
+        else:
+            shard_writer.close()
+        journal.close()
+        if refresh_index is not None:
+            refresh_index.commit()
+        if merge_index is not None:
+            merge_index.commit()
+        if missing_ids is not None:
+            missing_ids.commit()
+
+    def locations():
+        return filter(None, (journal.completed.get(item_id) for item_id in ids))
+
+    if json_array:
+        if compact:
+            write_compact_json_array(output_file, read_jsonl_lines(lines_file_path, locations()))
+        else:
+            write_json_array(output_file, read_jsonl_records(lines_file_path, locations()))
+    counts["errors"] = dict(journal.failed)
+    return counts
@@ -0,0 +1,116 @@
+"""
+Crawl Progress Journal
+
+This module keeps a durable, append-only journal of the IDs a crawl has
+finished, so a crashed or interrupted run can resume where it stopped instead
+of refetching the whole range.
+
+Each line of the journal is a JSON object:
+- {"id": 42, "status": "done", "location": [offset, length]} for a processed
+  ID, where location points at its line in the JSON Lines output (null when
+  the response held nothing to transform)
+- {"id": 43, "status": "failed", "error": "..."} for an ID whose fetch failed
+
+Author: Israel Neto
+Date: 2024
+"""
+
+import json
+import os
+
+class ProgressJournal:
+    """
+    Append-only journal of completed and failed IDs.
+
+    Args:
+        path (str): Journal file path
+        resume (bool): Load an existing journal instead of starting a new one
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.completed = {}
+        self.failed = {}
+        if resume and os.path.exists(path):
+            self._load()
+        self._file = open(path, "a" if resume else "w", encoding="utf-8")
+
+    def _load(self):
+        with open(self.path, encoding="utf-8") as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A torn last line from a crash mid-write
+                    continue
+                if entry["status"] == "done":
+                    location = entry.get("location")
+                    self.completed[entry["id"]] = tuple(location) if location else None
+                    self.failed.pop(entry["id"], None)
+                else:
+                    self.failed[entry["id"]] = entry.get("error")
+
+    def is_done(self, item_id):
+        """
+        Checks whether an ID was already processed.
+
+        Args:
+            item_id (int): Record ID
+
+        Returns:
+            bool: True if the ID finished successfully in this or a previous run
+        """
+        return item_id in self.completed
+
+    def output_end(self):
+        """
+        Returns the end offset of the last journaled output line.
+
+        Output written after that offset belongs to an ID that was never
+        journaled and must be discarded before resuming.
+
+        Returns:
+            int: Byte offset in the JSON Lines output
+        """
+        return max((offset + length for offset, length in filter(None, self.completed.values())), default=0)
+
+    def _append(self, entry):
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+
+    def record_done(self, item_id, location):
+        """
+        Journals a processed ID.
+
+        Args:
+            item_id (int): Record ID
+            location (tuple): (offset, length) of the record in the JSON Lines
+                output, or None if there was nothing to transform
+        """
+        self._append({"id": item_id, "status": "done", "location": location})
+        self.completed[item_id] = location
+        self.failed.pop(item_id, None)
+
+    def record_failed(self, item_id, error):
+        """
+        Journals an ID whose fetch failed. Failed IDs are retried on resume.
+
+        Args:
+            item_id (int): Record ID
+            error (str): Error message
+        """
+        self._append({"id": item_id, "status": "failed", "error": error})
+        self.failed[item_id] = error
+
+    def sync(self):
+        """
+        Forces journaled entries to disk.
+        """
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        """
+        Syncs and closes the journal file.
+        """
+        self.sync()
+        self._file.close()
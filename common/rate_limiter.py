@@ -0,0 +1,225 @@
+"""
+Shared Request Rate Limiter
+
+This module provides the token buckets scraper requests pass through, one
+per host. The PubChem bucket defaults to PubChem's published limit of 5
+requests per second and slows down further when PubChem's
+X-Throttling-Control header reports that the service is under load. Other
+hosts, such as the ChEMBL API, get a bucket of their own, so they neither
+use up PubChem's budget nor pause when PubChem throttles.
+
+Requests wait in lanes, one per pipeline stage, and the bucket hands tokens
+to the waiting lanes in turn. Stages running side by side therefore split the
+rate evenly, however many workers each of them has.
+
+Features:
+- Thread-safe token bucket per host, shared by all fetchers
+- Round-robin token handoff between the lanes (stages) waiting for a token
+- Adaptive rate driven by the X-Throttling-Control header
+- Jittered exponential backoff delays for retries
+
+Author: Israel Neto
+Date: 2024
+"""
+
+import contextvars
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+PUBCHEM_RATE_LIMIT = 5.0
+PUBCHEM_HOST = "pubchem.ncbi.nlm.nih.gov"
+
+# Requests per second for the other hosts (ChEMBL publishes no limit)
+DEFAULT_RATE_LIMIT = 5.0
+
+# Fraction of the configured rate used for each PubChem throttling status
+THROTTLING_FACTORS = {
+    "green": 1.0,
+    "yellow": 0.5,
+    "red": 0.2,
+    "black": 0.1
+}
+
+# Seconds to stop sending requests when PubChem reports a "Black" status
+BLACK_STATUS_PAUSE = 60.0
+
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+_STATUS_PATTERN = re.compile(r"status:\s*(\w+)", re.IGNORECASE)
+
+# Lane the requests of the current context wait in. Set by whoever runs a
+# stage (see stage_runner); requests made outside any stage share the None lane.
+current_lane = contextvars.ContextVar("request_lane", default=None)
+
+class TokenBucket:
+    """
+    Thread-safe token bucket limiting how many requests start per second.
+
+    Waiting requests queue in their lane (current_lane), first come first
+    served within a lane. When a token frees up it goes to the head of the
+    next lane in turn, so every lane with waiting requests gets an equal share
+    of the rate.
+
+    Args:
+        rate (float): Tokens added per second
+        capacity (float): Maximum number of tokens that can accumulate
+    """
+
+    def __init__(self, rate=PUBCHEM_RATE_LIMIT, capacity=1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self._factor = 1.0
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        # Lane -> queue of waiting requests, lanes in turn order
+        self._lanes = OrderedDict()
+
+    @property
+    def effective_rate(self):
+        """float: Current rate after applying the throttling factor."""
+        return self.rate * self._factor
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.effective_rate)
+        self._updated = now
+
+    def acquire(self):
+        """
+        Blocks until a token is available and this request's turn has come,
+        then consumes the token.
+        """
+        lane = current_lane.get()
+        ticket = object()
+        with self._condition:
+            self._lanes.setdefault(lane, deque()).append(ticket)
+            try:
+                while True:
+                    if self._next_ticket() is not ticket:
+                        self._condition.wait()
+                        continue
+                    now = time.monotonic()
+                    if now < self._paused_until:
+                        wait = self._paused_until - now
+                    else:
+                        self._refill(now)
+                        if self._tokens >= 1:
+                            self._tokens -= 1
+                            return
+                        wait = (1 - self._tokens) / self.effective_rate
+                    self._condition.wait(wait)
+            finally:
+                self._leave(lane, ticket)
+
+    def _next_ticket(self):
+        for queue in self._lanes.values():
+            return queue[0]
+        return None
+
+    def _leave(self, lane, ticket):
+        """
+        Removes a request from its lane and moves the lane to the back of the
+        turn order. Called with the lock held.
+        """
+        queue = self._lanes[lane]
+        queue.remove(ticket)
+        if queue:
+            self._lanes.move_to_end(lane)
+        else:
+            del self._lanes[lane]
+        self._condition.notify_all()
+
+    def pause(self, seconds):
+        """
+        Stops handing out tokens for the given number of seconds.
+
+        Args:
+            seconds (float): Pause duration
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def observe_throttling(self, header_value):
+        """
+        Adjusts the rate from a PubChem X-Throttling-Control header.
+
+        The header looks like "Request Count status: Green (0%), Request Time
+        status: Yellow (60%), Service status: Green (20%)". The worst of the
+        reported statuses decides the rate.
+
+        Args:
+            header_value (str): Header value, or None when absent
+        """
+        if not header_value:
+            return
+        statuses = [status.lower() for status in _STATUS_PATTERN.findall(header_value)]
+        factors = [THROTTLING_FACTORS[status] for status in statuses if status in THROTTLING_FACTORS]
+        if not factors:
+            return
+        factor = min(factors)
+        with self._lock:
+            self._refill(time.monotonic())
+            self._factor = factor
+        if "black" in statuses:
+            self.pause(BLACK_STATUS_PAUSE)
+
+def backoff_delay(attempt, base=BACKOFF_BASE, maximum=BACKOFF_MAX):
+    """
+    Computes a "full jitter" exponential backoff delay.
+
+    Args:
+        attempt (int): Zero-based retry attempt
+        base (float): Delay ceiling for the first retry, in seconds
+        maximum (float): Upper bound for the delay ceiling, in seconds
+
+    Returns:
+        float: Seconds to wait before the next attempt
+    """
+    return random.uniform(0, min(maximum, base * (2 ** attempt)))
+
+_limiter = TokenBucket()
+# Host -> limiter of every host other than PubChem
+_host_limiters = {}
+_host_lock = threading.Lock()
+
+def get_rate_limiter(host=None):
+    """
+    Returns the rate limiter shared by every fetcher of a host.
+
+    Args:
+        host (str): Host name of the request; None or PUBCHEM_HOST returns
+            the PubChem limiter
+
+    Returns:
+        TokenBucket: Shared limiter of the host
+    """
+    if host is None or host == PUBCHEM_HOST:
+        return _limiter
+    with _host_lock:
+        limiter = _host_limiters.get(host)
+        if limiter is None:
+            limiter = _host_limiters[host] = TokenBucket(DEFAULT_RATE_LIMIT)
+        return limiter
+
+def configure(rate=PUBCHEM_RATE_LIMIT, capacity=1.0, host=None):
+    """
+    Replaces the shared rate limiter of a host.
+
+    Args:
+        rate (float): Requests per second
+        capacity (float): Burst size
+        host (str): Host name; None replaces the PubChem limiter
+    """
+    global _limiter
+    if host is None or host == PUBCHEM_HOST:
+        _limiter = TokenBucket(rate, capacity)
+        return
+    with _host_lock:
+        _host_limiters[host] = TokenBucket(rate, capacity)
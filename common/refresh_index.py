@@ -0,0 +1,92 @@
+"""
+Incremental Refresh Index
+
+This module remembers, for every record seen by previous runs, its Modify
+Date and a hash of its content, so an incremental run can skip records that
+did not change and only write a delta of the ones that did.
+
+Features:
+- SQLite index of (Modify Date, content hash) per record ID
+- Stable content hash of decoded records, independent of the JSON backend
+- Batched commits, made after the delta output reaches the disk
+
+Author: Israel Neto
+Date: 2024
+"""
+
+import hashlib
+import json
+import sqlite3
+
+def content_hash(data):
+    """
+    Hashes a decoded record.
+
+    The hash is taken over a canonical encoding made with the stdlib encoder
+    (sorted keys, no spaces), never the fast JSON backend, so it does not
+    change when orjson is installed or removed.
+
+    Args:
+        data (dict): Decoded record
+
+    Returns:
+        str: Hex digest
+    """
+    canonical = json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).hexdigest()
+
+class RefreshIndex:
+    """
+    Fingerprints of the records written by previous runs.
+
+    Args:
+        path (str): SQLite database file, created if missing
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS records (id PRIMARY KEY, modify_date TEXT, content_hash TEXT)"
+        )
+        self._connection.commit()
+
+    def get(self, item_id):
+        """
+        Returns the fingerprint stored for a record.
+
+        Args:
+            item_id (int): Record ID
+
+        Returns:
+            tuple: (modify date, content hash), or None if the record is new
+        """
+        return self._connection.execute(
+            "SELECT modify_date, content_hash FROM records WHERE id = ?", (item_id,)
+        ).fetchone()
+
+    def put(self, item_id, fingerprint):
+        """
+        Stores the fingerprint of a written record. It is only saved by the
+        next commit.
+
+        Args:
+            item_id (int): Record ID
+            fingerprint (tuple): (modify date, content hash)
+        """
+        self._connection.execute(
+            "INSERT OR REPLACE INTO records (id, modify_date, content_hash) VALUES (?, ?, ?)", (item_id, *fingerprint)
+        )
+
+    def commit(self):
+        """
+        Saves the fingerprints stored since the last commit.
+        """
+        self._connection.commit()
+
+    def close(self):
+        """
+        Commits and closes the index.
+        """
+        self.commit()
+        self._connection.close()
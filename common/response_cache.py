@@ -0,0 +1,182 @@
+"""
+Persistent Response Cache
+
+This module stores raw API response bodies on disk, gzip-compressed and keyed
+by URL, so re-running the scrapers (for example after changing only the
+transform code) does not refetch every record from PubChem or ChEMBL.
+
+Features:
+- One compressed file per URL, written atomically
+- Time-to-live after which entries are revalidated
+- Revalidation through ETag / Last-Modified conditional requests
+- Size-bounded, least-recently-used eviction
+
+Author: Israel Neto
+Date: 2024
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+DEFAULT_CACHE_DIR = ".scraper_cache"
+DEFAULT_TTL = 7 * 24 * 60 * 60
+DEFAULT_MAX_BYTES = 5 * 1024 ** 3
+
+# Fraction of max_bytes the cache is trimmed down to once it grows past the limit
+EVICTION_TARGET = 0.9
+
+class CacheEntry:
+    """
+    A cached response body with its validators.
+
+    Args:
+        body (bytes): Response body
+        stored_at (float): Unix time the entry was stored or last revalidated
+        etag (str): ETag header of the response, if any
+        last_modified (str): Last-Modified header of the response, if any
+    """
+
+    def __init__(self, body, stored_at, etag=None, last_modified=None):
+        self.body = body
+        self.stored_at = stored_at
+        self.etag = etag
+        self.last_modified = last_modified
+
+class ResponseCache:
+    """
+    On-disk, gzip-compressed response cache keyed by URL.
+
+    Args:
+        directory (str): Directory holding the cache files
+        ttl (float): Seconds an entry is served without revalidation
+        max_bytes (int): Maximum total size of the cache files
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._total_bytes = sum(size for _, size, _ in self._scan())
+
+    def _path(self, url):
+        digest = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest + ".gz")
+
+    def _scan(self):
+        """
+        Lists the cache files.
+
+        Returns:
+            list: (path, size, mtime) tuples
+        """
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if not name.endswith(".gz"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((path, stat.st_size, stat.st_mtime))
+        return files
+
+    def get(self, url):
+        """
+        Looks up a URL, whether or not the entry is still fresh.
+
+        Args:
+            url (str): Request URL
+
+        Returns:
+            CacheEntry: Cached entry, or None if the URL is not cached
+        """
+        path = self._path(url)
+        try:
+            with gzip.open(path, "rb") as cache_file:
+                header, body = cache_file.read().split(b"\n", 1)
+            os.utime(path)
+        except (OSError, EOFError, ValueError):
+            return None
+        meta = json.loads(header)
+        return CacheEntry(body, meta["stored_at"], meta.get("etag"), meta.get("last_modified"))
+
+    def is_fresh(self, entry):
+        """
+        Checks whether an entry is younger than the cache TTL.
+
+        Args:
+            entry (CacheEntry): Cached entry
+
+        Returns:
+            bool: True if the entry can be served without revalidation
+        """
+        return time.time() - entry.stored_at < self.ttl
+
+    def put(self, url, body, etag=None, last_modified=None):
+        """
+        Stores a response body, evicting old entries if the cache is full.
+
+        Args:
+            url (str): Request URL
+            body (bytes): Response body
+            etag (str): ETag header of the response, if any
+            last_modified (str): Last-Modified header of the response, if any
+        """
+        path = self._path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        header = json.dumps({
+            "url": url,
+            "stored_at": time.time(),
+            "etag": etag,
+            "last_modified": last_modified
+        }).encode("utf-8")
+
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as raw_file:
+            with gzip.GzipFile(fileobj=raw_file, mode="wb") as cache_file:
+                cache_file.write(header + b"\n" + body)
+        new_size = os.path.getsize(temp_path)
+
+        with self._lock:
+            try:
+                old_size = os.path.getsize(path)
+            except OSError:
+                old_size = 0
+            os.replace(temp_path, path)
+            self._total_bytes += new_size - old_size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def refresh(self, url, entry):
+        """
+        Marks an entry as revalidated (the server answered 304 Not Modified).
+
+        Args:
+            url (str): Request URL
+            entry (CacheEntry): Entry that was revalidated
+        """
+        self.put(url, entry.body, entry.etag, entry.last_modified)
+
+    def _evict(self):
+        """
+        Deletes least recently used files until the cache is below the target size.
+        Must be called with the lock held.
+        """
+        target = self.max_bytes * EVICTION_TARGET
+        for path, size, _ in sorted(self._scan(), key=lambda item: item[2]):
+            if self._total_bytes <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._total_bytes -= size
@@ -0,0 +1,355 @@
+"""
+Distributed Crawl Coordinator
+
+This module splits ID ranges into shards and hands them out to crawl workers
+(processes or hosts) through expiring leases, so a crawl of the full CID/SID
+space can be spread over several machines. The shared state lives in a
+single SQLite file, which every worker opens directly.
+
+A worker leases a shard, renews the lease while it processes it, and reports
+the shard as completed (with its counts and failed IDs) or failed. Shards
+whose worker died are handed out again once their lease expires.
+
+Features:
+- Idempotent splitting of ID ranges into fixed-size shards
+- Atomic, expiring leases safe across processes and hosts
+- Lease renewal in the background while a shard is processed
+- Per-shard counts and per-ID failure reporting
+- Bounded retries of shards that keep failing
+
+Author: Israel Neto
+Date: 2024
+"""
+
+import sqlite3
+import threading
+import time
+
+DEFAULT_SHARD_SIZE = 1000
+DEFAULT_LEASE_SECONDS = 600
+
+# Attempts after which a shard is no longer handed out
+MAX_ATTEMPTS = 3
+
+# Seconds to wait for another worker's write transaction
+BUSY_TIMEOUT = 30
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shards (
+    kind TEXT NOT NULL,
+    start_id INTEGER NOT NULL,
+    end_id INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    written INTEGER,
+    failed INTEGER,
+    error TEXT,
+    PRIMARY KEY (kind, start_id)
+);
+CREATE TABLE IF NOT EXISTS failures (
+    kind TEXT NOT NULL,
+    item_id INTEGER NOT NULL,
+    error TEXT,
+    PRIMARY KEY (kind, item_id)
+);
+"""
+
+class Shard:
+    """
+    A leased range of IDs.
+
+    Args:
+        kind (str): Record kind, e.g. "compound" or "substance"
+        start_id (int): First ID of the shard
+        end_id (int): Last ID of the shard
+        attempts (int): Number of times the shard has been leased
+    """
+
+    def __init__(self, kind, start_id, end_id, attempts):
+        self.kind = kind
+        self.start_id = start_id
+        self.end_id = end_id
+        self.attempts = attempts
+
+    def __repr__(self):
+        return f"Shard({self.kind} {self.start_id}-{self.end_id}, attempt {self.attempts})"
+
+class ShardCoordinator:
+    """
+    SQLite backed shard table shared by every crawl worker.
+
+    Lease expiry uses wall-clock time, so hosts sharing the file need
+    synchronized clocks. The database uses SQLite's rollback journal, which
+    relies only on file locks, so it can sit on a network file system whose
+    locking works.
+
+    Args:
+        path (str): SQLite database file
+        lease_seconds (float): Lease duration before a shard is handed out again
+    """
+
+    def __init__(self, path, lease_seconds=DEFAULT_LEASE_SECONDS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+        try:
+            # Rollback journal, not WAL: WAL's shared-memory index only works
+            # between processes of one host, not over a network file system.
+            # Also switches back files created in WAL mode by earlier versions.
+            connection.execute("PRAGMA journal_mode=DELETE")
+            connection.executescript(_SCHEMA)
+        finally:
+            connection.close()
+
+    def _connect(self):
+        # One connection per operation: safe to use from several threads, and
+        # "with" commits (or rolls back) the transaction
+        return _Transaction(sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None))
+
+    def add_range(self, kind, start_id, end_id, shard_size=DEFAULT_SHARD_SIZE):
+        """
+        Splits an ID range into shards. Shards that already exist are kept as
+        they are, so the same range can be added again safely.
+
+        Args:
+            kind (str): Record kind
+            start_id (int): First ID of the range
+            end_id (int): Last ID of the range
+            shard_size (int): IDs per shard
+
+        Returns:
+            int: Number of new shards
+        """
+        shards = [(kind, first, min(first + shard_size - 1, end_id))
+                  for first in range(start_id, end_id + 1, shard_size)]
+        with self._connect() as connection:
+            before = connection.total_changes
+            connection.executemany("INSERT OR IGNORE INTO shards (kind, start_id, end_id) VALUES (?, ?, ?)", shards)
+            return connection.total_changes - before
+
+    def lease(self, worker_id, kinds=None):
+        """
+        Leases the next available shard: a pending one, or one whose lease
+        expired without being completed.
+
+        Args:
+            worker_id (str): Identifier of the leasing worker
+            kinds (list): Only lease shards of these kinds (None leases any)
+
+        Returns:
+            Shard: The leased shard, or None if no shard is available
+        """
+        now = time.time()
+        query = ("SELECT kind, start_id, end_id, attempts FROM shards "
+                 "WHERE (status = 'pending' OR (status = 'leased' AND lease_expires < ? AND attempts < ?))")
+        params = [now, MAX_ATTEMPTS]
+        if kinds:
+            query += f" AND kind IN ({', '.join('?' * len(kinds))})"
+            params.extend(kinds)
+        query += " ORDER BY start_id, kind LIMIT 1"
+
+        with self._connect() as connection:
+            # Shards whose workers kept dying are given up on
+            connection.execute(
+                "UPDATE shards SET status = 'failed', worker = NULL, lease_expires = NULL, error = 'lease expired' "
+                "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, MAX_ATTEMPTS),
+            )
+            row = connection.execute(query, params).fetchone()
+            if row is None:
+                return None
+            kind, start_id, end_id, attempts = row
+            connection.execute(
+                "UPDATE shards SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 "
+                "WHERE kind = ? AND start_id = ?",
+                (worker_id, now + self.lease_seconds, kind, start_id),
+            )
+        return Shard(kind, start_id, end_id, attempts + 1)
+
+    def _update_owned(self, shard, worker_id, assignments, params, extra=None):
+        """
+        Updates a shard only while worker_id still holds its lease.
+
+        Returns:
+            bool: True if the lease was still held
+        """
+        with self._connect() as connection:
+            updated = connection.execute(
+                f"UPDATE shards SET {assignments} "
+                "WHERE kind = ? AND start_id = ? AND worker = ? AND status = 'leased'",
+                (*params, shard.kind, shard.start_id, worker_id),
+            ).rowcount
+            if updated and extra is not None:
+                extra(connection)
+        return bool(updated)
+
+    def renew(self, shard, worker_id):
+        """
+        Extends a lease.
+
+        Args:
+            shard (Shard): Leased shard
+            worker_id (str): Identifier of the leasing worker
+
+        Returns:
+            bool: False if the lease was lost (expired and taken by another worker)
+        """
+        return self._update_owned(shard, worker_id, "lease_expires = ?", (time.time() + self.lease_seconds,))
+
+    def complete(self, shard, worker_id, counts):
+        """
+        Marks a shard as done and records its failed IDs.
+
+        Args:
+            shard (Shard): Leased shard
+            worker_id (str): Identifier of the leasing worker
+            counts (dict): Counts returned by run_pipeline, with the failed IDs'
+                errors under "errors"
+
+        Returns:
+            bool: False if the lease was lost and the report was ignored
+        """
+        errors = counts.get("errors", {})
+
+        def record_failures(connection):
+            connection.execute("DELETE FROM failures WHERE kind = ? AND item_id BETWEEN ? AND ?",
+                               (shard.kind, shard.start_id, shard.end_id))
+            connection.executemany("INSERT INTO failures (kind, item_id, error) VALUES (?, ?, ?)",
+                                   [(shard.kind, item_id, error) for item_id, error in errors.items()])
+
+        return self._update_owned(
+            shard, worker_id, "status = 'done', lease_expires = NULL, written = ?, failed = ?, error = NULL",
+            (counts.get("written", 0), counts.get("failed", len(errors))), extra=record_failures,
+        )
+
+    def fail(self, shard, worker_id, error):
+        """
+        Reports a shard that could not be processed. It is handed out again
+        until it has been attempted MAX_ATTEMPTS times.
+
+        Args:
+            shard (Shard): Leased shard
+            worker_id (str): Identifier of the leasing worker
+            error (str): Error message
+
+        Returns:
+            bool: False if the lease was lost and the report was ignored
+        """
+        status = "failed" if shard.attempts >= MAX_ATTEMPTS else "pending"
+        return self._update_owned(shard, worker_id, "status = ?, worker = NULL, lease_expires = NULL, error = ?",
+                                  (status, error))
+
+    def release(self, shard, worker_id):
+        """
+        Gives a shard back without counting the attempt, e.g. on shutdown.
+
+        Args:
+            shard (Shard): Leased shard
+            worker_id (str): Identifier of the leasing worker
+
+        Returns:
+            bool: False if the lease was already lost
+        """
+        return self._update_owned(shard, worker_id,
+                                  "status = 'pending', worker = NULL, lease_expires = NULL, attempts = attempts - 1", ())
+
+    def status(self):
+        """
+        Summarizes the crawl.
+
+        Returns:
+            dict: {kind: {"shards": {status: count}, "written": int, "failed": int}}
+        """
+        summary = {}
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT kind, status, COUNT(*), COALESCE(SUM(written), 0), COALESCE(SUM(failed), 0) "
+                "FROM shards GROUP BY kind, status ORDER BY kind, status"
+            ).fetchall()
+        for kind, status, shards, written, failed in rows:
+            entry = summary.setdefault(kind, {"shards": {}, "written": 0, "failed": 0})
+            entry["shards"][status] = shards
+            entry["written"] += written
+            entry["failed"] += failed
+        return summary
+
+class _Transaction:
+    """
+    Context manager running one write transaction on a fresh connection.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        # Take the write lock up front, so lease's SELECT and UPDATE are atomic
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, exc, traceback):
+        try:
+            self.connection.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        finally:
+            self.connection.close()
+
+class _LeaseRenewer(threading.Thread):
+    """
+    Background thread renewing a lease every third of its duration.
+    """
+
+    def __init__(self, coordinator, shard, worker_id):
+        super().__init__(daemon=True)
+        self.coordinator = coordinator
+        self.shard = shard
+        self.worker_id = worker_id
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.coordinator.lease_seconds / 3):
+            if not self.coordinator.renew(self.shard, self.worker_id):
+                print(f"Lost the lease on {self.shard}")
+                return
+
+def run_worker(coordinator, worker_id, process_shard, kinds=None):
+    """
+    Leases and processes shards until none is left.
+
+    Args:
+        coordinator (ShardCoordinator): Shared shard table
+        worker_id (str): Unique identifier of this worker
+        process_shard (callable): Function receiving a Shard and returning the
+            run_pipeline counts
+        kinds (list): Only process shards of these kinds (None processes any)
+
+    Returns:
+        int: Number of shards completed by this worker
+    """
+    completed = 0
+    while True:
+        shard = coordinator.lease(worker_id, kinds)
+        if shard is None:
+            return completed
+
+        print(f"{worker_id}: processing {shard}")
+        renewer = _LeaseRenewer(coordinator, shard, worker_id)
+        renewer.start()
+        try:
+            counts = process_shard(shard)
+        except KeyboardInterrupt:
+            coordinator.release(shard, worker_id)
+            raise
+        except Exception as e:
+            # One broken shard must not stop the worker
+            print(f"{worker_id}: {shard} failed: {e}")
+            coordinator.fail(shard, worker_id, str(e))
+            continue
+        finally:
+            renewer.stopped.set()
+            renewer.join()
+
+        if coordinator.complete(shard, worker_id, counts):
+            completed += 1
+        else:
+            print(f"{worker_id}: lease on {shard} expired before it finished, result not recorded")
@@ -0,0 +1,281 @@
+"""
+Sharded Output Writer
+
+This module writes records as compressed JSON Lines shards instead of one
+large file. A new shard is started once the current one reaches a record
+count or an (uncompressed) byte size, and a manifest lists every shard with
+its record count, sizes and SHA-256 checksum, so downstream loaders can
+verify the shards and process them in parallel.
+
+The manifest is rewritten whenever a shard is opened or finished, and only
+lists finished shards. A run interrupted mid-shard can be resumed: the
+unfinished shard is deleted, its records are written again, and shard numbers
+are never reused.
+
+Shards are gzip compressed, or zstd compressed when the zstandard package is
+installed. Either way they are plain JSON Lines once decompressed.
+
+Features:
+- gzip or zstd compressed JSON Lines shards
+- Rotation on record count or byte size
+- Manifest with per-shard counts, sizes and checksums, written atomically
+- Resumable after an interruption; stale shards of earlier runs removed
+- Readers for plain, .gz and .zst JSON Lines files
+
+Author: Israel Neto
+Date: 2024
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import os
+from contextlib import contextmanager
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compression -> shard file extension
+COMPRESSIONS = {
+    "gzip": ".jsonl.gz",
+    "zstd": ".jsonl.zst",
+}
+
+DEFAULT_COMPRESSION = "gzip"
+DEFAULT_MAX_RECORDS = 100000
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+MANIFEST_FILE = "manifest.json"
+
+class _ChecksumFile:
+    """
+    Write-only file wrapper hashing and counting the bytes written through it.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.raw.write(data)
+
+    def flush(self):
+        self.raw.flush()
+
+    def close(self):
+        self.raw.close()
+
+    @property
+    def closed(self):
+        return self.raw.closed
+
+class ShardedWriter:
+    """
+    Streams encoded records into rotating compressed shards.
+
+    Args:
+        directory (str): Directory receiving the shards and manifest.json
+        prefix (str): Shard file name prefix, e.g. "part" for part-00000.jsonl.gz
+        compression (str): "gzip" or "zstd"
+        max_records (int): Records per shard
+        max_bytes (int): Uncompressed bytes per shard (a single larger record
+            still gets written)
+        resume (bool): Keep the finished shards of an interrupted run and add
+            to them (otherwise the directory's shards and manifest are
+            removed first)
+
+    Raises:
+        ValueError: If the compression is unknown, or differs from the one of
+            the run being resumed
+        ImportError: If zstd is requested and zstandard is not installed
+    """
+
+    def __init__(self, directory, prefix="part", compression=DEFAULT_COMPRESSION, max_records=DEFAULT_MAX_RECORDS,
+                 max_bytes=DEFAULT_MAX_BYTES, resume=False):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression {compression!r}, expected one of {', '.join(COMPRESSIONS)}")
+        if compression == "zstd" and zstandard is None:
+            raise ImportError("zstd shards require zstandard (pip install zstandard)")
+        self.directory = directory
+        self.prefix = prefix
+        self.compression = compression
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.shards = []
+        self._next_number = 0
+        self._file = None
+        self._stream = None
+        self._records = 0
+        self._bytes = 0
+        os.makedirs(directory, exist_ok=True)
+        manifest_path = os.path.join(directory, MANIFEST_FILE)
+        if resume and os.path.exists(manifest_path):
+            manifest = read_manifest(directory)
+            if manifest["compression"] != compression:
+                raise ValueError(f"Cannot resume {manifest['compression']} shards with {compression} compression")
+            self.shards = manifest["shards"]
+            for number, shard in enumerate(self.shards):
+                shard.setdefault("number", number)
+            self._next_number = manifest.get("next_shard", len(self.shards))
+        kept = {shard["file"] for shard in self.shards}
+        # Shards of an earlier run, or the unfinished shard of an interrupted one
+        for name in os.listdir(directory):
+            if (name.startswith(f"{prefix}-") or name == MANIFEST_FILE) and name not in kept:
+                os.remove(os.path.join(directory, name))
+
+    @property
+    def finished_numbers(self):
+        """set: Numbers of the shards finished and listed in the manifest."""
+        return {shard["number"] for shard in self.shards}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, line):
+        """
+        Appends one encoded record, rotating to a new shard when needed.
+
+        The record only becomes durable once its shard is finished.
+
+        Args:
+            line (bytes): Encoded record, newline included
+
+        Returns:
+            tuple: (shard number, line number in the shard) of the record
+        """
+        if self._stream is not None and (self._records >= self.max_records
+                                         or self._bytes + len(line) > self.max_bytes):
+            self._close_shard()
+        if self._stream is None:
+            self._open_shard()
+        self._stream.write(line)
+        self._records += 1
+        self._bytes += len(line)
+        return self._number, self._records - 1
+
+    def _open_shard(self):
+        self._number = self._next_number
+        self._next_number += 1
+        # Reserve the number before the file exists, so it is never reused
+        self._write_manifest()
+        name = f"{self.prefix}-{self._number:05d}{COMPRESSIONS[self.compression]}"
+        self._file = _ChecksumFile(open(os.path.join(self.directory, name), "wb"))
+        if self.compression == "gzip":
+            # mtime=0 keeps the shards, and their checksums, reproducible
+            self._stream = gzip.GzipFile(filename="", mode="wb", fileobj=self._file, mtime=0)
+        else:
+            self._stream = zstandard.ZstdCompressor().stream_writer(self._file, closefd=False)
+        self._name = name
+        self._records = 0
+        self._bytes = 0
+
+    def _close_shard(self):
+        self._stream.close()
+        self._file.raw.flush()
+        os.fsync(self._file.raw.fileno())
+        self._file.close()
+        self.shards.append({
+            "file": self._name,
+            "number": self._number,
+            "records": self._records,
+            "bytes": self._bytes,
+            "compressed_bytes": self._file.size,
+            "sha256": self._file.sha256.hexdigest(),
+        })
+        self._stream = None
+        self._file = None
+        self._write_manifest()
+
+    def _write_manifest(self):
+        manifest = {
+            "compression": self.compression,
+            "records": sum(shard["records"] for shard in self.shards),
+            "next_shard": self._next_number,
+            "shards": self.shards,
+        }
+        manifest_path = os.path.join(self.directory, MANIFEST_FILE)
+        temporary_path = f"{manifest_path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=4)
+        os.replace(temporary_path, manifest_path)
+        return manifest
+
+    def close(self):
+        """
+        Finishes the last shard and writes the manifest.
+
+        Returns:
+            dict: The manifest
+        """
+        if self._stream is not None:
+            self._close_shard()
+        return self._write_manifest()
+
+def read_manifest(directory):
+    """
+    Reads the manifest of a shard directory.
+
+    Args:
+        directory (str): Directory written by a ShardedWriter
+
+    Returns:
+        dict: The manifest, with the shard files as full paths under "paths"
+    """
+    with open(os.path.join(directory, MANIFEST_FILE)) as manifest_file:
+        manifest = json.load(manifest_file)
+    manifest["paths"] = [os.path.join(directory, shard["file"]) for shard in manifest["shards"]]
+    return manifest
+
+def verify_shard(directory, shard):
+    """
+    Checks a shard file against its manifest entry.
+
+    Args:
+        directory (str): Shard directory
+        shard (dict): Manifest entry of the shard
+
+    Returns:
+        bool: Whether the file's size and SHA-256 checksum match
+    """
+    sha256 = hashlib.sha256()
+    size = 0
+    with open(os.path.join(directory, shard["file"]), "rb") as shard_file:
+        for block in iter(lambda: shard_file.read(1024 * 1024), b""):
+            sha256.update(block)
+            size += len(block)
+    return size == shard["compressed_bytes"] and sha256.hexdigest() == shard["sha256"]
+
+@contextmanager
+def open_lines(path):
+    """
+    Opens a JSON Lines file for reading, decompressing .gz and .zst files.
+
+    Args:
+        path (str): Plain, gzip or zstd compressed JSON Lines file
+
+    Yields:
+        file: Binary file iterating over the decompressed lines
+
+    Raises:
+        ImportError: If the file is zstd compressed and zstandard is not installed
+    """
+    if path.endswith(".gz"):
+        lines_file = gzip.open(path, "rb")
+    elif path.endswith(".zst"):
+        if zstandard is None:
+            raise ImportError("Reading zstd shards requires zstandard (pip install zstandard)")
+        lines_file = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True))
+    else:
+        lines_file = open(path, "rb")
+    try:
+        yield lines_file
+    finally:
+        lines_file.close()
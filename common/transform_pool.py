@@ -0,0 +1,113 @@
+"""
+Parallel Transform Stage
+
+This module runs the transform and encode step of the pipeline, either in the
+calling process or spread over a pool of worker processes, so that the pure
+Python record transforms can use every core once fetching stops being the
+bottleneck.
+
+Features:
+- Serial or process-pool transforms behind one generator
+- Records sent to the workers in chunks to amortize inter-process overhead
+- Results yielded in input order, identical to the serial path
+- Bounded number of chunks in flight, keeping memory flat
+- Transform and encode times reported to the parent's metrics
+
+Author: Israel Neto
+Date: 2024
+"""
+
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from . import metrics
+
+# Records sent to a worker process at once
+DEFAULT_CHUNK_SIZE = 16
+
+# Chunks queued per worker process ahead of the one being written
+CHUNKS_PER_WORKER = 2
+
+def transform_chunk(transform_one, encode, chunk):
+    """
+    Transforms and encodes a chunk of records.
+
+    Args:
+        transform_one (callable): Function receiving (ID, data) and returning
+            the transformed record, or None to skip it
+        encode (callable): Function encoding a record to bytes
+        chunk (list): (ID, data) tuples
+
+    Returns:
+        tuple: (encoded lines (ending with a newline) or None for skipped
+        records, (transform seconds, encode seconds) of every record)
+    """
+    lines = []
+    timings = []
+    for item_id, data in chunk:
+        started = time.perf_counter()
+        record = transform_one(item_id, data)
+        transformed = time.perf_counter()
+        lines.append(None if record is None else encode(record) + b"\n")
+        timings.append((transformed - started, time.perf_counter() - transformed))
+    return lines, timings
+
+def _record_timings(timings):
+    # Worker processes have their own metrics, so the parent records them
+    for transform_seconds, encode_seconds in timings:
+        metrics.STAGE_SECONDS.observe(transform_seconds, "transform")
+        metrics.STAGE_SECONDS.observe(encode_seconds, "encode")
+
+def _yield_chunk(chunk_ids, future):
+    lines, timings = future.result()
+    _record_timings(timings)
+    yield from zip(chunk_ids, lines)
+
+def iter_transform(items, transform_one, encode, workers=0, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Transforms and encodes records, yielding them in input order.
+
+    With workers > 0 the records are transformed in worker processes, so
+    transform_one and encode must be picklable (module-level functions or
+    functools.partial objects wrapping them).
+
+    Args:
+        items (iterable): (ID, data) tuples
+        transform_one (callable): Function receiving (ID, data) and returning
+            the transformed record, or None to skip it
+        encode (callable): Function encoding a record to bytes
+        workers (int): Number of worker processes (0 transforms in this process)
+        chunk_size (int): Records sent to a worker at once
+
+    Yields:
+        tuple: (ID, encoded line or None if the record was skipped)
+    """
+    if workers <= 0:
+        for item_id, data in items:
+            lines, timings = transform_chunk(transform_one, encode, [(item_id, data)])
+            _record_timings(timings)
+            yield item_id, lines[0]
+        return
+
+    max_pending = workers * CHUNKS_PER_WORKER
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        chunk = []
+
+        def submit():
+            pending.append(([item_id for item_id, _ in chunk],
+                            pool.submit(transform_chunk, transform_one, encode, chunk)))
+
+        for item in items:
+            chunk.append(item)
+            if len(chunk) >= chunk_size:
+                submit()
+                chunk = []
+            # Hand out finished chunks early, and wait once enough are queued
+            while pending and (pending[0][1].done() or len(pending) >= max_pending):
+                yield from _yield_chunk(*pending.popleft())
+        if chunk:
+            submit()
+        while pending:
+            yield from _yield_chunk(*pending.popleft())
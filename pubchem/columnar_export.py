@@ -0,0 +1,253 @@
+"""
+Columnar Compound Export
+
+This module exports transformed compound records to typed columnar files
+(Parquet or Arrow IPC) for analytics. The nested compound layout is flattened
+into one column per field, numeric fields become real floats and ints, and
+the "Unknown" / empty string sentinels become nulls.
+
+Column names join the nested keys with "_", e.g.
+physicalProperties_molecularWeight.
+
+Features:
+- Fixed, typed schema flattened from the compound layout
+- Parquet (.parquet) or Arrow IPC (.arrow / .feather) output
+- Chunked conversion and writes, keeping memory bounded
+- Streams the pipeline's JSON Lines output or its compressed shards
+
+Author: Israel Neto
+Date: 2024
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from common import json_backend
+from common.shard_writer import open_lines, read_manifest
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Records converted and written at once (one Parquet row group each)
+DEFAULT_CHUNK_SIZE = 10000
+
+# Values the transform uses for missing data
+_MISSING = (None, "", "Unknown")
+
+def _to_string(value):
+    return None if value in _MISSING else str(value)
+
+def _to_float(value):
+    if isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _to_int(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    number = _to_float(value)
+    return int(number) if number is not None and number.is_integer() else None
+
+def _to_bool(value):
+    return value if isinstance(value, bool) else None
+
+def _to_strings(value):
+    return [str(item) for item in value] if isinstance(value, list) else None
+
+_SPECTRUM_FIELDS = ("instrument", "solvent", "frequency", "shifts")
+
+def _to_spectra(value):
+    if not isinstance(value, list):
+        return None
+    return [{field: _to_string(spectrum.get(field)) for field in _SPECTRUM_FIELDS} for spectrum in value]
+
+# Column type -> (pyarrow type factory, value converter)
+_TYPES = {
+    "string": (lambda: pyarrow.string(), _to_string),
+    "float": (lambda: pyarrow.float64(), _to_float),
+    "int": (lambda: pyarrow.int64(), _to_int),
+    "bool": (lambda: pyarrow.bool_(), _to_bool),
+    "strings": (lambda: pyarrow.list_(pyarrow.string()), _to_strings),
+    "spectra": (lambda: pyarrow.list_(pyarrow.struct([(field, pyarrow.string()) for field in _SPECTRUM_FIELDS])),
+                _to_spectra),
+}
+
+# Path of every exported field in the compound layout, with its column type
+COMPOUND_COLUMNS = [
+    ("basicInfo/type", "string"),
+    ("basicInfo/moleculeName", "string"),
+    # String: PubChem CIDs and ChEMBL IDs ("CHEMBL25") share this field
+    ("basicInfo/recordNumber", "string"),
+    ("basicInfo/source", "string"),
+    ("basicInfo/drugBankId", "string"),
+    ("basicInfo/casRegistryNumber", "string"),
+    ("basicInfo/unii", "string"),
+    ("basicInfo/chebiId", "string"),
+    ("basicInfo/description", "string"),
+    ("identifiers/pubChemCID", "int"),
+    ("identifiers/chemblId", "string"),
+    ("identifiers/wikidata", "string"),
+    ("identifiers/hmdbID", "string"),
+    ("identifiers/lipidMapsID", "string"),
+    ("identifiers/nciThesaurusCode", "string"),
+    ("identifiers/metabolomicsWorkbenchID", "string"),
+    ("identifiers/dssToxID", "string"),
+    ("structure/smilesStructure", "string"),
+    ("structure/inchiString", "string"),
+    ("structure/inchiKey", "string"),
+    ("structure/molecularFormula", "string"),
+    ("physicalProperties/molecularWeight", "float"),
+    ("physicalProperties/exactMass", "float"),
+    ("physicalProperties/monoisotopicMass", "float"),
+    ("physicalProperties/xlogp3", "float"),
+    ("physicalProperties/formalCharge", "int"),
+    ("physicalProperties/complexity", "float"),
+    ("physicalProperties/topologicalPolarSurfaceArea", "float"),
+    ("physicalProperties/heavyAtomCount", "int"),
+    ("physicalProperties/meltingPoint", "string"),
+    ("physicalProperties/solubility", "string"),
+    ("bondInformation/hydrogenBondDonorCount", "int"),
+    ("bondInformation/hydrogenBondAcceptorCount", "int"),
+    ("bondInformation/rotatableBondCount", "int"),
+    ("bondInformation/covalentlyBondedUnitCount", "int"),
+    ("stereochemistry/definedAtomStereocenterCount", "int"),
+    ("stereochemistry/undefinedAtomStereocenterCount", "int"),
+    ("stereochemistry/definedBondStereocenterCount", "int"),
+    ("stereochemistry/undefinedBondStereocenterCount", "int"),
+    ("stereochemistry/isotopeAtomCount", "int"),
+    ("stereochemistry/isRacemic", "bool"),
+    ("pharmacology/indications/text", "string"),
+    ("pharmacology/overview", "string"),
+    ("pharmacology/mechanism", "string"),
+    ("pharmacology/pharmacodynamics", "string"),
+    ("pharmacology/absorption", "string"),
+    ("pharmacology/routeOfElimination", "string"),
+    ("pharmacology/classification/meshPharmacological", "strings"),
+    ("synonyms", "strings"),
+    ("spectralData/nmr/proton", "spectra"),
+    ("spectralData/nmr/carbon", "spectra"),
+    ("spectralData/massSpectrometry/precursorMZ", "string"),
+    ("spectralData/massSpectrometry/topPeaks", "string"),
+    ("biologicalProperties/organismPresence", "strings"),
+    ("biologicalProperties/biochemicalFunction", "string"),
+    ("commercialAvailability/regulatoryStatus/approved", "strings"),
+    ("commercialAvailability/regulatoryStatus/investigational", "strings"),
+    ("metadata/createDate", "string"),
+    ("metadata/modifyDate", "string"),
+    ("metadata/dataSource", "string"),
+]
+
+def column_name(path):
+    """
+    Returns the flattened column name of a layout path.
+
+    Args:
+        path (str): "/" separated path in the compound layout
+
+    Returns:
+        str: Column name
+    """
+    return path.replace("/", "_")
+
+def compound_schema():
+    """
+    Builds the Arrow schema of the compound columns.
+
+    Returns:
+        pyarrow.Schema: Schema with one nullable field per column
+    """
+    return pyarrow.schema([(column_name(path), _TYPES[kind][0]()) for path, kind in COMPOUND_COLUMNS])
+
+def _lookup(record, keys):
+    value = record
+    for key in keys:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+def records_to_batch(records, schema):
+    """
+    Converts compound records to a typed record batch.
+
+    Args:
+        records (list): Transformed compound records
+        schema (pyarrow.Schema): Schema returned by compound_schema
+
+    Returns:
+        pyarrow.RecordBatch: One row per record
+    """
+    arrays = []
+    for (path, kind), field in zip(COMPOUND_COLUMNS, schema):
+        keys = path.split("/")
+        convert = _TYPES[kind][1]
+        arrays.append(pyarrow.array([convert(_lookup(record, keys)) for record in records], type=field.type))
+    return pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
+
+def _iter_chunks(jsonl_file, chunk_size):
+    paths = read_manifest(jsonl_file)["paths"] if os.path.isdir(jsonl_file) else [jsonl_file]
+    chunk = []
+    for path in paths:
+        with open_lines(path) as lines_file:
+            for line in lines_file:
+                if line.strip():
+                    chunk.append(json_backend.loads(line))
+                    if len(chunk) >= chunk_size:
+                        yield chunk
+                        chunk = []
+    if chunk:
+        yield chunk
+
+def export_compounds(jsonl_file, output_file, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Exports a compound JSON Lines file to a typed columnar file.
+
+    The format follows the output extension: .parquet writes Parquet (one row
+    group per chunk), .arrow or .feather writes an Arrow IPC file.
+
+    Args:
+        jsonl_file (str): Compound JSON Lines file written by the pipeline, or
+            the directory of its shards
+        output_file (str): Path of the columnar file
+        chunk_size (int): Records converted and written at once
+
+    Returns:
+        int: Number of exported records
+
+    Raises:
+        ImportError: If pyarrow is not installed
+    """
+    if pyarrow is None:
+        raise ImportError("Columnar export requires pyarrow (pip install pyarrow)")
+
+    schema = compound_schema()
+    if output_file.endswith(".parquet"):
+        writer = pyarrow.parquet.ParquetWriter(output_file, schema)
+    else:
+        writer = pyarrow.ipc.new_file(output_file, schema)
+
+    rows = 0
+    with writer:
+        for chunk in _iter_chunks(jsonl_file, chunk_size):
+            batch = records_to_batch(chunk, schema)
+            if output_file.endswith(".parquet"):
+                writer.write_table(pyarrow.Table.from_batches([batch]))
+            else:
+                writer.write_batch(batch)
+            rows += len(chunk)
+    return rows
+
+if __name__ == "__main__":
+    rows = export_compounds("final_pubchem_compound_data.jsonl", "final_pubchem_compound_data.parquet")
+    print(f"{rows} compounds exported to final_pubchem_compound_data.parquet")
@@ -16,590 +16,387 @@ Author: Israel Neto
 Date: 2024
 """
 
+import functools
+import os
+import sys
+
 import requests
-import json
 
-def remove_references(data):
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from common import http_client
+from common.fetch_engine import DEFAULT_MAX_CONCURRENCY, WINDOW_PER_SLOT
+from common.missing_ids import live_ids
+from common.pipeline import jsonl_path, run_pipeline
+from common.refresh_index import content_hash
+from common.response_cache import ResponseCache
+from compound_record import CompoundRecord
+from pug_rest import PROPERTY_BATCH_SIZE, PropertyBatcher, fetch_existing_ids
+from pug_view import heading_url, load_record, merge_documents
+from section_extractor import (SectionExtractor, collect_strings, first_number, first_string, last_date,
+                               named_string, string_or_number)
+
+PUG_VIEW_COMPOUND_URL = "https://pubchem.ncbi.nlm.nih.gov/rest/pug_view/data/compound/{}/JSON/"
+
+def fetch_compound(compound_id, cache=None, headings=None, properties=None, descriptors_only=False):
     """
-    Removes reference metadata from the PubChem data structure.
+    Fetches a single compound record from PubChem, without its references
+    or the top-level sections the transform does not read.
     
     Args:
-        data (dict/list): Raw PubChem data structure
+        compound_id (int): PubChem compound ID
+        cache (ResponseCache): Optional response cache to read through
+        headings (list): Only download these TOCHeadings, one request each,
+            and merge them into one record (None downloads the full record)
+        properties (PropertyBatcher): Optional source of the computed
+            descriptors, added to the data under "Properties"
+        descriptors_only (bool): Skip the PUG View record and only return the
+            computed descriptors (requires properties)
         
     Returns:
-        dict/list: Cleaned data structure without references
+        dict: Cleaned PubChem data, or {"error": message, "missing": bool} if
+        the request failed, "missing" telling whether PubChem answered 404
     """
-    if isinstance(data, dict):
-        if "Reference" in data:
-            del data["Reference"]
-        for key, value in data.items():
-            data[key] = remove_references(value)
-    elif isinstance(data, list):
-        data = [remove_references(item) for item in data]
+    url = PUG_VIEW_COMPOUND_URL.format(compound_id)
+    try:
+        computed = properties.get(compound_id) if properties is not None else None
+        if descriptors_only:
+            if computed is None:
+                # Left out of the batch answer: the CID does not exist, like a 404
+                print(f"Error fetching data for compound {compound_id}: PubChem has no computed properties")
+                return {"error": "PubChem has no computed properties for this compound", "missing": True}
+            data = {"Record": {"RecordNumber": compound_id, "RecordTitle": computed["title"]}}
+        elif headings is None:
+            data = load_record(http_client.get_content(url, cache=cache), COMPOUND_SCOPED_HEADINGS)
+        else:
+            data = _fetch_headings(url, headings, cache)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"Error fetching data for compound {compound_id}: {e}")
+        return {"error": str(e), "missing": http_client.is_not_found(e)}
+    if computed is not None:
+        data["Properties"] = computed["fields"]
     return data
 
-def process_compound_data(start_id, end_id, output_file, source_type):
+def _fetch_headings(url, headings, cache):
     """
-    Processes compound data from PubChem for a range of compound IDs.
+    Downloads the given headings of a record and merges them.
+    
+    A heading the record does not have answers 404 and is skipped; the record
+    itself is missing only if every heading answers 404.
     
     Args:
-        start_id (int): Starting compound ID
-        end_id (int): Ending compound ID
-        output_file (str): Path to output JSON file
-        source_type (str): Type identifier for the data source
+        url (str): Full-record PUG View URL
+        headings (list): TOCHeadings to download
+        cache (ResponseCache): Optional response cache to read through
+        
+    Returns:
+        dict: Merged PubChem data
+        
+    Raises:
+        requests.exceptions.HTTPError: If no heading could be downloaded
     """
-    # Fetch data
-    results = {}
-    for compound_id in range(start_id, end_id + 1):
-        url = f"https://pubchem.ncbi.nlm.nih.gov/rest/pug_view/data/compound/{compound_id}/JSON/"
+    documents = []
+    not_found = None
+    for heading in headings:
         try:
-            response = requests.get(url)
-            response.raise_for_status()
-            data = response.json()
-            processed_data = remove_references(data)
-            results[compound_id] = processed_data
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching data for compound {compound_id}: {e}")
-            results[compound_id] = {"error": str(e)}
-
-    # Transform data
-    transformed_data = []
-    for compound_id, compound_data in results.items():
-        if "Record" in compound_data:
-            record = compound_data["Record"]
-            molecule_name = record.get("RecordTitle", "Unknown")
-            record_number = record.get("RecordNumber", "Unknown")
-            
-            # Initialize values with defaults
-            smiles_structure = "Unknown"
-            inchi_string = "Unknown"
-            inchi_key = "Unknown"
-            molecular_formula = "Unknown"
-            molecular_weight = "Unknown"
-            drugbank_id = "Unknown"
-            category_usage = "Unknown"
-            description = "Unknown"
-            cas_registry_number = "Unknown"
-            unii = "Unknown"
-            chebi_id = "Unknown"
-            
-            # Initialize physical properties
-            xlogp3 = "Unknown"
-            hydrogen_bond_donor_count = "Unknown"
-            hydrogen_bond_acceptor_count = "Unknown"
-            rotatable_bond_count = "Unknown"
-            exact_mass = "Unknown"
-            monoisotopic_mass = "Unknown"
-            topological_polar_surface_area = "Unknown"
-            heavy_atom_count = "Unknown"
-            formal_charge = "Unknown"
-            complexity = "Unknown"
-            isotope_atom_count = "Unknown"
-            defined_atom_stereocenter_count = "Unknown"
-            undefined_atom_stereocenter_count = "Unknown"
-            defined_bond_stereocenter_count = "Unknown"
-            undefined_bond_stereocenter_count = "Unknown"
-            covalently_bonded_unit_count = "Unknown"
-            
-            # Initialize metadata
-            create_date = "Unknown"
-            modify_date = "Unknown"
-            
-            # Additional identifiers
-            hmdb_id = "Unknown"
-            lipid_maps_id = "Unknown"
-            nci_thesaurus_code = "Unknown"
-            metabolomics_workbench_id = "Unknown"
-            dsstox_id = "Unknown"
-            wikidata = "Unknown"
-            
-            # Spectral data placeholders
-            nmr_shifts_proton = []
-            nmr_shifts_carbon = []
-            mass_spec_peaks = ""
-            
-            # Additional properties
-            melting_point = "Unknown"
-            solubility = "Unknown"
-            
-            # Biological properties
-            organism_presence = []
-            biochemical_function = "Unknown"
-            
-            # Pharmacology fields
-            mechanism = "Unknown"
-            pharmacodynamics = "Unknown"
-            absorption = "Unknown"
-            route_of_elimination = "Unknown"
-            indications_text = "Unknown"
-            
-            # Synonyms list
-            synonyms = []
-            
-            sections = record.get("Section", [])
-            for section in sections:
-                # Names and Identifiers section
-                if section.get("TOCHeading") == "Names and Identifiers":
-                    for subsection in section.get("Section", []):
-                        if subsection.get("TOCHeading") == "Record Description":
-                            for info in subsection.get("Information", []):
-                                if info.get("Name") == "Record Description":
-                                    try:
-                                        description = info.get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "Unknown")
-                                    except (IndexError, TypeError):
-                                        pass
-                        
-                        elif subsection.get("TOCHeading") == "Computed Descriptors":
-                            for subsubsection in subsection.get("Section", []):
-                                if subsubsection.get("TOCHeading") == "SMILES":
-                                    try:
-                                        smiles_structure = subsubsection.get("Information", [{}])[0].get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "Unknown")
-                                    except (IndexError, TypeError):
-                                        pass
-                                elif subsubsection.get("TOCHeading") == "InChI":
-                                    try:
-                                        inchi_string = subsubsection.get("Information", [{}])[0].get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "Unknown")
-                                    except (IndexError, TypeError):
-                                        pass
-                                elif subsubsection.get("TOCHeading") == "InChIKey":
-                                    try:
-                                        inchi_key = subsubsection.get("Information", [{}])[0].get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "Unknown")
-                                    except (IndexError, TypeError):
-                                        pass
+            documents.append(load_record(http_client.get_content(heading_url(url, heading), cache=cache)))
+        except requests.exceptions.HTTPError as e:
+            if not http_client.is_not_found(e):
+                raise
+            not_found = e
+    if not documents:
+        raise not_found
+    return merge_documents(documents)
 
-                        elif subsection.get("TOCHeading") == "Molecular Formula":
-                            try:
-                                molecular_formula = subsection.get("Information", [{}])[0].get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "Unknown")
-                            except (IndexError, TypeError):
-                                pass
-                        
-                        elif subsection.get("TOCHeading") == "Other Identifiers":
-                            for identifier in subsection.get("Section", []):
-                                if identifier.get("TOCHeading") == "DrugBank ID":
-                                    try:
-                                        drugbank_id = identifier.get("Information", [{}])[0].get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "Unknown")
-                                    except (IndexError, TypeError):
-                                        pass
-                                elif identifier.get("TOCHeading") == "CAS":
-                                    try:
-                                        cas_registry_number = identifier.get("Information", [{}])[0].get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "Unknown")
-                                    except (IndexError, TypeError):
-                                        pass
-                                elif identifier.get("TOCHeading") == "UNII":
-                                    try:
-                                        unii = identifier.get("Information", [{}])[0].get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "Unknown")
-                                    except (IndexError, TypeError):
-                                        pass
-                                elif identifier.get("TOCHeading") == "ChEBI ID":
-                                    try:
-                                        chebi_id = identifier.get("Information", [{}])[0].get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "Unknown")
-                                    except (IndexError, TypeError):
-                                        pass
-                                elif identifier.get("TOCHeading") == "HMDB ID":
-                                    try:
-                                        hmdb_id = identifier.get("Information", [{}])[0].get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "Unknown")
-                                    except (IndexError, TypeError):
-                                        pass
-                                elif identifier.get("TOCHeading") == "Lipid Maps ID (LM_ID)":
-                                    try:
-                                        lipid_maps_id = identifier.get("Information", [{}])[0].get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "Unknown")
-                                    except (IndexError, TypeError):
-                                        pass
-                                elif identifier.get("TOCHeading") == "NCI Thesaurus Code":
-                                    try:
-                                        nci_thesaurus_code = identifier.get("Information", [{}])[0].get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "Unknown")
-                                    except (IndexError, TypeError):
-                                        pass
-                                elif identifier.get("TOCHeading") == "Metabolomics Workbench ID":
-                                    try:
-                                        metabolomics_workbench_id = identifier.get("Information", [{}])[0].get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "Unknown")
-                                    except (IndexError, TypeError):
-                                        pass
-                                elif identifier.get("TOCHeading") == "DSSTox Substance ID":
-                                    try:
-                                        dsstox_id = identifier.get("Information", [{}])[0].get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "Unknown")
-                                    except (IndexError, TypeError):
-                                        pass
-                                elif identifier.get("TOCHeading") == "Wikidata":
-                                    try:
-                                        wikidata = identifier.get("Information", [{}])[0].get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "Unknown")
-                                    except (IndexError, TypeError):
-                                        pass
-                        
-                        elif subsection.get("TOCHeading") == "Synonyms":
-                            for synonym_section in subsection.get("Section", []):
-                                for info in synonym_section.get("Information", []):
-                                    if "Value" in info and "StringWithMarkup" in info["Value"]:
-                                        for synonym_data in info["Value"]["StringWithMarkup"]:
-                                            if "String" in synonym_data and synonym_data["String"] not in synonyms and synonym_data["String"] != "":
-                                                synonyms.append(synonym_data["String"])
+def _nmr_spectra(include_frequency):
+    """
+    Builds an extractor appending the NMR spectra of a 1H/13C NMR section.
+    
+    Args:
+        include_frequency (bool): Also read the spectrometer frequency
+        
+    Returns:
+        callable: Value extractor
+    """
+    def extract(nmr_section, spectra):
+        for info in nmr_section.get("Information", []):
+            if info.get("Name") == "Shifts [ppm]:Intensity":
+                try:
+                    shifts = info.get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "")
+                    if shifts and shifts != "Unknown":
+                        nmr_data = {
+                            "instrument": "Bruker", # Default if not specified
+                            "solvent": "D2O",  # Default if not specified
+                            "shifts": shifts
+                        }
                         
-                        elif subsection.get("TOCHeading") == "Create Date":
-                            for info in subsection.get("Information", []):
-                                if "Value" in info and "DateISO8601" in info["Value"] and len(info["Value"]["DateISO8601"]) > 0:
-                                    create_date = info["Value"]["DateISO8601"][0]
+                        # Look for other NMR metadata in the same section
+                        for meta_info in nmr_section.get("Information", []):
+                            if meta_info.get("Name") == "Instrument Type":
+                                inst = meta_info.get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "")
+                                if inst:
+                                    nmr_data["instrument"] = inst
+                            elif meta_info.get("Name") == "Solvent":
+                                solv = meta_info.get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "")
+                                if solv:
+                                    nmr_data["solvent"] = solv
+                            elif include_frequency and meta_info.get("Name") == "Frequency":
+                                freq = meta_info.get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "")
+                                if freq:
+                                    nmr_data["frequency"] = freq
                         
-                        elif subsection.get("TOCHeading") == "Modify Date":
-                            for info in subsection.get("Information", []):
-                                if "Value" in info and "DateISO8601" in info["Value"] and len(info["Value"]["DateISO8601"]) > 0:
-                                    modify_date = info["Value"]["DateISO8601"][0]
+                        spectra.append(nmr_data)
+                except (IndexError, TypeError):
+                    pass
+        return spectra
+    return extract
+
+def _mass_spec_peaks(ms_section, mass_spec_peaks):
+    """
+    Reads the top peaks (or, failing that, the precursor m/z) of a mass spectrometry section.
+    """
+    for info in ms_section.get("Information", []):
+        if info.get("Name") == "Top 5 Peaks":
+            try:
+                peaks = info.get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "")
+                if peaks and peaks != "Unknown":
+                    mass_spec_peaks = peaks
+            except (IndexError, TypeError):
+                pass
+        elif info.get("Name") == "Precursor m/z" and not mass_spec_peaks:
+            try:
+                peaks = info.get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "")
+                if peaks and peaks != "Unknown":
+                    mass_spec_peaks = peaks
+            except (IndexError, TypeError):
+                pass
+    return mass_spec_peaks
+
+# Heading paths of the PUG View compound record mapped to transform fields
+COMPOUND_FIELDS = [
+    # Names and Identifiers section
+    ("Names and Identifiers/Record Description", "description", named_string("Record Description")),
+    ("Names and Identifiers/Computed Descriptors/SMILES", "smiles_structure", first_string),
+    ("Names and Identifiers/Computed Descriptors/InChI", "inchi_string", first_string),
+    ("Names and Identifiers/Computed Descriptors/InChIKey", "inchi_key", first_string),
+    ("Names and Identifiers/Molecular Formula", "molecular_formula", first_string),
+    ("Names and Identifiers/Other Identifiers/DrugBank ID", "drugbank_id", first_string),
+    ("Names and Identifiers/Other Identifiers/CAS", "cas_registry_number", first_string),
+    ("Names and Identifiers/Other Identifiers/UNII", "unii", first_string),
+    ("Names and Identifiers/Other Identifiers/ChEBI ID", "chebi_id", first_string),
+    ("Names and Identifiers/Other Identifiers/HMDB ID", "hmdb_id", first_string),
+    ("Names and Identifiers/Other Identifiers/Lipid Maps ID (LM_ID)", "lipid_maps_id", first_string),
+    ("Names and Identifiers/Other Identifiers/NCI Thesaurus Code", "nci_thesaurus_code", first_string),
+    ("Names and Identifiers/Other Identifiers/Metabolomics Workbench ID", "metabolomics_workbench_id", first_string),
+    ("Names and Identifiers/Other Identifiers/DSSTox Substance ID", "dsstox_id", first_string),
+    ("Names and Identifiers/Other Identifiers/Wikidata", "wikidata", first_string),
+    ("Names and Identifiers/Synonyms/*", "synonyms", collect_strings),
+    ("Names and Identifiers/Create Date", "create_date", last_date),
+    ("Names and Identifiers/Modify Date", "modify_date", last_date),
+    
+    # Chemical and Physical Properties section
+    ("Chemical and Physical Properties/Computed Properties/Molecular Weight", "molecular_weight", string_or_number),
+    ("Chemical and Physical Properties/Computed Properties/XLogP3", "xlogp3", first_number),
+    ("Chemical and Physical Properties/Computed Properties/Hydrogen Bond Donor Count", "hydrogen_bond_donor_count", first_number),
+    ("Chemical and Physical Properties/Computed Properties/Hydrogen Bond Acceptor Count", "hydrogen_bond_acceptor_count", first_number),
+    ("Chemical and Physical Properties/Computed Properties/Rotatable Bond Count", "rotatable_bond_count", first_number),
+    ("Chemical and Physical Properties/Computed Properties/Exact Mass", "exact_mass", string_or_number),
+    ("Chemical and Physical Properties/Computed Properties/Monoisotopic Mass", "monoisotopic_mass", string_or_number),
+    ("Chemical and Physical Properties/Computed Properties/Topological Polar Surface Area", "topological_polar_surface_area", first_number),
+    ("Chemical and Physical Properties/Computed Properties/Heavy Atom Count", "heavy_atom_count", first_number),
+    ("Chemical and Physical Properties/Computed Properties/Formal Charge", "formal_charge", first_number),
+    ("Chemical and Physical Properties/Computed Properties/Complexity", "complexity", first_number),
+    ("Chemical and Physical Properties/Computed Properties/Isotope Atom Count", "isotope_atom_count", first_number),
+    ("Chemical and Physical Properties/Computed Properties/Defined Atom Stereocenter Count", "defined_atom_stereocenter_count", first_number),
+    ("Chemical and Physical Properties/Computed Properties/Undefined Atom Stereocenter Count", "undefined_atom_stereocenter_count", first_number),
+    ("Chemical and Physical Properties/Computed Properties/Defined Bond Stereocenter Count", "defined_bond_stereocenter_count", first_number),
+    ("Chemical and Physical Properties/Computed Properties/Undefined Bond Stereocenter Count", "undefined_bond_stereocenter_count", first_number),
+    ("Chemical and Physical Properties/Computed Properties/Covalently-Bonded Unit Count", "covalently_bonded_unit_count", first_number),
+    ("Chemical and Physical Properties/Experimental Properties/Melting Point", "melting_point", first_string),
+    ("Chemical and Physical Properties/Experimental Properties/Solubility", "solubility", first_string),
+    
+    # Spectral Information section
+    ("Spectral Information/1D NMR Spectra/1H NMR Spectra", "nmr_shifts_proton", _nmr_spectra(include_frequency=True)),
+    ("Spectral Information/1D NMR Spectra/13C NMR Spectra", "nmr_shifts_carbon", _nmr_spectra(include_frequency=False)),
+    ("Spectral Information/Mass Spectrometry/*", "mass_spec_peaks", _mass_spec_peaks),
+    
+    # Drug and Medication Information section
+    ("Drug and Medication Information/Drug Indication", "indications_text", first_string),
+    
+    # Pharmacology and Biochemistry section
+    ("Pharmacology and Biochemistry/Pharmacodynamics", "pharmacodynamics", first_string),
+    ("Pharmacology and Biochemistry/Mechanism of Action", "mechanism", first_string),
+    ("Pharmacology and Biochemistry/Absorption, Distribution and Excretion", "absorption", named_string("Absorption")),
+    ("Pharmacology and Biochemistry/Absorption, Distribution and Excretion", "route_of_elimination", named_string("Route of Elimination")),
+]
+
+COMPOUND_EXTRACTOR = SectionExtractor(COMPOUND_FIELDS)
+
+# Top-level headings the transform reads. Downloading only these skips the
+# literature, patent, safety and bioassay sections that make up most of a
+# popular compound's record; full downloads drop the others on load.
+COMPOUND_SCOPED_HEADINGS = COMPOUND_EXTRACTOR.headings()
+
+# Reads only the Modify Date, to fingerprint records before transforming them
+_MODIFY_DATE_EXTRACTOR = SectionExtractor([entry for entry in COMPOUND_FIELDS if entry[1] == "modify_date"])
+
+_COMPOUND_DEFAULTS = {field: "Unknown" for _, field, _ in COMPOUND_FIELDS}
+
+def _compound_defaults():
+    """
+    Returns the default value of every extracted compound field.
+    """
+    values = _COMPOUND_DEFAULTS.copy()
+    values["synonyms"] = []
+    values["nmr_shifts_proton"] = []
+    values["nmr_shifts_carbon"] = []
+    values["mass_spec_peaks"] = ""
+    return values
+
+def transform_compound(compound_id, compound_data, source_type):
+    """
+    Transforms a cleaned PubChem compound record into the standardized format.
+    
+    Args:
+        compound_id (int): PubChem compound ID
+        compound_data (dict): Cleaned PubChem data returned by fetch_compound,
+            optionally with batched computed descriptors under "Properties"
+        source_type (str): Type identifier for the data source
+        
+    Returns:
+        CompoundRecord: Transformed compound, or None if the payload holds no Record
+    """
+    if "Record" not in compound_data:
+        return None
+
+    record = compound_data["Record"]
+    molecule_name = record.get("RecordTitle", "Unknown")
+    record_number = record.get("RecordNumber", "Unknown")
+    
+    values = COMPOUND_EXTRACTOR.extract(record.get("Section", []), _compound_defaults())
+    if "Properties" in compound_data:
+        # Batched PUG REST descriptors take precedence over the record's copy
+        values.update(compound_data["Properties"])
+    description = values["description"]
+    synonyms = list(dict.fromkeys(values["synonyms"]))
+    undefined_atom_stereocenter_count = values["undefined_atom_stereocenter_count"]
+    organism_presence = []
+    
+    # Process organism presence data from Record Description
+    if description != "Unknown":
+        # Extract organism mentions from description
+        organisms = []
+        if "found in " in description.lower():
+            org_part = description.lower().split("found in ")[1].split(".")[0]
+            organisms = [o.strip() for o in org_part.split(",")]
+        
+        if "human metabolite" in description.lower():
+            organisms.append("Human metabolite")
+        
+        if organisms:
+            organism_presence = organisms
+    
+    # Determine if racemic based on the name or stereochemistry information
+    is_racemic = False
+    if "DL-" in molecule_name or undefined_atom_stereocenter_count != "Unknown" and int(undefined_atom_stereocenter_count) > 0:
+        is_racemic = True
+    
+    # Slotted record; to_dict() gives the format.json structure
+    return CompoundRecord(source_type, compound_id, molecule_name, record_number, values, synonyms,
+                          organism_presence, is_racemic)
+
+def fingerprint_compound(compound_id, compound_data):
+    """
+    Fingerprints a fetched compound for incremental refreshes.
+    
+    Args:
+        compound_id (int): PubChem compound ID
+        compound_data (dict): Cleaned PubChem data returned by fetch_compound
+        
+    Returns:
+        tuple: (Modify Date, content hash)
+    """
+    sections = compound_data.get("Record", {}).get("Section", [])
+    modify_date = _MODIFY_DATE_EXTRACTOR.extract(sections, {"modify_date": "Unknown"})["modify_date"]
+    return modify_date, content_hash(compound_data)
+
+def process_compound_data(start_id, end_id, output_file, source_type, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                           cache=None, resume=False, json_array=True, compact=False, transform_workers=0,
+                           refresh_index=None, headings=None, batch_properties=False, descriptors_only=False,
+                           batch_size=PROPERTY_BATCH_SIZE, merge_index=None,
+                           missing_ids=None, check_existence=False, shard_writer=None):
+    """
+    Processes compound data from PubChem for a range of compound IDs.
+    
+    Args:
+        start_id (int): Starting compound ID
+        end_id (int): Ending compound ID
+        output_file (str): Path to output JSON file; records are streamed to
+            the same path with a .jsonl extension
+        source_type (str): Type identifier for the data source
+        max_concurrency (int): Maximum number of requests in flight at once
+        cache (ResponseCache): Optional response cache to read through
+        resume (bool): Continue the run journaled in output_file + ".journal"
+            instead of starting over; failed IDs are retried
+        json_array (bool): Also write the records as one JSON array to output_file
+        compact (bool): Write compact JSON with the fast JSON backend instead of
+            the indented format
+        transform_workers (int): Worker processes transforming records in
+            parallel, output staying in ID order (0 transforms them serially)
+        refresh_index (RefreshIndex): Fingerprints of previous runs; when given,
+            only new and changed compounds are transformed and written, so the
+            output is a delta
+        headings (list): Only download these TOCHeadings of each record, e.g.
+            COMPOUND_SCOPED_HEADINGS (None downloads full records)
+        batch_properties (bool): Fill the computed descriptors from one PUG REST
+            property request per batch_size compounds
+        descriptors_only (bool): Only fetch the batched computed descriptors and
+            skip the per-compound PUG View records; text fields stay "Unknown"
+        batch_size (int): Compounds per PUG REST property request
+        merge_index (MergeIndex): InChIKey merge index the written compounds
+            are added to
+        missing_ids (MissingIdCache): Negative cache of missing CIDs; known
+            missing CIDs are not requested and new 404s are added to it
+        check_existence (bool): Check which CIDs exist with bulk PUG REST
+            queries first, so only live CIDs are fetched one by one
+        shard_writer (ShardedWriter): Write the compounds as compressed JSON
+            Lines shards with a manifest instead of the .jsonl file (json_array
+            must then be False)
+        
+    Returns:
+        dict: Counts of written, skipped and failed IDs (see run_pipeline)
+    """
+    properties = None
+    if batch_properties or descriptors_only:
+        properties = PropertyBatcher(start_id, end_id, batch_size, cache=cache,
+                                     window=WINDOW_PER_SLOT * max_concurrency)
+    fetch_one = functools.partial(fetch_compound, cache=cache, headings=headings, properties=properties,
+                                  descriptors_only=descriptors_only)
+    transform_one = functools.partial(transform_compound, source_type=source_type)
+    ids = range(start_id, end_id + 1)
+    if missing_ids is not None or check_existence:
+        check_batch = functools.partial(fetch_existing_ids, "compound", cache=cache) if check_existence else None
+        ids = live_ids(ids, missing_ids, check_batch, max_concurrency=max_concurrency)
+        print(f"{end_id - start_id + 1 - len(ids)} missing compound IDs skipped")
+    counts = run_pipeline(ids, fetch_one, transform_one, output_file,
+                          max_concurrency, resume=resume, json_array=json_array, compact=compact,
+                          transform_workers=transform_workers, refresh_index=refresh_index,
+                          fingerprint_one=fingerprint_compound, merge_index=merge_index,
+                          missing_ids=missing_ids, shard_writer=shard_writer)
 
-                # Chemical and Physical Properties section
-                elif section.get("TOCHeading") == "Chemical and Physical Properties":
-                    for subsection in section.get("Section", []):
-                        if subsection.get("TOCHeading") == "Computed Properties":
-                            for subsubsection in subsection.get("Section", []):
-                                if subsubsection.get("TOCHeading") == "Molecular Weight":
-                                    try:
-                                        molecular_weight = subsubsection.get("Information", [{}])[0].get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "Unknown")
-                                        if molecular_weight == "Unknown":
-                                            # Try to get the numeric value directly
-                                            molecular_weight = subsubsection.get("Information", [{}])[0].get("Value", {}).get("Number", ["Unknown"])[0]
-                                    except (IndexError, TypeError):
-                                        pass
-                                elif subsubsection.get("TOCHeading") == "XLogP3":
-                                    try:
-                                        xlogp3 = subsubsection.get("Information", [{}])[0].get("Value", {}).get("Number", ["Unknown"])[0]
-                                    except (IndexError, TypeError):
-                                        pass
-                                elif subsubsection.get("TOCHeading") == "Hydrogen Bond Donor Count":
-                                    try:
-                                        hydrogen_bond_donor_count = subsubsection.get("Information", [{}])[0].get("Value", {}).get("Number", ["Unknown"])[0]
-                                    except (IndexError, TypeError):
-                                        pass
-                                elif subsubsection.get("TOCHeading") == "Hydrogen Bond Acceptor Count":
-                                    try:
-                                        hydrogen_bond_acceptor_count = subsubsection.get("Information", [{}])[0].get("Value", {}).get("Number", ["Unknown"])[0]
-                                    except (IndexError, TypeError):
-                                        pass
-                                elif subsubsection.get("TOCHeading") == "Rotatable Bond Count":
-                                    try:
-                                        rotatable_bond_count = subsubsection.get("Information", [{}])[0].get("Value", {}).get("Number", ["Unknown"])[0]
-                                    except (IndexError, TypeError):
-                                        pass
-                                elif subsubsection.get("TOCHeading") == "Exact Mass":
-                                    try:
-                                        exact_mass = subsubsection.get("Information", [{}])[0].get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "Unknown")
-                                        if exact_mass == "Unknown":
-                                            # Try to get the numeric value directly
-                                            exact_mass = subsubsection.get("Information", [{}])[0].get("Value", {}).get("Number", ["Unknown"])[0]
-                                    except (IndexError, TypeError):
-                                        pass
-                                elif subsubsection.get("TOCHeading") == "Monoisotopic Mass":
-                                    try:
-                                        monoisotopic_mass = subsubsection.get("Information", [{}])[0].get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "Unknown")
-                                        if monoisotopic_mass == "Unknown":
-                                            # Try to get the numeric value directly
-                                            monoisotopic_mass = subsubsection.get("Information", [{}])[0].get("Value", {}).get("Number", ["Unknown"])[0]
-                                    except (IndexError, TypeError):
-                                        pass
-                                elif subsubsection.get("TOCHeading") == "Topological Polar Surface Area":
-                                    try:
-                                        topological_polar_surface_area = subsubsection.get("Information", [{}])[0].get("Value", {}).get("Number", ["Unknown"])[0]
-                                    except (IndexError, TypeError):
-                                        pass
-                                elif subsubsection.get("TOCHeading") == "Heavy Atom Count":
-                                    try:
-                                        heavy_atom_count = subsubsection.get("Information", [{}])[0].get("Value", {}).get("Number", ["Unknown"])[0]
-                                    except (IndexError, TypeError):
-                                        pass
-                                elif subsubsection.get("TOCHeading") == "Formal Charge":
-                                    try:
-                                        formal_charge = subsubsection.get("Information", [{}])[0].get("Value", {}).get("Number", ["Unknown"])[0]
-                                    except (IndexError, TypeError):
-                                        pass
-                                elif subsubsection.get("TOCHeading") == "Complexity":
-                                    try:
-                                        complexity = subsubsection.get("Information", [{}])[0].get("Value", {}).get("Number", ["Unknown"])[0]
-                                    except (IndexError, TypeError):
-                                        pass
-                                elif subsubsection.get("TOCHeading") == "Isotope Atom Count":
-                                    try:
-                                        isotope_atom_count = subsubsection.get("Information", [{}])[0].get("Value", {}).get("Number", ["Unknown"])[0]
-                                    except (IndexError, TypeError):
-                                        pass
-                                elif subsubsection.get("TOCHeading") == "Defined Atom Stereocenter Count":
-                                    try:
-                                        defined_atom_stereocenter_count = subsubsection.get("Information", [{}])[0].get("Value", {}).get("Number", ["Unknown"])[0]
-                                    except (IndexError, TypeError):
-                                        pass
-                                elif subsubsection.get("TOCHeading") == "Undefined Atom Stereocenter Count":
-                                    try:
-                                        undefined_atom_stereocenter_count = subsubsection.get("Information", [{}])[0].get("Value", {}).get("Number", ["Unknown"])[0]
-                                    except (IndexError, TypeError):
-                                        pass
-                                elif subsubsection.get("TOCHeading") == "Defined Bond Stereocenter Count":
-                                    try:
-                                        defined_bond_stereocenter_count = subsubsection.get("Information", [{}])[0].get("Value", {}).get("Number", ["Unknown"])[0]
-                                    except (IndexError, TypeError):
-                                        pass
-                                elif subsubsection.get("TOCHeading") == "Undefined Bond Stereocenter Count":
-                                    try:
-                                        undefined_bond_stereocenter_count = subsubsection.get("Information", [{}])[0].get("Value", {}).get("Number", ["Unknown"])[0]
-                                    except (IndexError, TypeError):
-                                        pass
-                                elif subsubsection.get("TOCHeading") == "Covalently-Bonded Unit Count":
-                                    try:
-                                        covalently_bonded_unit_count = subsubsection.get("Information", [{}])[0].get("Value", {}).get("Number", ["Unknown"])[0]
-                                    except (IndexError, TypeError):
-                                        pass
-                                        
-                        elif subsection.get("TOCHeading") == "Experimental Properties":
-                            for exp_section in subsection.get("Section", []):
-                                if exp_section.get("TOCHeading") == "Melting Point":
-                                    try:
-                                        melting_point = exp_section.get("Information", [{}])[0].get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "Unknown")
-                                    except (IndexError, TypeError):
-                                        pass
-                                elif exp_section.get("TOCHeading") == "Solubility":
-                                    try:
-                                        solubility = exp_section.get("Information", [{}])[0].get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "Unknown")
-                                    except (IndexError, TypeError):
-                                        pass
-                
-                # Spectral Information section
-                elif section.get("TOCHeading") == "Spectral Information":
-                    for subsection in section.get("Section", []):
-                        if subsection.get("TOCHeading") == "1D NMR Spectra":
-                            for nmr_section in subsection.get("Section", []):
-                                if nmr_section.get("TOCHeading") == "1H NMR Spectra":
-                                    for info in nmr_section.get("Information", []):
-                                        if info.get("Name") == "Shifts [ppm]:Intensity":
-                                            try:
-                                                shifts = info.get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "")
-                                                if shifts and shifts != "Unknown":
-                                                    nmr_data = {
-                                                        "instrument": "Bruker", # Default if not specified
-                                                        "solvent": "D2O",  # Default if not specified
-                                                        "shifts": shifts
-                                                    }
-                                                    
-                                                    # Look for other NMR metadata in the same section
-                                                    for meta_info in nmr_section.get("Information", []):
-                                                        if meta_info.get("Name") == "Instrument Type":
-                                                            inst = meta_info.get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "")
-                                                            if inst:
-                                                                nmr_data["instrument"] = inst
-                                                        elif meta_info.get("Name") == "Solvent":
-                                                            solv = meta_info.get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "")
-                                                            if solv:
-                                                                nmr_data["solvent"] = solv
-                                                        elif meta_info.get("Name") == "Frequency":
-                                                            freq = meta_info.get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "")
-                                                            if freq:
-                                                                nmr_data["frequency"] = freq
-                                                    
-                                                    nmr_shifts_proton.append(nmr_data)
-                                            except (IndexError, TypeError):
-                                                pass
-                                                
-                                elif nmr_section.get("TOCHeading") == "13C NMR Spectra":
-                                    for info in nmr_section.get("Information", []):
-                                        if info.get("Name") == "Shifts [ppm]:Intensity":
-                                            try:
-                                                shifts = info.get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "")
-                                                if shifts and shifts != "Unknown":
-                                                    nmr_data = {
-                                                        "instrument": "Bruker", # Default if not specified
-                                                        "solvent": "D2O",  # Default if not specified
-                                                        "shifts": shifts
-                                                    }
-                                                    
-                                                    # Look for other NMR metadata in the same section
-                                                    for meta_info in nmr_section.get("Information", []):
-                                                        if meta_info.get("Name") == "Instrument Type":
-                                                            inst = meta_info.get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "")
-                                                            if inst:
-                                                                nmr_data["instrument"] = inst
-                                                        elif meta_info.get("Name") == "Solvent":
-                                                            solv = meta_info.get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "")
-                                                            if solv:
-                                                                nmr_data["solvent"] = solv
-                                                    
-                                                    nmr_shifts_carbon.append(nmr_data)
-                                            except (IndexError, TypeError):
-                                                pass
-                                                
-                        elif subsection.get("TOCHeading") == "Mass Spectrometry":
-                            for ms_section in subsection.get("Section", []):
-                                for info in ms_section.get("Information", []):
-                                    if info.get("Name") == "Top 5 Peaks":
-                                        try:
-                                            peaks = info.get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "")
-                                            if peaks and peaks != "Unknown":
-                                                mass_spec_peaks = peaks
-                                        except (IndexError, TypeError):
-                                            pass
-                                    elif info.get("Name") == "Precursor m/z" and not mass_spec_peaks:
-                                        try:
-                                            peaks = info.get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "")
-                                            if peaks and peaks != "Unknown":
-                                                mass_spec_peaks = peaks
-                                        except (IndexError, TypeError):
-                                            pass
-                
-                # Drug and Medication Information section
-                elif section.get("TOCHeading") == "Drug and Medication Information":
-                    for subsection in section.get("Section", []):
-                        if subsection.get("TOCHeading") == "Drug Indication":
-                            try:
-                                indications_text = subsection.get("Information", [{}])[0].get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "Unknown")
-                            except (IndexError, TypeError):
-                                pass
-                
-                # Pharmacology and Biochemistry section
-                elif section.get("TOCHeading") == "Pharmacology and Biochemistry":
-                    for subsection in section.get("Section", []):
-                        if subsection.get("TOCHeading") == "Pharmacodynamics":
-                            try:
-                                pharmacodynamics = subsection.get("Information", [{}])[0].get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "Unknown")
-                            except (IndexError, TypeError):
-                                pass
-                        elif subsection.get("TOCHeading") == "Mechanism of Action":
-                            try:
-                                mechanism = subsection.get("Information", [{}])[0].get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "Unknown")
-                            except (IndexError, TypeError):
-                                pass
-                        elif subsection.get("TOCHeading") == "Absorption, Distribution and Excretion":
-                            for info in subsection.get("Information", []):
-                                if info.get("Name") == "Absorption":
-                                    try:
-                                        absorption = info.get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "Unknown")
-                                    except (IndexError, TypeError):
-                                        pass
-                                elif info.get("Name") == "Route of Elimination":
-                                    try:
-                                        route_of_elimination = info.get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "Unknown")
-                                    except (IndexError, TypeError):
-                                        pass
-            
-            # Process organism presence data from Record Description
-            if description != "Unknown":
-                # Extract organism mentions from description
-                organisms = []
-                if "found in " in description.lower():
-                    org_part = description.lower().split("found in ")[1].split(".")[0]
-                    organisms = [o.strip() for o in org_part.split(",")]
-                
-                if "human metabolite" in description.lower():
-                    organisms.append("Human metabolite")
-                
-                if organisms:
-                    organism_presence = organisms
-            
-            # Extract biochemical function
-            if description != "Unknown":
-                biochemical_function = description
-            
-            # Determine if racemic based on the name or stereochemistry information
-            is_racemic = False
-            if "DL-" in molecule_name or undefined_atom_stereocenter_count != "Unknown" and int(undefined_atom_stereocenter_count) > 0:
-                is_racemic = True
-            
-            # Organize data according to the format.json structure
-            transformed_item = {
-                "basicInfo": {
-                    "type": source_type,
-                    "moleculeName": molecule_name,
-                    "recordNumber": record_number,
-                    "source": "pubchem",
-                    "drugBankId": drugbank_id,
-                    "casRegistryNumber": cas_registry_number,
-                    "unii": unii,
-                    "chebiId": chebi_id,
-                    "description": description
-                },
-                "identifiers": {
-                    "pubChemCID": compound_id,
-                    "wikidata": wikidata,
-                    "hmdbID": hmdb_id,
-                    "lipidMapsID": lipid_maps_id,
-                    "nciThesaurusCode": nci_thesaurus_code,
-                    "metabolomicsWorkbenchID": metabolomics_workbench_id,
-                    "dssToxID": dsstox_id
-                },
-                "structure": {
-                    "smilesStructure": smiles_structure,
-                    "inchiString": inchi_string,
-                    "inchiKey": inchi_key,
-                    "molecularFormula": molecular_formula
-                },
-                "physicalProperties": {
-                    "molecularWeight": molecular_weight,
-                    "exactMass": exact_mass,
-                    "monoisotopicMass": monoisotopic_mass,
-                    "xlogp3": xlogp3,
-                    "formalCharge": formal_charge,
-                    "complexity": complexity,
-                    "topologicalPolarSurfaceArea": topological_polar_surface_area,
-                    "heavyAtomCount": heavy_atom_count,
-                    "meltingPoint": melting_point,
-                    "solubility": solubility
-                },
-                "bondInformation": {
-                    "hydrogenBondDonorCount": hydrogen_bond_donor_count,
-                    "hydrogenBondAcceptorCount": hydrogen_bond_acceptor_count,
-                    "rotatableBondCount": rotatable_bond_count,
-                    "covalentlyBondedUnitCount": covalently_bonded_unit_count
-                },
-                "stereochemistry": {
-                    "definedAtomStereocenterCount": defined_atom_stereocenter_count,
-                    "undefinedAtomStereocenterCount": undefined_atom_stereocenter_count,
-                    "definedBondStereocenterCount": defined_bond_stereocenter_count,
-                    "undefinedBondStereocenterCount": undefined_bond_stereocenter_count,
-                    "isotopeAtomCount": isotope_atom_count,
-                    "isRacemic": is_racemic
-                },
-                "pharmacology": {
-                    "indications": {
-                        "text": indications_text
-                    },
-                    "overview": description,
-                    "mechanism": mechanism,
-                    "pharmacodynamics": pharmacodynamics,
-                    "absorption": absorption,
-                    "routeOfElimination": route_of_elimination,
-                    "classification": {
-                        "meshPharmacological": []
-                    }
-                },
-                "synonyms": synonyms,
-                "spectralData": {
-                    "nmr": {
-                        "proton": nmr_shifts_proton,
-                        "carbon": nmr_shifts_carbon
-                    },
-                    "massSpectrometry": {
-                        "precursorMZ": "",
-                        "topPeaks": mass_spec_peaks
-                    }
-                },
-                "biologicalProperties": {
-                    "organismPresence": organism_presence,
-                    "biochemicalFunction": biochemical_function
-                },
-                "commercialAvailability": {
-                    "regulatoryStatus": {
-                        "approved": [],
-                        "investigational": []
-                    }
-                },
-                "classification": {},
-                "metadata": {
-                    "createDate": create_date,
-                    "modifyDate": modify_date,
-                    "dataSource": "PubChem"
-                }
-            }
-            
-            transformed_data.append(transformed_item)
+    destination = shard_writer.directory if shard_writer is not None else jsonl_path(output_file)
+    print(f"{counts['written']} compounds streamed to {destination} ({counts['failed']} failed)")
+    if missing_ids is not None:
+        print(f"{counts['missing']} newly missing compound IDs recorded")
+    if refresh_index is not None:
+        print(f"{counts['unchanged']} unchanged compounds skipped")
+    if json_array:
+        print(f"Final compound data saved to {output_file}")
+    if shard_writer is not None:
+        print(f"{len(shard_writer.shards)} compound shards saved to {shard_writer.directory}")
+    return counts
 
-    # Save final result
-    with open(output_file, "w") as json_file:
-        json.dump(transformed_data, json_file, indent=4)
-    print(f"Final compound data saved to {output_file}")
- 
 if __name__ == "__main__":
-    process_compound_data(1, 20, "final_pubchem_compound_data.json", "compound")
+    process_compound_data(1, 20, "final_pubchem_compound_data.json", "compound", cache=ResponseCache())
 
 
@@ -0,0 +1,173 @@
+"""
+Compact Compound Record
+
+This module holds transformed compounds as flat slotted objects instead of
+the ~20 nested dicts of the output layout. Only the values that differ from
+record to record are stored; the constant fields ("source", "dataSource", the
+empty classification lists, ...) and the fields copied from the description
+are filled in when the record is serialized.
+
+to_dict() rebuilds the nested layout, and json_backend encodes records
+through it, so the JSON written is exactly the same as before.
+
+Features:
+- __slots__ record with one attribute per varying leaf value
+- Constant and derived fields rebuilt on serialization
+- to_dict() producing the documented compound layout, key order included
+
+Author: Israel Neto
+Date: 2024
+"""
+
+# Extracted fields copied as they are from the section extractor's values
+EXTRACTED_FIELDS = (
+    "drugbank_id", "cas_registry_number", "unii", "chebi_id", "description",
+    "wikidata", "hmdb_id", "lipid_maps_id", "nci_thesaurus_code", "metabolomics_workbench_id", "dsstox_id",
+    "smiles_structure", "inchi_string", "inchi_key", "molecular_formula",
+    "molecular_weight", "exact_mass", "monoisotopic_mass", "xlogp3", "formal_charge", "complexity",
+    "topological_polar_surface_area", "heavy_atom_count", "melting_point", "solubility",
+    "hydrogen_bond_donor_count", "hydrogen_bond_acceptor_count", "rotatable_bond_count",
+    "covalently_bonded_unit_count",
+    "defined_atom_stereocenter_count", "undefined_atom_stereocenter_count", "defined_bond_stereocenter_count",
+    "undefined_bond_stereocenter_count", "isotope_atom_count",
+    "indications_text", "mechanism", "pharmacodynamics", "absorption", "route_of_elimination",
+    "nmr_shifts_proton", "nmr_shifts_carbon", "mass_spec_peaks",
+    "create_date", "modify_date",
+)
+
+class CompoundRecord:
+    """
+    A transformed PubChem compound.
+
+    Args:
+        source_type (str): Type identifier for the data source
+        compound_id (int): PubChem compound ID
+        molecule_name (str): Record title
+        record_number (int): Record number
+        values (dict): Extracted field values, see EXTRACTED_FIELDS
+        synonyms (list): Unique synonyms
+        organism_presence (list): Organisms the compound is found in
+        is_racemic (bool): Whether the compound is racemic
+    """
+
+    __slots__ = ("source_type", "compound_id", "molecule_name", "record_number", "synonyms",
+                 "organism_presence", "is_racemic") + EXTRACTED_FIELDS
+
+    def __init__(self, source_type, compound_id, molecule_name, record_number, values, synonyms,
+                 organism_presence, is_racemic):
+        self.source_type = source_type
+        self.compound_id = compound_id
+        self.molecule_name = molecule_name
+        self.record_number = record_number
+        self.synonyms = synonyms
+        self.organism_presence = organism_presence
+        self.is_racemic = is_racemic
+        for field in EXTRACTED_FIELDS:
+            setattr(self, field, values[field])
+
+    def __repr__(self):
+        return f"CompoundRecord({self.compound_id}, {self.molecule_name!r})"
+
+    def to_dict(self):
+        """
+        Builds the nested output layout of the record.
+
+        Returns:
+            dict: Compound in the format.json structure
+        """
+        description = self.description
+        return {
+            "basicInfo": {
+                "type": self.source_type,
+                "moleculeName": self.molecule_name,
+                "recordNumber": self.record_number,
+                "source": "pubchem",
+                "drugBankId": self.drugbank_id,
+                "casRegistryNumber": self.cas_registry_number,
+                "unii": self.unii,
+                "chebiId": self.chebi_id,
+                "description": description
+            },
+            "identifiers": {
+                "pubChemCID": self.compound_id,
+                "wikidata": self.wikidata,
+                "hmdbID": self.hmdb_id,
+                "lipidMapsID": self.lipid_maps_id,
+                "nciThesaurusCode": self.nci_thesaurus_code,
+                "metabolomicsWorkbenchID": self.metabolomics_workbench_id,
+                "dssToxID": self.dsstox_id
+            },
+            "structure": {
+                "smilesStructure": self.smiles_structure,
+                "inchiString": self.inchi_string,
+                "inchiKey": self.inchi_key,
+                "molecularFormula": self.molecular_formula
+            },
+            "physicalProperties": {
+                "molecularWeight": self.molecular_weight,
+                "exactMass": self.exact_mass,
+                "monoisotopicMass": self.monoisotopic_mass,
+                "xlogp3": self.xlogp3,
+                "formalCharge": self.formal_charge,
+                "complexity": self.complexity,
+                "topologicalPolarSurfaceArea": self.topological_polar_surface_area,
+                "heavyAtomCount": self.heavy_atom_count,
+                "meltingPoint": self.melting_point,
+                "solubility": self.solubility
+            },
+            "bondInformation": {
+                "hydrogenBondDonorCount": self.hydrogen_bond_donor_count,
+                "hydrogenBondAcceptorCount": self.hydrogen_bond_acceptor_count,
+                "rotatableBondCount": self.rotatable_bond_count,
+                "covalentlyBondedUnitCount": self.covalently_bonded_unit_count
+            },
+            "stereochemistry": {
+                "definedAtomStereocenterCount": self.defined_atom_stereocenter_count,
+                "undefinedAtomStereocenterCount": self.undefined_atom_stereocenter_count,
+                "definedBondStereocenterCount": self.defined_bond_stereocenter_count,
+                "undefinedBondStereocenterCount": self.undefined_bond_stereocenter_count,
+                "isotopeAtomCount": self.isotope_atom_count,
+                "isRacemic": self.is_racemic
+            },
+            "pharmacology": {
+                "indications": {
+                    "text": self.indications_text
+                },
+                "overview": description,
+                "mechanism": self.mechanism,
+                "pharmacodynamics": self.pharmacodynamics,
+                "absorption": self.absorption,
+                "routeOfElimination": self.route_of_elimination,
+                "classification": {
+                    "meshPharmacological": []
+                }
+            },
+            "synonyms": self.synonyms,
+            "spectralData": {
+                "nmr": {
+                    "proton": self.nmr_shifts_proton,
+                    "carbon": self.nmr_shifts_carbon
+                },
+                "massSpectrometry": {
+                    "precursorMZ": "",
+                    "topPeaks": self.mass_spec_peaks
+                }
+            },
+            "biologicalProperties": {
+                "organismPresence": self.organism_presence,
+                # The whole description, when there is one
+                "biochemicalFunction": description
+            },
+            "commercialAvailability": {
+                "regulatoryStatus": {
+                    "approved": [],
+                    "investigational": []
+                }
+            },
+            "classification": {},
+            "metadata": {
+                "createDate": self.create_date,
+                "modifyDate": self.modify_date,
+                "dataSource": "PubChem"
+            }
+        }
@@ -0,0 +1,132 @@
+"""
+Distributed PubChem Crawl
+
+This module spreads a crawl of the PubChem CID/SID space over several worker
+processes or hosts. The ranges are split into shards in a shared SQLite
+coordinator file; every worker leases shards from it and writes one output
+file per shard.
+
+Usage:
+    python distributed_pubchem.py init --db crawl.sqlite --compounds 1 1000000 --substances 1 100000
+    python distributed_pubchem.py work --db crawl.sqlite --worker-id host-1 --output-dir shards
+    python distributed_pubchem.py status --db crawl.sqlite
+
+Each worker resumes its shard's progress journal, so a shard re-leased to the
+same host after a crash continues where it stopped.
+
+Author: Israel Neto
+Date: 2024
+"""
+
+import argparse
+import os
+import socket
+
+from compound_pubchem import process_compound_data
+from substance_pubchem import process_substance_data
+from common import metrics
+from common.fetch_engine import DEFAULT_MAX_CONCURRENCY
+from common.response_cache import ResponseCache
+from common.shard_coordinator import DEFAULT_LEASE_SECONDS, DEFAULT_SHARD_SIZE, ShardCoordinator, run_worker
+
+PROCESSORS = {
+    "compound": process_compound_data,
+    "substance": process_substance_data,
+}
+
+def shard_output_file(output_dir, shard):
+    """
+    Builds the output file path of a shard.
+
+    Args:
+        output_dir (str): Directory holding the shard outputs
+        shard (Shard): Leased shard
+
+    Returns:
+        str: JSON output path; records are streamed to the .jsonl next to it
+    """
+    return os.path.join(output_dir, f"{shard.kind}_{shard.start_id:09d}_{shard.end_id:09d}.json")
+
+def work(coordinator, worker_id, output_dir, kinds=None, max_concurrency=DEFAULT_MAX_CONCURRENCY, cache=None,
+         metrics_file=None):
+    """
+    Processes shards from the coordinator until none is left.
+
+    Args:
+        coordinator (ShardCoordinator): Shared shard table
+        worker_id (str): Unique identifier of this worker
+        output_dir (str): Directory receiving one output file per shard
+        kinds (list): Only process these kinds (None processes every kind)
+        max_concurrency (int): Maximum number of requests in flight at once
+        cache (ResponseCache): Optional response cache to read through
+        metrics_file (str): Prometheus textfile updated after every shard
+
+    Returns:
+        int: Number of shards completed by this worker
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    def process_shard(shard):
+        try:
+            return PROCESSORS[shard.kind](shard.start_id, shard.end_id, shard_output_file(output_dir, shard),
+                                          shard.kind, max_concurrency=max_concurrency, cache=cache, resume=True,
+                                          json_array=False)
+        finally:
+            if metrics_file is not None:
+                metrics.write_textfile(metrics_file)
+
+    return run_worker(coordinator, worker_id, process_shard, kinds)
+
+def print_status(coordinator):
+    """
+    Prints the shard and record counts of every kind.
+
+    Args:
+        coordinator (ShardCoordinator): Shared shard table
+    """
+    for kind, entry in coordinator.status().items():
+        shards = ", ".join(f"{count} {status}" for status, count in entry["shards"].items())
+        print(f"{kind}: {shards} shards; {entry['written']} records written, {entry['failed']} IDs failed")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a PubChem crawl spread over several workers.")
+    parser.add_argument("--db", default="crawl.sqlite", help="shared coordinator database")
+    parser.add_argument("--lease-seconds", type=float, default=DEFAULT_LEASE_SECONDS,
+                        help="seconds before an unfinished shard is handed to another worker")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    init_parser = commands.add_parser("init", help="split ID ranges into shards")
+    init_parser.add_argument("--compounds", type=int, nargs=2, metavar=("START", "END"), help="CID range")
+    init_parser.add_argument("--substances", type=int, nargs=2, metavar=("START", "END"), help="SID range")
+    init_parser.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_SIZE, help="IDs per shard")
+
+    work_parser = commands.add_parser("work", help="process shards until none is left")
+    work_parser.add_argument("--worker-id", default=f"{socket.gethostname()}-{os.getpid()}",
+                             help="unique worker name (default: host name and process ID)")
+    work_parser.add_argument("--output-dir", default="shards", help="directory for the shard outputs")
+    work_parser.add_argument("--kind", choices=sorted(PROCESSORS), action="append",
+                             help="only process this kind (repeatable)")
+    work_parser.add_argument("--max-concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY,
+                             help="requests in flight at once")
+    work_parser.add_argument("--metrics-file", metavar="PATH",
+                             help="Prometheus textfile updated after every shard (name it *.prom)")
+    work_parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                             help="serve Prometheus metrics on http://localhost:PORT/metrics")
+
+    commands.add_parser("status", help="show crawl progress")
+
+    args = parser.parse_args()
+    coordinator = ShardCoordinator(args.db, lease_seconds=args.lease_seconds)
+    if args.command == "init":
+        for kind, id_range in (("compound", args.compounds), ("substance", args.substances)):
+            if id_range:
+                added = coordinator.add_range(kind, id_range[0], id_range[1], args.shard_size)
+                print(f"{added} new {kind} shards")
+    elif args.command == "work":
+        if args.metrics_port is not None:
+            metrics.start_http_server(args.metrics_port)
+        completed = work(coordinator, args.worker_id, args.output_dir, args.kind, args.max_concurrency,
+                         cache=ResponseCache(), metrics_file=args.metrics_file)
+        print(f"{args.worker_id}: {completed} shards completed")
+        metrics.print_summary()
+    print_status(coordinator)
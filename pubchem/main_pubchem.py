@@ -14,33 +14,260 @@ Each process includes:
 - Data transformation
 - Final JSON file generation
 
+The processes run one after the other by default, or at the same time (along
+with an optional ChEMBL stage), sharing each host's request rate limit fairly.
+
 Author: Israel Neto
 Date: 2024
 """
 
-from compound_pubchem import process_compound_data
+import argparse
+import functools
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "chembl"))
+
+from columnar_export import export_compounds
+from compound_pubchem import COMPOUND_SCOPED_HEADINGS, process_compound_data
 from substance_pubchem import process_substance_data
+from common import http_client, metrics, mongo_loader, stage_runner
+from common.merge_index import DEFAULT_MERGE_INDEX_FILE, MergeIndex
+from common.missing_ids import MissingIdCache
+from common.pipeline import jsonl_path
+from common.refresh_index import RefreshIndex
+from common.response_cache import ResponseCache
+from common.shard_writer import COMPRESSIONS, DEFAULT_MAX_BYTES, DEFAULT_MAX_RECORDS, ShardedWriter
+from main_chembl import DEFAULT_CHEMBL_IDS, fetch_chembl_data
+
+def shard_directory(output_file):
+    """
+    Derives the shard directory of an output file.
+
+    Args:
+        output_file (str): Path of the JSON output file
+
+    Returns:
+        str: Directory holding the output's shards and manifest.json
+    """
+    return os.path.splitext(output_file)[0] + "_shards"
+
+def run_pubchem_stage(process, kind, incremental=False, skip_missing=False, **options):
+    """
+    Runs a PubChem stage with its own refresh index and missing ID cache.
+
+    Both are opened and closed in the calling thread, as SQLite connections
+    must be, so the stage can run in a thread of its own.
+
+    Args:
+        process (callable): process_compound_data or process_substance_data
+        kind (str): Record kind, "compound" or "substance"
+        incremental (bool): Use the kind's pubchem_<kind>_index.sqlite
+        skip_missing (bool): Use the kind's entries in pubchem_missing_ids.sqlite
+        **options: Arguments passed on to process
 
-def main():
+    Returns:
+        dict: Counts returned by process
+    """
+    refresh_index = RefreshIndex(f"pubchem_{kind}_index.sqlite") if incremental else None
+    missing_ids = MissingIdCache("pubchem_missing_ids.sqlite", kind) if skip_missing else None
+    try:
+        return process(refresh_index=refresh_index, missing_ids=missing_ids, **options)
+    finally:
+        for index in (refresh_index, missing_ids):
+            if index is not None:
+                index.close()
+
+def main(resume=False, scoped=False, batch_properties=False, descriptors_only=False, compact=False,
+         transform_workers=0, incremental=False, mongo_uri=None, parquet=False, metrics_file=None,
+         merge_index_file=None, resolve_related=False, skip_missing=False, check_existence=False,
+         shards=None, shard_max_records=DEFAULT_MAX_RECORDS, shard_max_bytes=DEFAULT_MAX_BYTES,
+         concurrent=False, chembl_ids=None, chembl_listing=False, chembl_max_molecules=None):
     """
     Main orchestrator function that runs the complete data processing pipeline.
     
     This function coordinates:
     - Compound data processing (IDs 1-100)
     - Substance data processing (IDs 1-5)
+    - Optionally, ChEMBL molecule processing
     
     Output files:
-    - final_pubchem_compound_data.json
-    - final_pubchem_substance_data.json
-    """
+    - final_pubchem_compound_data.jsonl / final_pubchem_compound_data.json
+    - final_pubchem_substance_data.jsonl / final_pubchem_substance_data.json
+    - chembl_data.jsonl / chembl_data.json, with a ChEMBL stage
     
-    # Process compound data
-    print("Processing compound data...")
-    process_compound_data(1, 100, "final_pubchem_compound_data.json", "compound")
+    Incremental runs write delta_pubchem_*_data.jsonl / .json instead, holding
+    only the records that changed since the previous run, and keep the
+    fingerprints of every record in pubchem_*_index.sqlite.
+    
+    Raw responses are cached on disk, so re-running the pipeline only refetches
+    records whose cache entries have expired.
+    
+    Args:
+        resume (bool): Continue interrupted runs from their progress journals
+        scoped (bool): Download only the compound sections the transform reads
+        batch_properties (bool): Fetch computed descriptors in PUG REST batches
+        descriptors_only (bool): Only refresh the batched computed descriptors
+        compact (bool): Write compact JSON instead of the indented format
+        transform_workers (int): Worker processes for the transform stage
+            (0 transforms records serially)
+        incremental (bool): Only write the records changed since the last run
+        mongo_uri (str): Upsert the written records, ChEMBL molecules included,
+            into DrugXpert.molecules on this MongoDB server (None skips loading)
+        parquet (bool): Also export the compounds to a typed Parquet file
+        metrics_file (str): Write the run metrics to this Prometheus textfile
+            (e.g. for node_exporter's textfile collector) after each stage
+        merge_index_file (str): Add the written compounds to this InChIKey
+            merge index, shared with the ChEMBL stage (None skips indexing)
+        resolve_related (bool): Attach compact summaries of the substances'
+            related compounds, fetched once per distinct CID in batches
+        skip_missing (bool): Remember the IDs that answer 404 in
+            pubchem_missing_ids.sqlite and skip them for the next 30 days
+        check_existence (bool): Check which IDs exist with bulk PUG REST
+            queries before fetching the records one by one
+        shards (str): Write the records as "gzip" or "zstd" compressed JSON
+            Lines shards in a <output>_shards directory next to each output,
+            instead of the .jsonl and single-array .json files (None keeps them)
+        shard_max_records (int): Records per shard
+        shard_max_bytes (int): Uncompressed bytes per shard
+        concurrent (bool): Run the stages at the same time, each in its own
+            thread, splitting each host's request rate fairly between them
+        chembl_ids (list): Also run the ChEMBL stage on these molecule IDs
+            (an empty list fetches DEFAULT_CHEMBL_IDS; None skips the stage)
+        chembl_listing (bool): Also run the ChEMBL stage over the whole
+            molecule listing
+        chembl_max_molecules (int): Stop the ChEMBL listing after this many
+            molecules
+    """
+    cache = ResponseCache()
+    prefix = "delta" if incremental else "final"
+    merge_index = MergeIndex(merge_index_file) if merge_index_file is not None else None
     
-    # Process substance data
-    print("\nProcessing substance data...")
-    process_substance_data(1, 5, "final_pubchem_substance_data.json", "substance")
+    compound_file = f"{prefix}_pubchem_compound_data.json"
+    substance_file = f"{prefix}_pubchem_substance_data.json"
+    chembl_file = "chembl_data.json"
+    shard_writers = {}
+    if shards is not None:
+        for output_file in (compound_file, substance_file):
+            shard_writers[output_file] = ShardedWriter(shard_directory(output_file), compression=shards,
+                                                       max_records=shard_max_records, max_bytes=shard_max_bytes,
+                                                       resume=resume)
+    stages = [
+        ("compound", functools.partial(
+            run_pubchem_stage, process_compound_data, "compound", incremental, skip_missing,
+            start_id=1, end_id=100, output_file=compound_file, source_type="compound", cache=cache,
+            resume=resume, headings=COMPOUND_SCOPED_HEADINGS if scoped else None,
+            batch_properties=batch_properties, descriptors_only=descriptors_only, compact=compact,
+            transform_workers=transform_workers, merge_index=merge_index, check_existence=check_existence,
+            json_array=shards is None, shard_writer=shard_writers.get(compound_file))),
+        ("substance", functools.partial(
+            run_pubchem_stage, process_substance_data, "substance", incremental, skip_missing,
+            start_id=1, end_id=5, output_file=substance_file, source_type="substance", cache=cache,
+            resume=resume, compact=compact, transform_workers=transform_workers,
+            resolve_related=resolve_related, check_existence=check_existence,
+            json_array=shards is None, shard_writer=shard_writers.get(substance_file))),
+    ]
+    output_files = [compound_file, substance_file]
+    if chembl_ids is not None or chembl_listing:
+        output_files.append(chembl_file)
+        stages.append(("chembl", functools.partial(
+            fetch_chembl_data, chembl_ids or DEFAULT_CHEMBL_IDS, chembl_file, cache=cache, compact=compact,
+            listing=chembl_listing, max_molecules=chembl_max_molecules, resume=resume, merge_index=merge_index)))
+
+    if concurrent:
+        print(f"Processing {', '.join(name for name, _ in stages)} data concurrently...")
+        stage_runner.run_stages(stages)
+    else:
+        for name, stage in stages:
+            print(f"\nProcessing {name} data...")
+            stage()
+            if metrics_file is not None:
+                metrics.write_textfile(metrics_file)
+
+    if merge_index is not None:
+        merge_index.close()
+
+    if parquet:
+        parquet_file = os.path.splitext(compound_file)[0] + ".parquet"
+        source = shard_directory(compound_file) if compound_file in shard_writers else jsonl_path(compound_file)
+        rows = export_compounds(source, parquet_file)
+        print(f"\n{rows} compounds exported to {parquet_file}")
+
+    if mongo_uri is not None:
+        collection = mongo_loader.get_collection(mongo_uri)
+        for output_file in output_files:
+            if output_file in shard_writers:
+                source = shard_directory(output_file)
+                counts = mongo_loader.load_shards(source, collection)
+            else:
+                source = jsonl_path(output_file)
+                counts = mongo_loader.load_jsonl(source, collection)
+            print(f"\nLoaded {source} into MongoDB: {counts['inserted']} inserted, "
+                  f"{counts['updated']} updated, {counts['unchanged']} unchanged, {counts['failed']} failed")
+
+    stats = http_client.connection_stats()
+    print(f"\nHTTP requests: {stats['requests']}, connections opened: {stats['connections_opened']}, "
+          f"reused: {stats['connections_reused']}")
+    metrics.print_summary()
+    if metrics_file is not None:
+        metrics.write_textfile(metrics_file)
+        print(f"Metrics written to {metrics_file}")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Run the PubChem data processing pipeline.")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue interrupted runs instead of starting over")
+    parser.add_argument("--scoped", action="store_true",
+                        help="download only the compound sections that are extracted")
+    parser.add_argument("--batch-properties", action="store_true",
+                        help="fetch computed descriptors with one PUG REST request per batch of compounds")
+    parser.add_argument("--descriptors-only", action="store_true",
+                        help="only fetch the batched computed descriptors, skipping the text sections")
+    parser.add_argument("--compact", action="store_true",
+                        help="write compact JSON instead of the indented format")
+    parser.add_argument("--transform-workers", type=int, default=0, metavar="N",
+                        help="transform records in N worker processes (default: serially)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only write the records changed since the previous run, to delta_*.jsonl")
+    parser.add_argument("--mongo-uri", metavar="URI",
+                        help="upsert the results into DrugXpert.molecules on this MongoDB server")
+    parser.add_argument("--parquet", action="store_true",
+                        help="also export the compounds to a typed Parquet file")
+    parser.add_argument("--metrics-file", metavar="PATH",
+                        help="write Prometheus metrics to this textfile (name it *.prom)")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="serve Prometheus metrics on http://localhost:PORT/metrics during the run")
+    parser.add_argument("--merge-index", nargs="?", const=DEFAULT_MERGE_INDEX_FILE, metavar="PATH",
+                        help="add the compounds to the InChIKey merge index shared with ChEMBL "
+                             f"(default path: {DEFAULT_MERGE_INDEX_FILE})")
+    parser.add_argument("--resolve-related", action="store_true",
+                        help="attach summaries of the substances' related compounds (batched PUG REST requests)")
+    parser.add_argument("--skip-missing", action="store_true",
+                        help="remember the IDs that answer 404 and skip them in later runs")
+    parser.add_argument("--check-existence", action="store_true",
+                        help="check which IDs exist with bulk PUG REST queries before fetching records")
+    parser.add_argument("--shards", choices=sorted(COMPRESSIONS),
+                        help="write compressed JSON Lines shards with a manifest instead of the .jsonl and .json files")
+    parser.add_argument("--shard-records", type=int, default=DEFAULT_MAX_RECORDS, metavar="N",
+                        help=f"records per shard (default {DEFAULT_MAX_RECORDS})")
+    parser.add_argument("--shard-mb", type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024), metavar="MB",
+                        help=f"uncompressed megabytes per shard (default {DEFAULT_MAX_BYTES // (1024 * 1024)})")
+    parser.add_argument("--concurrent", action="store_true",
+                        help="run the stages at the same time, sharing the request rate fairly")
+    parser.add_argument("--chembl", nargs="*", metavar="ID",
+                        help="also fetch these ChEMBL molecules (default: the sample ID) to chembl_data.jsonl")
+    parser.add_argument("--chembl-listing", action="store_true",
+                        help="also page through the ChEMBL molecule listing to chembl_data.jsonl")
+    parser.add_argument("--chembl-max-molecules", type=int, metavar="N",
+                        help="stop the ChEMBL listing after N molecules")
+    args = parser.parse_args()
+    if args.metrics_port is not None:
+        metrics.start_http_server(args.metrics_port)
+    main(resume=args.resume, scoped=args.scoped, batch_properties=args.batch_properties,
+         descriptors_only=args.descriptors_only, compact=args.compact, transform_workers=args.transform_workers,
+         incremental=args.incremental, mongo_uri=args.mongo_uri,
+         parquet=args.parquet, metrics_file=args.metrics_file, merge_index_file=args.merge_index,
+         resolve_related=args.resolve_related, skip_missing=args.skip_missing,
+         check_existence=args.check_existence, shards=args.shards, shard_max_records=args.shard_records,
+         shard_max_bytes=args.shard_mb * 1024 * 1024, concurrent=args.concurrent, chembl_ids=args.chembl,
+         chembl_listing=args.chembl_listing, chembl_max_molecules=args.chembl_max_molecules)
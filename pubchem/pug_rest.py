@@ -0,0 +1,214 @@
+"""
+PUG REST Computed Properties
+
+This module fetches PubChem's computed compound descriptors (molecular
+weight, XLogP3, TPSA, hydrogen bond counts, InChIKey, SMILES, ...) in bulk
+through PUG REST, which returns them for a whole list of CIDs in one call,
+instead of reading them out of one PUG View record per compound.
+
+Features:
+- One property request per batch of CIDs
+- Property names mapped onto the compound transform's fields
+- Thread-safe batch loader shared by the concurrent fetch workers
+- Bulk existence checks of CID and SID lists
+
+Author: Israel Neto
+Date: 2024
+"""
+
+import threading
+from concurrent.futures import Future
+
+import requests
+
+from common import http_client, json_backend, metrics
+from common.fetch_engine import DEFAULT_MAX_CONCURRENCY, WINDOW_PER_SLOT
+
+PUG_REST_PROPERTY_URL = "https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/cid/{}/property/{}/JSON"
+
+# CIDs per property request. PUG REST accepts a few hundred CIDs per GET
+# before the URL gets too long.
+PROPERTY_BATCH_SIZE = 100
+
+# PUG REST property name -> compound transform field
+COMPUTED_PROPERTIES = {
+    "MolecularFormula": "molecular_formula",
+    "MolecularWeight": "molecular_weight",
+    "SMILES": "smiles_structure",
+    "InChI": "inchi_string",
+    "InChIKey": "inchi_key",
+    "XLogP": "xlogp3",
+    "ExactMass": "exact_mass",
+    "MonoisotopicMass": "monoisotopic_mass",
+    "TPSA": "topological_polar_surface_area",
+    "Complexity": "complexity",
+    "Charge": "formal_charge",
+    "HBondDonorCount": "hydrogen_bond_donor_count",
+    "HBondAcceptorCount": "hydrogen_bond_acceptor_count",
+    "RotatableBondCount": "rotatable_bond_count",
+    "HeavyAtomCount": "heavy_atom_count",
+    "IsotopeAtomCount": "isotope_atom_count",
+    "DefinedAtomStereoCount": "defined_atom_stereocenter_count",
+    "UndefinedAtomStereoCount": "undefined_atom_stereocenter_count",
+    "DefinedBondStereoCount": "defined_bond_stereocenter_count",
+    "UndefinedBondStereoCount": "undefined_bond_stereocenter_count",
+    "CovalentUnitCount": "covalently_bonded_unit_count",
+}
+
+# Record title, requested along with the descriptors
+TITLE_PROPERTY = "Title"
+
+# Cheapest PUG REST query per record kind whose answer lists only the IDs
+# that exist (unknown IDs are left out, 404 when none exists)
+EXISTENCE_URLS = {
+    "compound": "https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/cid/{}/property/Title/JSON",
+    "substance": "https://pubchem.ncbi.nlm.nih.gov/rest/pug/substance/sid/{}/xrefs/RegistryID/JSON",
+}
+
+def property_url(cids, properties=None):
+    """
+    Builds the PUG REST URL returning the computed properties of a CID list.
+
+    Args:
+        cids (iterable): PubChem compound IDs
+        properties (iterable): PUG REST property names to request, besides
+            the title (None requests every COMPUTED_PROPERTIES entry)
+
+    Returns:
+        str: PUG REST property URL
+    """
+    names = ",".join([TITLE_PROPERTY, *(COMPUTED_PROPERTIES if properties is None else properties)])
+    return PUG_REST_PROPERTY_URL.format(",".join(str(cid) for cid in cids), names)
+
+def fetch_properties(cids, cache=None, properties=None):
+    """
+    Fetches the computed properties of a batch of compounds in one request.
+
+    CIDs PubChem does not know are left out of the result. Properties that do
+    not apply to a compound (e.g. XLogP3 of a salt) are left out of its entry.
+
+    Args:
+        cids (iterable): PubChem compound IDs
+        cache (ResponseCache): Optional response cache to read through
+        properties (iterable): PUG REST property names to request (None
+            requests every COMPUTED_PROPERTIES entry)
+
+    Returns:
+        dict: CID -> {"title": str, "fields": {transform field: value}}
+
+    Raises:
+        requests.exceptions.RequestException: If the request fails
+        ValueError: If the response is not valid JSON
+    """
+    try:
+        content = http_client.get_content(property_url(cids, properties), cache=cache)
+    except requests.exceptions.HTTPError as e:
+        # PUG REST answers 404 when none of the CIDs exists
+        if http_client.is_not_found(e):
+            return {}
+        raise
+
+    with metrics.time_stage("parse"):
+        data = json_backend.loads(content)
+    rows = {}
+    for row in data.get("PropertyTable", {}).get("Properties", []):
+        rows[row["CID"]] = {
+            "title": row.get(TITLE_PROPERTY, "Unknown"),
+            "fields": {field: row[name] for name, field in COMPUTED_PROPERTIES.items() if name in row},
+        }
+    return rows
+
+def fetch_existing_ids(kind, ids, cache=None):
+    """
+    Checks which IDs of a list exist, in one request.
+
+    Args:
+        kind (str): "compound" (CIDs) or "substance" (SIDs)
+        ids (iterable): IDs to check
+        cache (ResponseCache): Optional response cache to read through
+
+    Returns:
+        set: The IDs PubChem has a record for
+
+    Raises:
+        requests.exceptions.RequestException: If the request fails
+        ValueError: If the response is not valid JSON
+    """
+    try:
+        content = http_client.get_content(EXISTENCE_URLS[kind].format(",".join(str(item_id) for item_id in ids)),
+                                          cache=cache)
+    except requests.exceptions.HTTPError as e:
+        if http_client.is_not_found(e):
+            return set()
+        raise
+    with metrics.time_stage("parse"):
+        data = json_backend.loads(content)
+    rows = data.get("PropertyTable", {}).get("Properties") or data.get("InformationList", {}).get("Information", [])
+    return {row["CID"] if "CID" in row else row["SID"] for row in rows}
+
+class PropertyBatcher:
+    """
+    Loads computed properties batch by batch for a range of CIDs.
+
+    The first lookup of a CID fetches its whole batch; concurrent lookups of
+    the same batch wait for that single request instead of repeating it.
+
+    CIDs are fetched in ascending order, so the IDs in the fetch window touch
+    at most one batch each, and every batch below them has been read in full.
+    Once more batches are loaded than the window holds IDs, the lowest ones
+    are dropped; a batch is never dropped while the window can still read it.
+
+    Args:
+        start_id (int): First CID of the range
+        end_id (int): Last CID of the range
+        batch_size (int): CIDs per property request
+        cache (ResponseCache): Optional response cache to read through
+        window (int): IDs the fetch stage schedules ahead (iter_fetch's window)
+    """
+
+    def __init__(self, start_id, end_id, batch_size=PROPERTY_BATCH_SIZE, cache=None,
+                 window=WINDOW_PER_SLOT * DEFAULT_MAX_CONCURRENCY):
+        self.start_id = start_id
+        self.end_id = end_id
+        self.batch_size = batch_size
+        self.cache = cache
+        self.window = window
+        self._lock = threading.Lock()
+        self._batches = {}
+
+    def get(self, cid):
+        """
+        Returns the computed properties of one compound.
+
+        Args:
+            cid (int): PubChem compound ID, within the batcher's range
+
+        Returns:
+            dict: {"title": str, "fields": {...}}, or None if PubChem has no
+            properties for the CID
+
+        Raises:
+            requests.exceptions.RequestException: If the batch request failed
+            ValueError: If the batch response is not valid JSON
+        """
+        key = (cid - self.start_id) // self.batch_size
+        with self._lock:
+            batch = self._batches.get(key)
+            loading = batch is None
+            if loading:
+                batch = self._batches[key] = Future()
+                while len(self._batches) > self.window:
+                    del self._batches[min(self._batches)]
+
+        if loading:
+            first = self.start_id + key * self.batch_size
+            last = min(first + self.batch_size - 1, self.end_id)
+            try:
+                batch.set_result(fetch_properties(range(first, last + 1), self.cache))
+            except (requests.exceptions.RequestException, ValueError) as e:
+                batch.set_exception(e)
+                with self._lock:
+                    # Let the next lookup retry the batch
+                    if self._batches.get(key) is batch:
+                        del self._batches[key]
+        return batch.result().get(cid)
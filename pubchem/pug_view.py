@@ -0,0 +1,136 @@
+"""
+PUG View Helpers
+
+This module holds helpers for PubChem's PUG View documents that are shared by
+the compound and substance processors.
+
+Features:
+- Reference-pruning record loading, without copying the parsed tree
+- Dropping of top-level sections the transforms never read
+- Heading-scoped PUG View URLs (heading= parameter)
+- Merging of heading-scoped partial documents into one record
+
+Author: Israel Neto
+Date: 2024
+"""
+
+import json
+import os
+import sys
+from urllib.parse import quote_plus
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from common import json_backend, metrics
+
+def remove_references(data):
+    """
+    Removes reference metadata from the PubChem data structure, in place.
+    
+    Args:
+        data (dict/list): Raw PubChem data structure
+        
+    Returns:
+        dict/list: The same data structure without references
+    """
+    if type(data) is dict:
+        data.pop("Reference", None)
+        values = data.values()
+    else:
+        values = data
+    for value in values:
+        if type(value) is dict or type(value) is list:
+            remove_references(value)
+    return data
+
+def _drop_reference(obj):
+    obj.pop("Reference", None)
+    return obj
+
+def load_record(content, headings=None):
+    """
+    Decodes a PUG View response without its reference metadata.
+    
+    With the stdlib backend, Reference blocks are dropped by the parser as
+    each object is read. With orjson, which parses far faster but has no
+    hooks, the unused sections are dropped first and the rest is pruned in
+    place. In both cases the tree is never copied.
+    
+    Args:
+        content (bytes): PUG View response body
+        headings (iterable): Top-level TOCHeadings to keep (None keeps all)
+        
+    Returns:
+        dict: Cleaned PubChem data
+        
+    Raises:
+        ValueError: If content is not valid JSON
+    """
+    with metrics.time_stage("parse"):
+        if json_backend.BACKEND == "json":
+            data = json.loads(content, object_hook=_drop_reference)
+            prune = False
+        else:
+            data = json_backend.loads(content)
+            prune = True
+
+        record = data.get("Record") if type(data) is dict else None
+        if headings is not None and record is not None and "Section" in record:
+            headings = set(headings)
+            record["Section"] = [section for section in record["Section"] if section.get("TOCHeading") in headings]
+        return remove_references(data) if prune else data
+
+def heading_url(url, heading):
+    """
+    Restricts a PUG View record URL to a single TOCHeading.
+
+    Args:
+        url (str): Full-record PUG View URL
+        heading (str): TOCHeading to download
+
+    Returns:
+        str: URL that only returns the heading (and the path leading to it)
+    """
+    separator = "&" if "?" in url else "?"
+    return f"{url}{separator}heading={quote_plus(heading)}"
+
+def _merge_sections(target, sections):
+    """
+    Merges a Section list into another, joining sections with the same TOCHeading.
+
+    Args:
+        target (list): Section list updated in place
+        sections (list): Sections to merge into target
+    """
+    by_heading = {section.get("TOCHeading"): section for section in target}
+    for section in sections:
+        existing = by_heading.get(section.get("TOCHeading"))
+        if existing is None:
+            target.append(section)
+            by_heading[section.get("TOCHeading")] = section
+        elif "Section" in section:
+            _merge_sections(existing.setdefault("Section", []), section["Section"])
+
+def merge_documents(documents):
+    """
+    Combines heading-scoped PUG View documents of one record.
+
+    Each scoped response holds the record header plus the path down to its
+    heading. The result has the shape of a full-record response restricted to
+    the downloaded headings, so the transforms can read it unchanged. The
+    Reference lists are dropped, as remove_references would discard them anyway.
+
+    Args:
+        documents (list): Parsed PUG View responses for the same record
+
+    Returns:
+        dict: {"Record": ...} with every downloaded section
+    """
+    merged = None
+    for document in documents:
+        record = document.get("Record", {})
+        if merged is None:
+            merged = {key: value for key, value in record.items() if key not in ("Section", "Reference")}
+            merged["Section"] = []
+        _merge_sections(merged["Section"], record.get("Section", []))
+    return {"Record": merged if merged is not None else {}}
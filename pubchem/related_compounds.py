@@ -0,0 +1,181 @@
+"""
+Related Compound Resolution
+
+Substances list the compounds they are related to as "CID n" strings. This
+module resolves them into compact compound summaries (name, formula, weight,
+InChIKey, SMILES) through PUG REST properties.
+
+Many substances point at the same few compounds, so lookups are pooled: the
+CIDs of the substances being fetched concurrently are queued together,
+deduplicated against the CIDs already resolved or in flight, and requested in
+batches. Each compound is requested once however many substances reference it.
+
+Features:
+- CID parsing of the related compound strings
+- One PUG REST property request per batch of distinct CIDs
+- In-flight deduplication shared by the concurrent fetch workers
+- Bounded memory of resolved summaries
+
+Author: Israel Neto
+Date: 2024
+"""
+
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, wait
+
+import requests
+
+from pug_rest import PROPERTY_BATCH_SIZE, fetch_properties
+
+# Summary key of every compound transform field requested, in output order
+SUMMARY_FIELDS = {
+    "molecular_formula": "molecularFormula",
+    "molecular_weight": "molecularWeight",
+    "inchi_key": "inchiKey",
+    "smiles_structure": "smilesStructure",
+}
+
+# PUG REST properties the summaries are built from
+SUMMARY_PROPERTIES = ("MolecularFormula", "MolecularWeight", "InChIKey", "SMILES")
+
+# Seconds a lookup waits for other substances to fill a batch before
+# requesting a partial one
+BATCH_LINGER = 0.05
+
+# Resolved summaries kept for later lookups
+MAX_CACHED_SUMMARIES = 100000
+
+_CID_PATTERN = re.compile(r"^(?:CID\s*)?(\d+)$")
+
+def related_cids(related_compounds):
+    """
+    Parses the CIDs out of a substance's related compound strings.
+
+    Args:
+        related_compounds (list): Strings like "CID 2244" (plain numbers are
+            accepted too)
+
+    Returns:
+        list: Distinct CIDs, in order of first appearance
+    """
+    cids = []
+    for text in related_compounds:
+        match = _CID_PATTERN.match(text.strip())
+        if match is not None:
+            cids.append(int(match.group(1)))
+    return list(dict.fromkeys(cids))
+
+def compound_summary(cid, properties):
+    """
+    Builds the compact summary of a compound.
+
+    Args:
+        cid (int): PubChem compound ID
+        properties (dict): {"title": str, "fields": {...}} from fetch_properties
+
+    Returns:
+        dict: Summary, or None if PubChem has no properties for the CID
+    """
+    if properties is None:
+        return None
+    summary = {"pubChemCID": cid, "moleculeName": properties["title"]}
+    for field, key in SUMMARY_FIELDS.items():
+        summary[key] = properties["fields"].get(field, "Unknown")
+    return summary
+
+class RelatedCompoundResolver:
+    """
+    Resolves CIDs into compound summaries in shared, deduplicated batches.
+
+    Every CID gets one Future. A lookup reuses the Future of a CID already
+    resolved, queued or in flight, and only queues the new ones. Full batches
+    are requested right away; a lookup left with queued CIDs waits briefly for
+    other lookups to fill the batch, then requests what is queued itself.
+
+    Args:
+        batch_size (int): CIDs per property request
+        linger (float): Seconds to wait for a batch to fill
+        cache (ResponseCache): Optional response cache to read through
+    """
+
+    def __init__(self, batch_size=PROPERTY_BATCH_SIZE, linger=BATCH_LINGER, cache=None):
+        self.batch_size = batch_size
+        self.linger = linger
+        self.cache = cache
+        self.requests = 0
+        self.lookups = 0
+        self._lock = threading.Lock()
+        # CID -> Future of its summary, least recently used first
+        self._futures = OrderedDict()
+        # (CID, Future) pairs waiting for a batch request
+        self._queued = []
+
+    def summaries(self, cids):
+        """
+        Returns the summaries of a substance's related compounds.
+
+        Args:
+            cids (list): PubChem compound IDs
+
+        Returns:
+            dict: CID -> summary, or None if PubChem does not know the CID
+
+        Raises:
+            requests.exceptions.RequestException: If a batch request failed
+            ValueError: If a batch response is not valid JSON
+        """
+        futures = self._enqueue(cids)
+        self._load(full_only=True)
+        waiting = [future for future in futures.values() if not future.done()]
+        if waiting:
+            wait(waiting, timeout=self.linger)
+            self._load(full_only=False)
+        return {cid: future.result() for cid, future in futures.items()}
+
+    def _enqueue(self, cids):
+        futures = {}
+        with self._lock:
+            for cid in cids:
+                self.lookups += 1
+                future = self._futures.get(cid)
+                if future is None:
+                    future = self._futures[cid] = Future()
+                    self._queued.append((cid, future))
+                    while len(self._futures) > MAX_CACHED_SUMMARIES:
+                        self._futures.popitem(last=False)
+                else:
+                    self._futures.move_to_end(cid)
+                futures[cid] = future
+        return futures
+
+    def _take_batch(self, full_only):
+        with self._lock:
+            if not self._queued or (full_only and len(self._queued) < self.batch_size):
+                return []
+            batch = self._queued[:self.batch_size]
+            del self._queued[:self.batch_size]
+            self.requests += 1
+            return batch
+
+    def _load(self, full_only):
+        """
+        Requests queued CIDs batch by batch until none (or no full batch) is left.
+        """
+        batch = self._take_batch(full_only)
+        while batch:
+            try:
+                properties = fetch_properties([cid for cid, _ in batch], self.cache, SUMMARY_PROPERTIES)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                with self._lock:
+                    # Let later lookups retry these CIDs
+                    for cid, future in batch:
+                        if self._futures.get(cid) is future:
+                            del self._futures[cid]
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for cid, future in batch:
+                    future.set_result(compound_summary(cid, properties.get(cid)))
+            batch = self._take_batch(full_only)
@@ -0,0 +1,209 @@
+"""
+PubChem Section Extractor
+
+This module extracts fields from PUG View records with a declarative mapping
+of TOCHeading paths to output fields, instead of nested if/elif chains over
+every section.
+
+A mapping is a list of (heading path, field, value extractor) entries:
+
+    [
+        ("Chemical and Physical Properties/Computed Properties/XLogP3", "xlogp3", first_number),
+        ("Names and Identifiers/Synonyms/*", "synonyms", collect_strings),
+    ]
+
+Each path is a "/" separated list of TOCHeadings ("*" matches any heading at
+that level). The value extractor receives the matched section and the current
+value of the field, and returns the new value. The mapping is compiled once
+into a tree of dicts, and each record is walked in a single pass, visiting only
+the branches the mapping uses. Sections are visited in document order, so when
+a heading appears more than once the last match wins, as before.
+
+Author: Israel Neto
+Date: 2024
+"""
+
+WILDCARD = "*"
+
+# Shared read-only defaults for the .get() chains, so that looking up a
+# missing key does not allocate a fresh list or dict on every call
+_NO_SECTIONS = ()
+_NO_INFORMATION = ({},)
+_NO_VALUE = {}
+_NO_STRINGS = ()
+_UNKNOWN = ("Unknown",)
+
+class SectionExtractor:
+    """
+    Precompiled single-pass walker over PUG View sections.
+
+    Args:
+        fields (list): (heading path, field name, value extractor) entries
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+        tree = {}
+        for path, field, extract in fields:
+            node = tree
+            headings = path.split("/")
+            for heading in headings[:-1]:
+                node = node.setdefault(heading, ([], {}))[1]
+            node.setdefault(headings[-1], ([], {}))[0].append((field, extract))
+        self._root = self._compile(tree)
+
+    def _compile(self, tree):
+        """
+        Freezes a heading tree into {heading: (handlers or None, children or None)}.
+        """
+        return {
+            heading: (tuple(handlers) or None, self._compile(children) if children else None)
+            for heading, (handlers, children) in tree.items()
+        }
+
+    def headings(self, depth=1):
+        """
+        Lists the TOCHeadings the mapping reads at a given depth.
+
+        Paths shorter than depth contribute their last heading, and wildcards
+        stop at the heading above them. Downloading only these headings
+        (see pug_view.heading_url) gives every section the mapping uses.
+
+        Args:
+            depth (int): Heading depth, 1 being the top-level sections
+
+        Returns:
+            list: Unique headings, in mapping order
+        """
+        headings = []
+        for path, _, _ in self.fields:
+            parts = path.split("/")[:depth]
+            if WILDCARD in parts:
+                parts = parts[:parts.index(WILDCARD)]
+            if parts[-1] not in headings:
+                headings.append(parts[-1])
+        return headings
+
+    def extract(self, sections, values):
+        """
+        Walks the sections once and updates values with every mapped field.
+
+        Args:
+            sections (list): Top-level "Section" list of a PUG View record
+            values (dict): Field defaults, updated in place
+
+        Returns:
+            dict: The updated values
+        """
+        self._walk(sections, self._root, values)
+        return values
+
+    def _walk(self, sections, node, values):
+        lookup = node.get
+        wildcard = lookup(WILDCARD)
+        for section in sections:
+            entry = lookup(section.get("TOCHeading"), wildcard)
+            if entry is None:
+                continue
+            handlers, children = entry
+            if handlers is not None:
+                for field, extract in handlers:
+                    values[field] = extract(section, values[field])
+            if children is not None:
+                self._walk(section.get("Section", _NO_SECTIONS), children, values)
+
+def first_string(section, current):
+    """
+    Returns the first string of the section's first Information entry.
+
+    Missing strings give "Unknown"; a missing Information entry keeps current.
+    """
+    try:
+        return section.get("Information", _NO_INFORMATION)[0].get("Value", _NO_VALUE).get("StringWithMarkup", _NO_INFORMATION)[0].get("String", "Unknown")
+    except (IndexError, TypeError):
+        return current
+
+def first_number(section, current):
+    """
+    Returns the first number of the section's first Information entry.
+
+    Missing numbers give "Unknown"; a missing Information entry keeps current.
+    """
+    try:
+        return section.get("Information", _NO_INFORMATION)[0].get("Value", _NO_VALUE).get("Number", _UNKNOWN)[0]
+    except (IndexError, TypeError):
+        return current
+
+def string_or_number(section, current):
+    """
+    Returns the first string of the section, falling back to its first number.
+    """
+    try:
+        value = section.get("Information", _NO_INFORMATION)[0].get("Value", _NO_VALUE).get("StringWithMarkup", _NO_INFORMATION)[0].get("String", "Unknown")
+    except (IndexError, TypeError):
+        return current
+    if value == "Unknown":
+        value = first_number(section, value)
+    return value
+
+def named_string(name):
+    """
+    Builds an extractor returning the first string of the last Information
+    entry called name.
+
+    Args:
+        name (str): Information "Name" to look for
+
+    Returns:
+        callable: Value extractor
+    """
+    def extract(section, current):
+        for info in section.get("Information", _NO_SECTIONS):
+            if info.get("Name") == name:
+                try:
+                    current = info.get("Value", _NO_VALUE).get("StringWithMarkup", _NO_INFORMATION)[0].get("String", "Unknown")
+                except (IndexError, TypeError):
+                    pass
+        return current
+    return extract
+
+def string_list(section, current):
+    """
+    Returns the non-empty strings of the section's first Information entry.
+    """
+    try:
+        strings = section.get("Information", _NO_INFORMATION)[0].get("Value", _NO_VALUE).get("StringWithMarkup", _NO_STRINGS)
+    except (IndexError, TypeError):
+        return current
+    return [item.get("String") for item in strings if item.get("String")]
+
+def collect_strings(section, current):
+    """
+    Appends every non-empty string of the section's Information entries to
+    the current list. Duplicates are kept; drop them once the walk is done
+    with list(dict.fromkeys(strings)), which is linear instead of quadratic.
+    """
+    for info in section.get("Information", _NO_SECTIONS):
+        if "Value" in info and "StringWithMarkup" in info["Value"]:
+            for item in info["Value"]["StringWithMarkup"]:
+                if "String" in item and item["String"] != "":
+                    current.append(item["String"])
+    return current
+
+def first_date(section, current):
+    """
+    Returns the first ISO 8601 date of the section's first Information entry.
+    """
+    try:
+        return section.get("Information", _NO_INFORMATION)[0].get("Value", _NO_VALUE).get("DateISO8601", _UNKNOWN)[0]
+    except (IndexError, TypeError):
+        return current
+
+def last_date(section, current):
+    """
+    Returns the first ISO 8601 date of the last Information entry holding one.
+    """
+    for info in section.get("Information", _NO_SECTIONS):
+        if "Value" in info and "DateISO8601" in info["Value"] and len(info["Value"]["DateISO8601"]) > 0:
+            current = info["Value"]["DateISO8601"][0]
+    return current
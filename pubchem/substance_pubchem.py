@@ -10,43 +10,191 @@ Features:
 - Removes unnecessary reference metadata
 - Extracts relevant substance information
 - Transforms data into standardized format
+- Optionally resolves related compounds into compact summaries, in shared
+  deduplicated batches
 - Saves final results to JSON
 
 Author: Israel Neto
 Date: 2024
 """
 
+import functools
+import os
+import sys
+
 import requests
-import json
 
-def remove_references(data):
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from common import http_client
+from common.fetch_engine import DEFAULT_MAX_CONCURRENCY
+from common.missing_ids import live_ids
+from common.pipeline import jsonl_path, run_pipeline
+from common.refresh_index import content_hash
+from common.response_cache import ResponseCache
+from pug_rest import PROPERTY_BATCH_SIZE, fetch_existing_ids
+from pug_view import load_record
+from related_compounds import RelatedCompoundResolver, related_cids
+from section_extractor import SectionExtractor, first_date, first_string, string_list
+
+PUG_VIEW_SUBSTANCE_URL = "https://pubchem.ncbi.nlm.nih.gov/rest/pug_view/data/substance/{}/JSON/?version=1"
+
+def fetch_substance(substance_id, cache=None, related=None):
     """
-    Removes reference metadata from the PubChem data structure.
+    Fetches a single substance record from PubChem, without its references
+    or the top-level sections the transform does not read.
     
     Args:
-        data (dict/list): Raw PubChem data structure
+        substance_id (int): PubChem substance ID
+        cache (ResponseCache): Optional response cache to read through
+        related (RelatedCompoundResolver): Optional resolver of the related
+            compounds; their summaries are added to the data under
+            "RelatedCompounds"
         
     Returns:
-        dict/list: Cleaned data structure without references
+        dict: Cleaned PubChem data, or {"error": message, "missing": bool} if
+        the request failed, "missing" telling whether PubChem answered 404
     """
-    if isinstance(data, dict):
-        if "Reference" in data:
-            del data["Reference"]
-        for key, value in data.items():
-            data[key] = remove_references(value)
-    elif isinstance(data, list):
-        data = [remove_references(item) for item in data]
+    url = PUG_VIEW_SUBSTANCE_URL.format(substance_id)
+    try:
+        data = load_record(http_client.get_content(url, cache=cache), SUBSTANCE_HEADINGS)
+        if related is not None:
+            sections = data.get("Record", {}).get("Section", [])
+            cids = related_cids(_RELATED_EXTRACTOR.extract(sections, {"related_compounds": []})["related_compounds"])
+            summaries = related.summaries(cids)
+            data["RelatedCompounds"] = [summaries[cid] for cid in cids if summaries[cid] is not None]
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"Error fetching data for substance {substance_id}: {e}")
+        return {"error": str(e), "missing": http_client.is_not_found(e)}
     return data
 
-def process_substance_data(start_id, end_id, output_file, source_type):
+# Heading paths of the PUG View substance record mapped to transform fields
+SUBSTANCE_FIELDS = [
+    ("Identity/Source", "source", first_string),
+    ("Identity/External ID", "external_id", first_string),
+    ("Identity/Source Category", "source_category", string_list),
+    ("Identity/Deposit Date", "deposit_date", first_date),
+    ("Identity/Modify Date", "modify_date", first_date),
+    ("Identity/Available Date", "available_date", first_date),
+    ("Identity/Status", "status", first_string),
+    ("Depositor Comments", "depositor_comments", string_list),
+    ("Related Records/Related Compounds", "related_compounds", string_list),
+]
+
+SUBSTANCE_EXTRACTOR = SectionExtractor(SUBSTANCE_FIELDS)
+
+# Top-level headings the transform reads; the others are dropped on load
+SUBSTANCE_HEADINGS = SUBSTANCE_EXTRACTOR.headings()
+
+# Reads only the Modify Date, to fingerprint records before transforming them
+_MODIFY_DATE_EXTRACTOR = SectionExtractor([entry for entry in SUBSTANCE_FIELDS if entry[1] == "modify_date"])
+
+# Reads only the Related Compounds, to resolve them while fetching
+_RELATED_EXTRACTOR = SectionExtractor([entry for entry in SUBSTANCE_FIELDS if entry[1] == "related_compounds"])
+
+def _substance_defaults():
+    """
+    Returns the default value of every extracted substance field.
+    """
+    values = {field: "Unknown" for _, field, _ in SUBSTANCE_FIELDS}
+    values["source_category"] = []
+    values["depositor_comments"] = []
+    values["related_compounds"] = []
+    return values
+
+def transform_substance(substance_id, substance_data, source_type):
+    """
+    Transforms a cleaned PubChem substance record into the standardized format.
+    
+    Args:
+        substance_id (int): PubChem substance ID
+        substance_data (dict): Cleaned PubChem data returned by fetch_substance,
+            optionally with related compound summaries under "RelatedCompounds"
+        source_type (str): Type identifier for the data source
+        
+    Returns:
+        dict: Transformed substance, or None if the payload holds no Record
+    """
+    if "Record" not in substance_data:
+        return None
+
+    record = substance_data["Record"]
+    molecule_name = record.get("RecordTitle", "Unknown")
+    record_number = record.get("RecordNumber", "Unknown")
+    record_type = record.get("RecordType", "Unknown")
+    
+    values = SUBSTANCE_EXTRACTOR.extract(record.get("Section", []), _substance_defaults())
+
+    transformed_item = {
+        "type": source_type,
+        "place_loc": "pubchem",
+        "moleculeName": molecule_name,
+        "recordNumber": record_number,
+        "recordType": record_type,
+        "externalId": values["external_id"],
+        "source": values["source"],
+        "sourceCategory": values["source_category"],
+        "depositDate": values["deposit_date"],
+        "modifyDate": values["modify_date"],
+        "availableDate": values["available_date"],
+        "status": values["status"],
+        "depositorComments": values["depositor_comments"],
+        "relatedCompounds": values["related_compounds"]
+    }
+    if "RelatedCompounds" in substance_data:
+        transformed_item["relatedCompoundSummaries"] = substance_data["RelatedCompounds"]
+    return transformed_item
+
+def fingerprint_substance(substance_id, substance_data):
+    """
+    Fingerprints a fetched substance for incremental refreshes.
+    
+    Args:
+        substance_id (int): PubChem substance ID
+        substance_data (dict): Cleaned PubChem data returned by fetch_substance
+        
+    Returns:
+        tuple: (Modify Date, content hash)
+    """
+    sections = substance_data.get("Record", {}).get("Section", [])
+    modify_date = _MODIFY_DATE_EXTRACTOR.extract(sections, {"modify_date": "Unknown"})["modify_date"]
+    return modify_date, content_hash(substance_data)
+
+def process_substance_data(start_id, end_id, output_file, source_type, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                            cache=None, resume=False, json_array=True, compact=False, transform_workers=0,
+                            refresh_index=None, resolve_related=False, batch_size=PROPERTY_BATCH_SIZE,
+                            missing_ids=None, check_existence=False, shard_writer=None):
     """
     Processes substance data from PubChem for a range of substance IDs.
     
     Args:
         start_id (int): Starting substance ID
         end_id (int): Ending substance ID
-        output_file (str): Path to output JSON file
+        output_file (str): Path to output JSON file; records are streamed to
+            the same path with a .jsonl extension
         source_type (str): Type identifier for the data source
+        max_concurrency (int): Maximum number of requests in flight at once
+        cache (ResponseCache): Optional response cache to read through
+        resume (bool): Continue the run journaled in output_file + ".journal"
+            instead of starting over; failed IDs are retried
+        json_array (bool): Also write the records as one JSON array to output_file
+        compact (bool): Write compact JSON with the fast JSON backend instead of
+            the indented format
+        transform_workers (int): Worker processes transforming records in
+            parallel, output staying in ID order (0 transforms them serially)
+        refresh_index (RefreshIndex): Fingerprints of previous runs; when given,
+            only new and changed substances are transformed and written, so the
+            output is a delta
+        resolve_related (bool): Resolve the related compounds into compact
+            summaries, fetching each distinct CID once in PUG REST batches
+        batch_size (int): CIDs per PUG REST property request
+        missing_ids (MissingIdCache): Negative cache of missing SIDs; known
+            missing SIDs are not requested and new 404s are added to it
+        check_existence (bool): Check which SIDs exist with bulk PUG REST
+            queries first, so only live SIDs are fetched one by one
+        shard_writer (ShardedWriter): Write the substances as compressed JSON
+            Lines shards with a manifest instead of the .jsonl file (json_array
+            must then be False)
         
     Output fields:
         - type: Data type identifier
@@ -63,92 +211,39 @@ def process_substance_data(start_id, end_id, output_file, source_type):
         - status: Record status
         - depositorComments: Depositor comments
         - relatedCompounds: Related compound information
+        - relatedCompoundSummaries: CID, name, formula, weight, InChIKey and
+          SMILES of the related compounds (with resolve_related only)
+        
+    Returns:
+        dict: Counts of written, skipped and failed IDs (see run_pipeline)
     """
-    # Fetch data
-    results = {}
-    for substance_id in range(start_id, end_id + 1):
-        url = f"https://pubchem.ncbi.nlm.nih.gov/rest/pug_view/data/substance/{substance_id}/JSON/?version=1"
-        try:
-            response = requests.get(url)
-            response.raise_for_status()
-            data = response.json()
-            processed_data = remove_references(data)
-            results[substance_id] = processed_data
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching data for substance {substance_id}: {e}")
-            results[substance_id] = {"error": str(e)}
-
-    # Transform data
-    transformed_data = []
-    for substance_id, substance_data in results.items():
-        if "Record" in substance_data:
-            record = substance_data["Record"]
-            molecule_name = record.get("RecordTitle", "Unknown")
-            record_number = record.get("RecordNumber", "Unknown")
-            record_type = record.get("RecordType", "Unknown")
-            
-            sections = record.get("Section", [])
-            external_id = "Unknown"
-            source = "Unknown"
-            source_category = []
-            deposit_date = "Unknown"
-            modify_date = "Unknown"
-            available_date = "Unknown"
-            status = "Unknown"
-            depositor_comments = []
-            related_compounds = []
-            
-            for section in sections:
-                if section.get("TOCHeading") == "Identity":
-                    for subsection in section.get("Section", []):
-                        if subsection.get("TOCHeading") == "Source":
-                            source = subsection.get("Information", [{}])[0].get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "Unknown")
-                        elif subsection.get("TOCHeading") == "External ID":
-                            external_id = subsection.get("Information", [{}])[0].get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "Unknown")
-                        elif subsection.get("TOCHeading") == "Source Category":
-                            categories = subsection.get("Information", [{}])[0].get("Value", {}).get("StringWithMarkup", [])
-                            source_category = [cat.get("String") for cat in categories if cat.get("String")]
-                        elif subsection.get("TOCHeading") == "Deposit Date":
-                            deposit_date = subsection.get("Information", [{}])[0].get("Value", {}).get("DateISO8601", ["Unknown"])[0]
-                        elif subsection.get("TOCHeading") == "Modify Date":
-                            modify_date = subsection.get("Information", [{}])[0].get("Value", {}).get("DateISO8601", ["Unknown"])[0]
-                        elif subsection.get("TOCHeading") == "Available Date":
-                            available_date = subsection.get("Information", [{}])[0].get("Value", {}).get("DateISO8601", ["Unknown"])[0]
-                        elif subsection.get("TOCHeading") == "Status":
-                            status = subsection.get("Information", [{}])[0].get("Value", {}).get("StringWithMarkup", [{}])[0].get("String", "Unknown")
-
-                elif section.get("TOCHeading") == "Depositor Comments":
-                    comments = section.get("Information", [{}])[0].get("Value", {}).get("StringWithMarkup", [])
-                    depositor_comments = [comment.get("String") for comment in comments if comment.get("String")]
-
-                elif section.get("TOCHeading") == "Related Records":
-                    for subsection in section.get("Section", []):
-                        if subsection.get("TOCHeading") == "Related Compounds":
-                            compounds = subsection.get("Information", [{}])[0].get("Value", {}).get("StringWithMarkup", [])
-                            related_compounds = [comp.get("String") for comp in compounds if comp.get("String")]
-
-            transformed_item = {
-                "type": source_type,
-                "place_loc": "pubchem",
-                "moleculeName": molecule_name,
-                "recordNumber": record_number,
-                "recordType": record_type,
-                "externalId": external_id,
-                "source": source,
-                "sourceCategory": source_category,
-                "depositDate": deposit_date,
-                "modifyDate": modify_date,
-                "availableDate": available_date,
-                "status": status,
-                "depositorComments": depositor_comments,
-                "relatedCompounds": related_compounds
-            }
-            transformed_data.append(transformed_item)
-
-    # Save final result
-    with open(output_file, "w") as json_file:
-        json.dump(transformed_data, json_file, indent=4)
-    print(f"Final substance data saved to {output_file}")
+    related = RelatedCompoundResolver(batch_size, cache=cache) if resolve_related else None
+    fetch_one = functools.partial(fetch_substance, cache=cache, related=related)
+    transform_one = functools.partial(transform_substance, source_type=source_type)
+    ids = range(start_id, end_id + 1)
+    if missing_ids is not None or check_existence:
+        check_batch = functools.partial(fetch_existing_ids, "substance", cache=cache) if check_existence else None
+        ids = live_ids(ids, missing_ids, check_batch, max_concurrency=max_concurrency)
+        print(f"{end_id - start_id + 1 - len(ids)} missing substance IDs skipped")
+    counts = run_pipeline(ids, fetch_one, transform_one, output_file,
+                          max_concurrency, resume=resume, json_array=json_array, compact=compact,
+                          transform_workers=transform_workers, refresh_index=refresh_index,
+                          fingerprint_one=fingerprint_substance, missing_ids=missing_ids,
+                          shard_writer=shard_writer)
+
+    destination = shard_writer.directory if shard_writer is not None else jsonl_path(output_file)
+    print(f"{counts['written']} substances streamed to {destination} ({counts['failed']} failed)")
+    if missing_ids is not None:
+        print(f"{counts['missing']} newly missing substance IDs recorded")
+    if related is not None:
+        print(f"{related.lookups} related compound lookups resolved with {related.requests} PUG REST requests")
+    if refresh_index is not None:
+        print(f"{counts['unchanged']} unchanged substances skipped")
+    if json_array:
+        print(f"Final substance data saved to {output_file}")
+    if shard_writer is not None:
+        print(f"{len(shard_writer.shards)} substance shards saved to {shard_writer.directory}")
+    return counts
 
 if __name__ == "__main__":
-    process_substance_data(1, 5, "final_pubchem_substance_data.json", "substance")
+    process_substance_data(1, 5, "final_pubchem_substance_data.json", "substance", cache=ResponseCache())